@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import math
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 from langchain_community.document_loaders import DirectoryLoader
 
 from openai import AzureOpenAI
@@ -19,13 +24,15 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 # LangChain Core (prompt/chain)
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
 # Chat model init (provider-agnostic, qui puntiamo a LM Studio via OpenAI-compatible)
 from langchain.chat_models import init_chat_model
 from dotenv import load_dotenv
 
+import pandas as pd
 from ragas import evaluate, EvaluationDataset
+from ragas.run_config import RunConfig
 from ragas.metrics import (
     context_precision,   # "precision@k" sui chunk recuperati
     context_recall,      # copertura dei chunk rilevanti
@@ -56,6 +63,10 @@ class Settings:
     hf_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
     # LM Studio (OpenAI-compatible)
     lmstudio_model_env: str = "LMSTUDIO_MODEL"  # nome del modello in LM Studio, via env var
+    # Valutazione Ragas
+    eval_cache_path: str = "ragas_cache.sqlite"  # punteggi per (metrica, riga, giudice)
+    eval_max_concurrency: int = 2   # metriche valutate in parallelo
+    eval_max_workers: int = 8       # chiamate LLM in volo per ogni metrica
 
 
 
@@ -231,9 +242,9 @@ def format_docs_for_prompt(docs: List[Document]) -> str:
     return "\n\n".join(lines)
 
 
-def build_rag_chain(llm, retriever):
+def build_rag_prompt() -> ChatPromptTemplate:
     """
-    Costruisce la catena RAG (retrieval -> prompt -> LLM) con citazioni e regole anti-hallucination.
+    Prompt RAG con citazioni e regole anti-hallucination (variabili: question, context).
     """
     system_prompt = (
         "Sei un assistente esperto. Rispondi in italiano. "
@@ -254,20 +265,47 @@ def build_rag_chain(llm, retriever):
          "3) Se la risposta non è nel contesto, scrivi: 'Non è presente nel contesto fornito.'"
          "4) Non contraddire assolutamente il CONTENUTO fornito nel contesto.")
     ])
+    return prompt
+
 
+def build_rag_chain(llm, retriever):
+    """
+    Costruisce la catena RAG (retrieval -> prompt -> LLM) con citazioni e regole anti-hallucination.
+    """
     # LCEL: dict -> prompt -> llm -> parser
     chain = (
         {
             "context": retriever | format_docs_for_prompt,
             "question": RunnablePassthrough(),
         }
-        | prompt
+        | build_rag_prompt()
         | llm
         | StrOutputParser()
     )
     return chain
 
 
+def build_rag_chain_with_sources(llm, retriever):
+    """
+    Come build_rag_chain, ma restituisce anche i documenti recuperati:
+    {"question", "docs", "answer"}. Il retrieval avviene una sola volta,
+    quindi i contesti sono esattamente quelli passati all'LLM.
+    """
+    generation = (
+        RunnableLambda(lambda x: {
+            "context": format_docs_for_prompt(x["docs"]),
+            "question": x["question"],
+        })
+        | build_rag_prompt()
+        | llm
+        | StrOutputParser()
+    )
+    return RunnableParallel(
+        docs=retriever,
+        question=RunnablePassthrough(),
+    ).assign(answer=generation)
+
+
 def rag_answer(question: str, chain) -> str:
     """
     Esegue la catena RAG per una singola domanda.
@@ -275,11 +313,6 @@ def rag_answer(question: str, chain) -> str:
     return chain.invoke(question)
 
 
-def get_contexts_for_question(retriever, question: str, k: int) -> List[str]:
-    """Ritorna i testi dei top-k documenti (chunk) usati come contesto."""
-    docs = docs = retriever.invoke(question)[:k]
-    return [d.page_content for d in docs]
-
 def build_ragas_dataset(
     questions: List[str],
     retriever,
@@ -290,16 +323,24 @@ def build_ragas_dataset(
     """
     Esegue la pipeline RAG per ogni domanda e costruisce il dataset per Ragas.
     Ogni riga contiene: question, contexts, answer, (opzionale) ground_truth.
+
+    Con una catena di build_rag_chain_with_sources ogni domanda viene recuperata
+    una sola volta e i contesti sono quelli usati per la risposta. Una catena che
+    restituisce solo la stringa (build_rag_chain) è ancora accettata: i contesti
+    vengono allora letti da `retriever`, con un secondo retrieval per domanda.
     """
     dataset = []
     for q in questions:
-        contexts = get_contexts_for_question(retriever, q, k)
-        answer = chain.invoke(q)
+        result = chain.invoke(q)
+        if isinstance(result, dict):
+            docs, answer = result["docs"], result["answer"]
+        else:
+            docs, answer = retriever.invoke(q), result
 
         row = {
             # chiavi richieste da molte metriche Ragas
             "user_input": q,
-            "retrieved_contexts": contexts,
+            "retrieved_contexts": [d.page_content for d in docs[:k]],
             "response": answer,
         }
         if ground_truth and q in ground_truth:
@@ -309,6 +350,127 @@ def build_ragas_dataset(
     return dataset
 
 
+# =========================
+# Valutazione con cache dei punteggi
+# =========================
+
+def row_hash(row: dict) -> str:
+    """
+    Hash stabile di una riga del dataset (domanda, contesti, risposta, riferimento).
+    Cambia se cambia uno qualsiasi dei campi valutati dalle metriche.
+    """
+    payload = json.dumps(row, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def judge_id() -> str:
+    """
+    Identifica i modelli giudice: un cambio di deployment invalida i punteggi in cache.
+    """
+    return f"{os.getenv('CHAT_DEPLOYMENT')}|{os.getenv('EMBEDDING_DEPLOYMENT')}"
+
+
+class ScoreCache:
+    """
+    Cache su disco (SQLite) dei punteggi Ragas per (metrica, hash della riga, giudice).
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " metric TEXT, row_hash TEXT, judge TEXT, score REAL,"
+            " PRIMARY KEY (metric, row_hash, judge))"
+        )
+        self.conn.commit()
+
+    def get_many(self, metric: str, judge: str, hashes: List[str]) -> Dict[str, float]:
+        if not hashes:
+            return {}
+        rows = self.conn.execute(
+            "SELECT row_hash, score FROM scores WHERE metric = ? AND judge = ?"
+            f" AND row_hash IN ({','.join('?' * len(hashes))})",
+            (metric, judge, *hashes),
+        ).fetchall()
+        return dict(rows)
+
+    def put_many(self, metric: str, judge: str, scores: Dict[str, float]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scores (metric, row_hash, judge, score) VALUES (?, ?, ?, ?)",
+            [(metric, h, judge, score) for h, score in scores.items()],
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def evaluate_with_cache(
+    dataset: List[dict],
+    metrics: list,
+    llm,
+    embeddings,
+    settings: Settings,
+    judge: str | None = None,
+) -> pd.DataFrame:
+    """
+    Valuta il dataset con Ragas ricalcolando solo le righe nuove o modificate.
+
+    Per ogni metrica le righe gia' valutate (stesso hash e stesso giudice) sono
+    lette dalla cache; le altre sono valutate con una sola chiamata a `evaluate`
+    per metrica, con al piu' `eval_max_concurrency` metriche in parallelo.
+    I punteggi NaN (giudice fallito) non sono salvati e verranno ritentati.
+    Restituisce lo stesso formato di `ragas_result.to_pandas()`.
+    """
+    judge = judge or judge_id()
+    hashes = [row_hash(row) for row in dataset]
+    cache = ScoreCache(settings.eval_cache_path)
+
+    scores: Dict[str, Dict[str, float]] = {}
+    pending = []
+    for metric in metrics:
+        scores[metric.name] = cache.get_many(metric.name, judge, hashes)
+        # Righe identiche vengono valutate una sola volta
+        missing = sorted({h: i for i, h in enumerate(hashes) if h not in scores[metric.name]}.values())
+        if missing:
+            pending.append((metric, missing))
+
+    def _score(metric, indices: List[int]) -> List[float]:
+        result = evaluate(
+            dataset=EvaluationDataset.from_list([dataset[i] for i in indices]),
+            metrics=[metric],
+            llm=llm,
+            embeddings=embeddings,
+            run_config=RunConfig(max_workers=settings.eval_max_workers),
+            show_progress=False,
+        )
+        return result.to_pandas()[metric.name].tolist()
+
+    cached = sum(len(s) for s in scores.values())
+    rescored = sum(len(indices) for _, indices in pending)
+    print(f"Ragas: {cached} punteggi dalla cache, {rescored} da calcolare")
+
+    try:
+        with ThreadPoolExecutor(max_workers=settings.eval_max_concurrency) as pool:
+            futures = {pool.submit(_score, metric, indices): (metric, indices) for metric, indices in pending}
+            for future in as_completed(futures):
+                metric, indices = futures[future]
+                new = {
+                    hashes[i]: float(value)
+                    for i, value in zip(indices, future.result())
+                    if value is not None and not math.isnan(value)
+                }
+                cache.put_many(metric.name, judge, new)
+                scores[metric.name].update(new)
+    finally:
+        cache.close()
+
+    df = pd.DataFrame(dataset)
+    for metric in metrics:
+        df[metric.name] = [scores[metric.name].get(h, float("nan")) for h in hashes]
+    return df
+
+
 # =========================
 # Esecuzione dimostrativa
 # =========================
@@ -355,31 +517,31 @@ def main():
     }
 
     # 6) Costruisci dataset per Ragas (stessi top-k del tuo retriever)
+    # (una sola chiamata al retriever per domanda: la catena restituisce anche i documenti)
     dataset = build_ragas_dataset(
         questions=questions,
         retriever=retriever,
-        chain=chain,
+        chain=build_rag_chain_with_sources(llm, retriever),
         k=settings.k,
         ground_truth=ground_truth,  # rimuovi se non vuoi correctness
     )
 
-    evaluation_dataset = EvaluationDataset.from_list(dataset)
-
     # 7) Scegli le metriche
     metrics = [context_precision, context_recall, faithfulness, answer_relevancy]
     # Aggiungi correctness solo se tutte le righe hanno ground_truth
     if all("ground_truth" in row for row in dataset):
         metrics.append(answer_correctness)
 
-    # 8) Esegui la valutazione con il TUO LLM e le TUE embeddings
-    ragas_result = evaluate(
-        dataset=evaluation_dataset,
+    # 8) Esegui la valutazione con il TUO LLM e le TUE embeddings:
+    #    solo le righe nuove o cambiate vengono ricalcolate, le altre arrivano dalla cache
+    df = evaluate_with_cache(
+        dataset=dataset,
         metrics=metrics,
         llm=llm,                 # passa l'istanza LangChain del tuo LLM (LM Studio)
         embeddings=get_embeddings(settings),  # o riusa 'embeddings' creato sopra
+        settings=settings,
     )
 
-    df = ragas_result.to_pandas()
     cols = ["user_input", "response", "context_precision", "context_recall", "faithfulness", "answer_relevancy"]
     print("\n=== DETTAGLIO PER ESEMPIO ===")
     print(df[cols].round(4).to_string(index=False))
@@ -0,0 +1,71 @@
+"""Incremental context of the sections already written, under a token budget"""
+from typing import List
+
+from pydantic import BaseModel, Field
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # tokenizer of gpt-4o
+except Exception:  # tiktoken missing or encoding not downloadable
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the gpt-4o tokenizer, or estimate them (4 chars per token)"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+class SectionSummary(BaseModel):
+    summary: str = Field(description="2-4 sentences on what the section covers and concludes")
+    key_terms: List[str] = Field(description="Terms and concepts the section introduces or defines")
+
+
+class SectionRecord(BaseModel):
+    title: str
+    summary: str
+    key_terms: List[str] = []
+
+
+class SectionContextStore(BaseModel):
+    """Compact summaries of the written sections, rendered for the next section.
+
+    Each section is recorded once, so building the context costs O(n) tokens
+    over the whole guide instead of re-sending the full text of every
+    previous section. When the budget is tight, older sections degrade from
+    summary to key terms to title only; the most recent ones keep the most detail.
+    """
+
+    records: List[SectionRecord] = []
+
+    def add(self, title: str, summary: SectionSummary) -> None:
+        """Record a completed section"""
+        self.records.append(SectionRecord(title=title, summary=summary.summary, key_terms=summary.key_terms))
+
+    def render(self, max_tokens: int) -> str:
+        """Context for the next section, at most max_tokens tokens"""
+        if not self.records:
+            return "No previous sections written yet."
+
+        header = "# Previously Written Sections (summaries)\n"
+        budget = max_tokens - count_tokens(header)
+        entries = []
+        # Newest first: the sections closest to the next one get the most detail
+        for record in reversed(self.records):
+            terms = ", ".join(record.key_terms)
+            candidates = [
+                f"## {record.title}\n{record.summary}\nKey terms: {terms}\n",
+                f"## {record.title}\nKey terms: {terms}\n",
+                f"## {record.title}\n",
+            ]
+            for candidate in candidates:
+                tokens = count_tokens(candidate)
+                if tokens <= budget:
+                    entries.append(candidate)
+                    budget -= tokens
+                    break
+            else:
+                break
+
+        return header + "\n".join(reversed(entries))
@@ -1,10 +1,12 @@
 #!/usr/bin/env python
+import asyncio
 import json
 import os
 from typing import List, Dict
 from pydantic import BaseModel, Field
 from crewai import LLM
 from crewai.flow.flow import Flow, listen, start
+from guide_creator_flow.context_store import SectionContextStore, SectionSummary, count_tokens
 from guide_creator_flow.crews.content_crew.content_crew import ContentCrew
 
 # Define our models for structured data
@@ -19,12 +21,28 @@ class GuideOutline(BaseModel):
     sections: List[Section] = Field(description="List of sections in the guide")
     conclusion: str = Field(description="Conclusion or summary of the guide")
 
+class ConsistencyEdit(BaseModel):
+    section_title: str = Field(description="Title of the section to edit")
+    original: str = Field(description="Exact passage to replace, copied verbatim from the section")
+    replacement: str = Field(description="Corrected passage")
+
+class ConsistencyReport(BaseModel):
+    edits: List[ConsistencyEdit] = Field(description="Small edits that make the sections consistent")
+
 # Define our flow state
 class GuideCreatorState(BaseModel):
     topic: str = ""
     audience_level: str = ""
     guide_outline: GuideOutline = None
     sections_content: Dict[str, str] = {}
+    # Draft sections concurrently from the outline, then run a consistency pass
+    parallel_sections: bool = True
+    max_concurrent_sections: int = 3
+    # Sequential mode: summaries of the previous sections passed to the next one
+    context_store: SectionContextStore = SectionContextStore()
+    context_token_budget: int = 1500
+    # Prompt tokens used by the content crew, per section
+    prompt_tokens: Dict[str, int] = {}
 
 class GuideCreatorFlow(Flow[GuideCreatorState]):
     """Flow for creating a comprehensive guide on any topic"""
@@ -90,38 +108,19 @@ class GuideCreatorFlow(Flow[GuideCreatorState]):
         return self.state.guide_outline
 
     @listen(create_guide_outline)
-    def write_and_compile_guide(self, outline):
+    async def write_and_compile_guide(self, outline):
         """Write all sections and compile the guide"""
         print("Writing guide sections and compiling...")
-        completed_sections = []
-
-        # Process sections one by one to maintain context flow
-        for section in outline.sections:
-            print(f"Processing section: {section.title}")
 
-            # Build context from previous sections
-            previous_sections_text = ""
-            if completed_sections:
-                previous_sections_text = "# Previously Written Sections\n\n"
-                for title in completed_sections:
-                    previous_sections_text += f"## {title}\n\n"
-                    previous_sections_text += self.state.sections_content.get(title, "") + "\n\n"
-            else:
-                previous_sections_text = "No previous sections written yet."
+        if self.state.parallel_sections:
+            await self.write_sections_parallel(outline)
+            # Blocking LLM calls run in a worker thread, off the flow's event loop
+            await asyncio.to_thread(self.review_consistency, outline)
+        else:
+            await asyncio.to_thread(self.write_sections_sequential, outline)
 
-            # Run the content crew for this section
-            result = ContentCrew().crew().kickoff(inputs={
-                "section_title": section.title,
-                "section_description": section.description,
-                "audience_level": self.state.audience_level,
-                "previous_sections": previous_sections_text,
-                "draft_content": ""
-            })
-
-            # Store the content
-            self.state.sections_content[section.title] = result.raw
-            completed_sections.append(section.title)
-            print(f"Section completed: {section.title}")
+        total = sum(self.state.prompt_tokens.values())
+        print(f"Prompt tokens for {len(self.state.prompt_tokens)} sections: {total}")
 
         # Compile the final guide
         guide_content = f"# {outline.title}\n\n"
@@ -142,6 +141,145 @@ class GuideCreatorFlow(Flow[GuideCreatorState]):
         print("\nComplete guide compiled and saved to output/complete_guide.md")
         return "Guide creation completed successfully"
 
+    def section_inputs(self, section, previous_sections):
+        """Inputs of the content crew for one section"""
+        return {
+            "section_title": section.title,
+            "section_description": section.description,
+            "audience_level": self.state.audience_level,
+            "previous_sections": previous_sections,
+        }
+
+    def record_usage(self, section, result, previous_sections):
+        """Store and log the prompt tokens of a section's crew run"""
+        usage = getattr(result, "token_usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        self.state.prompt_tokens[section.title] = prompt_tokens
+        print(
+            f"Section completed: {section.title} "
+            f"(context {count_tokens(previous_sections)} tokens, crew prompt {prompt_tokens} tokens)"
+        )
+
+    def summarize_section(self, section, content):
+        """Compact summary and key terms of a written section"""
+        llm = LLM(model="azure/gpt-4o", response_format=SectionSummary)
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant designed to output JSON."},
+            {"role": "user", "content": f"""
+            Summarize the guide section "{section.title}" for the writers of the next sections.
+            Give what it covers and concludes in 2-4 sentences, and list the terms it defines,
+            so they are not explained again.
+
+            {content}
+            """}
+        ]
+        return SectionSummary(**json.loads(llm.call(messages=messages)))
+
+    def write_sections_sequential(self, outline):
+        """Write sections one by one, each seeing summaries of the previous ones"""
+        store = self.state.context_store
+
+        # Process sections one by one to maintain context flow
+        for section in outline.sections:
+            print(f"Processing section: {section.title}")
+
+            # Summaries of the previous sections, within the token budget
+            previous_sections_text = store.render(self.state.context_token_budget)
+
+            # Run the content crew for this section
+            result = ContentCrew().crew().kickoff(inputs=self.section_inputs(section, previous_sections_text))
+
+            # Store the content and its summary for the next sections
+            self.state.sections_content[section.title] = result.raw
+            store.add(section.title, self.summarize_section(section, result.raw))
+            self.record_usage(section, result, previous_sections_text)
+
+    async def write_sections_parallel(self, outline):
+        """Draft all sections concurrently, at most max_concurrent_sections at a time"""
+        semaphore = asyncio.Semaphore(max(1, self.state.max_concurrent_sections))
+
+        async def write_section(index, section):
+            async with semaphore:
+                print(f"Processing section: {section.title}")
+                # A new crew per section: crews and agents keep per-run state
+                context = sibling_context(outline, index)
+                result = await ContentCrew().crew().kickoff_async(inputs=self.section_inputs(section, context))
+                self.record_usage(section, result, context)
+                return result.raw
+
+        # gather returns results in submission order, so the outline order is kept
+        contents = await asyncio.gather(
+            *(write_section(index, section) for index, section in enumerate(outline.sections))
+        )
+        for section, content in zip(outline.sections, contents):
+            self.state.sections_content[section.title] = content
+
+    def review_consistency(self, outline):
+        """Align terminology and remove contradictions across independently drafted sections.
+
+        The LLM returns a short list of passage replacements instead of rewriting
+        the guide, so the pass costs one read of the guide and a small output.
+        Edits whose passage is not found verbatim are skipped.
+        """
+        print("Running consistency pass...")
+        llm = LLM(model="azure/gpt-4o", response_format=ConsistencyReport)
+
+        sections_text = ""
+        for section in outline.sections:
+            sections_text += f"=== {section.title} ===\n"
+            sections_text += self.state.sections_content.get(section.title, "") + "\n\n"
+
+        messages = [
+            {"role": "system", "content": "You are a meticulous technical editor designed to output JSON."},
+            {"role": "user", "content": f"""
+            The sections below belong to the guide "{outline.title}" for {self.state.audience_level} level learners.
+            They were written in parallel, so each author did not see the others' text.
+
+            Find only real inconsistencies between sections:
+            1. The same concept named or defined differently
+            2. Contradicting statements or recommendations
+            3. A concept explained in full in more than one section (keep the first, shorten the others)
+            4. References to sections that do not exist
+
+            Return at most 10 small edits. Copy each "original" passage verbatim from its section.
+            Return an empty list if the sections are already consistent.
+
+            {sections_text}
+            """}
+        ]
+
+        report = ConsistencyReport(**json.loads(llm.call(messages=messages)))
+
+        applied = 0
+        for edit in report.edits:
+            content = self.state.sections_content.get(edit.section_title)
+            if content is None or not edit.original or edit.original not in content:
+                continue
+            self.state.sections_content[edit.section_title] = content.replace(edit.original, edit.replacement, 1)
+            applied += 1
+        print(f"Consistency pass: {applied} of {len(report.edits)} edits applied")
+
+def sibling_context(outline, index, max_description_chars=200):
+    """Context for a section drafted in parallel: the guide plan with short sibling summaries"""
+    lines = [
+        f"# Guide: {outline.title}",
+        f"Target audience: {outline.target_audience}",
+        "",
+        "The other sections are written at the same time by other writers.",
+        "Stay within your section and do not repeat the topics listed for the others.",
+        "",
+        "## Sections of the guide",
+    ]
+    for position, sibling in enumerate(outline.sections):
+        if position == index:
+            lines.append(f"{position + 1}. {sibling.title} (this section)")
+            continue
+        description = sibling.description
+        if len(description) > max_description_chars:
+            description = description[:max_description_chars].rsplit(" ", 1)[0] + "..."
+        lines.append(f"{position + 1}. {sibling.title}: {description}")
+    return "\n".join(lines)
+
 def kickoff():
     """Run the guide creator flow"""
     GuideCreatorFlow().kickoff()
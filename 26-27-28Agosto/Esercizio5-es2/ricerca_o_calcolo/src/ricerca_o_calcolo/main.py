@@ -1,14 +1,58 @@
 #!/usr/bin/env python
 import json
+import os
+import time
 from random import randint
 
+import httpx
+import litellm
+import openai
 from pydantic import BaseModel, Field
 
 from crewai.flow import Flow, listen, start, router, or_
-from crewai import LLM
+from crewai import LLM, Crew
 
 from ricerca_o_calcolo.crews.search_summarize.search_summarize import SearchSummarizeCrew
 from ricerca_o_calcolo.crews.sum.sum import SumCrew
+from ricerca_o_calcolo.tools.arithmetic import evaluate
+from ricerca_o_calcolo.tools.intent_router import IntentRouter, IntentRule
+
+# Fast path of the menu classifier: rules fire only when they agree on one label
+INTENT_RULES = [
+    IntentRule("Uscita", r"^\W*(esci|uscita|exit|quit|bye|basta|fine|stop)\W*$"),
+    # Inputs that merely contain numbers ("eventi del 12 maggio 2024") are left to the centroid/LLM tiers
+    IntentRule("Somma", r"\bsomm\w*|\baddizion\w*|\bsum\b|\d\s*\+\s*\d"),
+    IntentRule("Ricerca", r"\b(ricerca\w*|cerca\w*|search|web|internet|google)\b"),
+    IntentRule("Richiedi", r"^\W*$"),
+]
+
+# Example utterances for the nearest-centroid tier
+INTENT_EXAMPLES = {
+    "Ricerca": [
+        "Voglio cercare qualcosa online",
+        "Fammi una ricerca sul web",
+        "Trova informazioni su un argomento",
+        "Vorrei sapere le ultime notizie",
+        "Cerca su internet",
+        "Mi serve un'informazione",
+    ],
+    "Somma": [
+        "Voglio sommare dei numeri",
+        "Fai un calcolo",
+        "Addiziona due valori",
+        "Quanto fa tre piu' cinque?",
+        "Mi serve fare un conto",
+        "Calcola il totale",
+    ],
+}
+
+# Cache of the example centroids (recomputed when examples or model change)
+INTENT_CACHE_PATH = "intent_centroids.npz"
+
+
+def azure_embed(texts, client=None):
+    response = litellm.embedding(model=f"azure/{os.getenv('EMBEDDING_DEPLOYMENT')}", input=texts, client=client)
+    return [item["embedding"] for item in response.data]
 
 class LLMResponseNumbers(BaseModel):
     numbers: list[int] = Field(description="List of numbers to sum")
@@ -21,19 +65,92 @@ class SearchState(BaseModel):
     task: str = ""
     response: LLMResponseTask = None
     numbers: LLMResponseNumbers = None
+    sum_result: str = ""
+
+
+def pooled_azure_client(max_connections=20):
+    # One keep-alive pool, passed per call (client=) to the LLMs of a single flow:
+    # LiteLLM's global session and the SDK request timeouts are left untouched
+    return openai.AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_API_BASE"),
+        api_key=os.getenv("AZURE_API_KEY"),
+        api_version=os.getenv("AZURE_API_VERSION", "2024-02-01"),
+        http_client=openai.DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        ),
+    )
+
+
+def use_client(crew: Crew, client) -> Crew:
+    # Agents get their LLM from agents.yaml: rebuild it with the flow's client
+    for agent in crew.agents:
+        agent.llm = LLM(model=agent.llm.model, client=client)
+    return crew
+
+
+def reset_crew(crew: Crew) -> Crew:
+    # Clear per-run state only: kickoff re-interpolates the task templates itself
+    for task in crew.tasks:
+        task.output = None
+    for agent in crew.agents:
+        agent.tools_results = []
+    return crew
 
 
 class RicercaOCalcoloFlow(Flow[SearchState]):
 
-    @start("restart_flow")
-    def init_menu(self):
+    def kickoff(self, *args, **kwargs):
+        try:
+            return super().kickoff(*args, **kwargs)
+        finally:
+            self.close()
 
-        question = "Vuoi fare una ricerca web o una somma?"
-        user_response = input(question)
+    def close(self):
+        # Close the pooled client; LLMs and crews are rebuilt on next use
+        cache = self.__dict__.pop("_reused_objects", {})
+        if "azure_client" in cache:
+            cache["azure_client"].close()
+
+    # LLMs and crews are built on first use and reused on every restart_flow loop.
+    # Plain methods, not properties: Flow.__init__ reads every attribute while registering methods
+    def _reused(self, name, factory):
+        cache = self.__dict__.setdefault("_reused_objects", {})
+        if name not in cache:
+            cache[name] = factory()
+        return cache[name]
+
+    def _azure_client(self):
+        return self._reused("azure_client", pooled_azure_client)
+
+    def _menu_llm(self):
+        return self._reused("menu_llm", lambda: LLM(
+            model="azure/gpt-4o", response_format=LLMResponseTask, client=self._azure_client()
+        ))
+
+    def _numbers_llm(self):
+        return self._reused("numbers_llm", lambda: LLM(
+            model="azure/gpt-4o", response_format=LLMResponseNumbers, client=self._azure_client()
+        ))
+
+    def _search_summarize_crew(self):
+        return self._reused("search_summarize_crew", lambda: use_client(SearchSummarizeCrew().crew(), self._azure_client()))
+
+    def _sum_crew(self):
+        return self._reused("sum_crew", lambda: use_client(SumCrew().crew(), self._azure_client()))
 
-        # Initialize the LLM
-        llm = LLM(model="azure/gpt-4o", response_format=LLMResponseTask)
+    def _intent_router(self):
+        # Without an embeddings deployment only the rules and the LLM are used
+        deployment = os.getenv("EMBEDDING_DEPLOYMENT")
+        return self._reused("intent_router", lambda: IntentRouter(
+            rules=INTENT_RULES,
+            examples=INTENT_EXAMPLES,
+            fallback=self.classify_with_llm,
+            embed=(lambda texts: azure_embed(texts, client=self._azure_client())) if deployment else None,
+            cache_path=INTENT_CACHE_PATH,
+            model_id=deployment or "",
+        ))
 
+    def classify_with_llm(self, user_response):
         # Create the messages for the outline
         messages = [
             {"role": "system", "content": "You are a helpful assistant designed to output a single word between: Ricerca, Somma, Uscita, Richiedi."},
@@ -49,9 +166,19 @@ class RicercaOCalcoloFlow(Flow[SearchState]):
         ]
 
         # Make the LLM call with JSON response format
-        response = llm.call(messages=messages)
-        response = json.loads(response)
-        self.state.response = LLMResponseTask(**response)
+        response = self._menu_llm().call(messages=messages)
+        return LLMResponseTask(**json.loads(response)).response
+
+    @start("restart_flow")
+    def init_menu(self):
+
+        question = "Vuoi fare una ricerca web o una somma?"
+        user_response = input(question)
+
+        # Rules and embedding centroids first, the LLM only when both are unsure
+        decision = self._intent_router().classify(user_response)
+        self.state.response = LLMResponseTask(response=decision.label)
+        print(f"Intento: {decision.label} (tier {decision.tier}, {decision.latency_ms:.1f} ms)")
 
 
     @router(init_menu)
@@ -67,6 +194,8 @@ class RicercaOCalcoloFlow(Flow[SearchState]):
             return "restart_flow"
         elif self.state.response.response == "Uscita":
             print("Uscita...")
+            for tier, stats in self._intent_router().stats().items():
+                print(f"Classificatore {tier}: {stats}")
             return "exit"
 
     @listen("search_internet")
@@ -77,17 +206,32 @@ class RicercaOCalcoloFlow(Flow[SearchState]):
     @listen(collect_search_query)
     def search_crew(self):
         print("Searching the internet with DuckDuckGo")
-        SearchSummarizeCrew().crew().kickoff(inputs={
+        reset_crew(self._search_summarize_crew()).kickoff(inputs={
             "topic": self.state.search_query
         })
 
     @listen("sum_numbers")
     def sum_two_numbers(self):
+        # The state survives restart_flow: clear the outcome of the previous sum
+        self.state.sum_result = ""
         question = "Quali numeri vuoi sommare?"
         user_response = input(question)
 
-        # Initialize the LLM
-        llm = LLM(model="azure/gpt-4o", response_format=LLMResponseNumbers)
+        # Local exact arithmetic first: the LLM and the crew only run if parsing fails
+        start = time.perf_counter()
+        try:
+            result = evaluate(user_response)
+        except ZeroDivisionError:
+            self.state.sum_result = "Errore: divisione per zero"
+            print(self.state.sum_result)
+            return
+        except ValueError as error:
+            print(f"Calcolo locale non riuscito ({error}), uso l'LLM")
+        else:
+            elapsed_us = (time.perf_counter() - start) * 1e6
+            self.state.sum_result = result.text
+            print(f"{result.expression} = {result.text} (calcolo locale, {elapsed_us:.0f} µs)")
+            return
 
         # Create the messages for the outline
         messages = [
@@ -100,20 +244,26 @@ class RicercaOCalcoloFlow(Flow[SearchState]):
         ]
 
         # Make the LLM call with JSON response format
-        response = llm.call(messages=messages)
+        response = self._numbers_llm().call(messages=messages)
         response = json.loads(response).get("numbers", [])
         self.state.numbers = LLMResponseNumbers(numbers=response)
 
     @listen(sum_two_numbers)
     def sum_two_numbers_crews(self):
+        if self.state.sum_result:
+            return
+        if len(self.state.numbers.numbers) < 2:
+            print("Servono almeno due numeri")
+            return
         print("Summing numbers:", self.state.numbers.numbers[0], "+", self.state.numbers.numbers[1])
-        SumCrew().crew().kickoff(inputs={
+        reset_crew(self._sum_crew()).kickoff(inputs={
             "arg1": self.state.numbers.numbers[0],
             "arg2": self.state.numbers.numbers[1]
         })
 
     @router(or_(sum_two_numbers_crews, search_crew))
     def restart(self):
+        # Per-run state is reset; LLMs and crews are kept
         self.state = SearchState()
         return "restart_flow"
 
@@ -0,0 +1,243 @@
+"""Deterministic parser and evaluator for sums and simple arithmetic expressions.
+
+Accepts lists of numbers ("somma 3, 5 e 10") and expressions with + - * / and
+parentheses, also written in words ("3 più 4 per 2"). Numbers are exact
+rationals (`fractions.Fraction`), so arbitrarily large integers and decimals
+are summed without rounding. Input that is not fully understood raises
+`ValueError`, so the caller can fall back to the LLM crew.
+
+Number formats: "2.5" and "2,5" are decimals; "1.000.000", "1,000,000",
+"1.234,5" and "1,234.5" are grouped thousands. A single separator followed by
+exactly three digits ("1.000") is ambiguous and rejected.
+"""
+import re
+from dataclasses import dataclass
+from decimal import Decimal, localcontext
+from fractions import Fraction
+from typing import List, Union
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<num>\d+(?:[.,]\d+)*)|(?P<word>[^\W\d_]+'?)|(?P<op>[-+*/×÷()])|(?P<sep>[,;:?!=.]))"
+)
+
+_PHRASES = {
+    "per favore": " ",
+    "diviso per": " / ",
+    "divided by": " / ",
+    "multiplied by": " * ",
+}
+
+_OPERATOR_WORDS = {
+    "più": "+", "piu": "+", "piu'": "+", "plus": "+",
+    "meno": "-", "minus": "-",
+    "per": "*", "x": "*", "times": "*", "moltiplicato": "*",
+    "diviso": "/",
+}
+
+# Words that carry no arithmetic meaning in a sum request
+_FILLER_WORDS = {
+    "somma", "sommare", "sommami", "somme", "addiziona", "addizionare", "aggiungi",
+    "calcola", "calcolare", "calcolami", "quanto", "quanti", "fa", "fanno", "fammi", "dimmi",
+    "voglio", "vorrei", "puoi", "il", "lo", "la", "i", "gli", "le", "di", "dei", "delle", "degli",
+    "tra", "fra", "numeri", "numero", "valori", "totale", "risultato", "uguale", "è", "e'",
+    "sum", "add", "the", "of", "what", "is", "please", "equals",
+}
+
+# Words that separate the items of a list of numbers
+_LIST_WORDS = {"e", "ed", "and", "con", "a"}
+
+Symbol = Union[str, Fraction]
+
+
+@dataclass(frozen=True)
+class ArithmeticResult:
+    """Exact value of an expression, with the normalized expression and its operands."""
+    value: Fraction
+    expression: str
+    operands: List[Fraction]
+
+    @property
+    def exact(self) -> bool:
+        """False when the value has no finite decimal representation (e.g. 1/3)."""
+        denominator = self.value.denominator
+        for factor in (2, 5):
+            while denominator % factor == 0:
+                denominator //= factor
+        return denominator == 1
+
+    @property
+    def text(self) -> str:
+        return format_number(self.value) if self.exact else "≈" + format_number(self.value)
+
+
+def parse_number(raw: str) -> Fraction:
+    """Convert a numeric token to an exact Fraction (see module docstring for formats)."""
+    separators = re.findall(r"[.,]", raw)
+    groups = re.split(r"[.,]", raw)
+    if not separators:
+        return Fraction(int(raw))
+    if len(separators) == 1:
+        if len(groups[1]) == 3 and groups[0] != "0":
+            raise ValueError(f"Numero ambiguo: {raw}")
+        return Fraction(f"{groups[0]}.{groups[1]}")
+
+    # Grouped thousands, optionally followed by a decimal separator of the other kind
+    thousands = separators[0]
+    decimals = ""
+    if separators[-1] != thousands:
+        decimals = groups.pop()
+        separators.pop()
+    if any(sep != thousands for sep in separators) or len(groups[0]) > 3 or any(len(g) != 3 for g in groups[1:]):
+        raise ValueError(f"Numero ambiguo: {raw}")
+    integer = "".join(groups)
+    return Fraction(f"{integer}.{decimals}") if decimals else Fraction(int(integer))
+
+
+def format_number(value: Fraction, digits: int = 30) -> str:
+    """Exact decimal string when it terminates, otherwise `digits` significant digits."""
+    if value.denominator == 1:
+        return str(value.numerator)
+    denominator = value.denominator
+    for factor in (2, 5):
+        while denominator % factor == 0:
+            denominator //= factor
+    with localcontext() as ctx:
+        if denominator == 1:
+            # Terminating decimal: enough precision for every digit
+            ctx.prec = len(str(value.numerator)) + len(str(value.denominator)) + 2
+        else:
+            ctx.prec = digits
+        result = Decimal(value.numerator) / Decimal(value.denominator)
+    return format(result.normalize(), "f") if denominator == 1 else f"{result:f}"
+
+
+def tokenize(text: str) -> List[Symbol]:
+    """Split `text` into numbers, operators and "," list separators; reject unknown words."""
+    text = text.lower().strip()
+    for phrase, replacement in _PHRASES.items():
+        text = text.replace(phrase, replacement)
+    text = re.sub(r"(?<=\d)\s*x\s*(?=\d)", " * ", text)
+    # Letters glued to digits ("3.5e2", "10k") cannot be read safely
+    if re.search(r"\d[^\W\d_]|[^\W\d_]\d", text):
+        raise ValueError(f"Numero non riconosciuto in {text!r}")
+
+    symbols: List[Symbol] = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None or match.end() == position:
+            rest = text[position:].lstrip()
+            if not rest:
+                break
+            raise ValueError(f"Carattere non riconosciuto: {rest[0]!r}")
+        position = match.end()
+        if match.group("num"):
+            symbols.append(parse_number(match.group("num")))
+        elif match.group("op"):
+            symbols.append({"×": "*", "÷": "/"}.get(match.group("op"), match.group("op")))
+        elif match.group("sep"):
+            symbols.append(",")
+        else:
+            word = match.group("word")
+            if word in _OPERATOR_WORDS:
+                symbols.append(_OPERATOR_WORDS[word])
+            elif word in _LIST_WORDS:
+                symbols.append(",")
+            elif word not in _FILLER_WORDS:
+                raise ValueError(f"Parola non riconosciuta: {word!r}")
+
+    # Two bare numbers, with or without "," or "e" between them, are added (a list);
+    # "2(3+4)" and "(1+2)(3+4)" are products; any other juxtaposition is ambiguous
+    joined: List[Symbol] = []
+    separated = False
+    for symbol in symbols:
+        if symbol == ",":
+            separated = True
+            continue
+        previous = joined[-1] if joined else None
+        if isinstance(previous, Fraction) and isinstance(symbol, Fraction):
+            joined.append("+")
+        elif (isinstance(previous, Fraction) or previous == ")") and (isinstance(symbol, Fraction) or symbol == "("):
+            if separated or symbol != "(":
+                near = symbol if symbol == "(" else format_number(symbol)
+                raise ValueError(f"Espressione ambigua vicino a {near!r}")
+            joined.append("*")
+        joined.append(symbol)
+        separated = False
+    return joined
+
+
+class _Parser:
+    """Recursive descent: expr := term (+|- term)*, term := factor (*|/ factor)*."""
+
+    def __init__(self, symbols: List[Symbol]):
+        self.symbols = symbols
+        self.position = 0
+        self.operands: List[Fraction] = []
+
+    def peek(self):
+        return self.symbols[self.position] if self.position < len(self.symbols) else None
+
+    def take(self):
+        symbol = self.peek()
+        self.position += 1
+        return symbol
+
+    def expr(self) -> Fraction:
+        value = self.term()
+        while self.peek() in ("+", "-"):
+            value = value + self.term() if self.take() == "+" else value - self.term()
+        return value
+
+    def term(self) -> Fraction:
+        value = self.factor()
+        while self.peek() in ("*", "/"):
+            value = value * self.factor() if self.take() == "*" else value / self.factor()
+        return value
+
+    def factor(self) -> Fraction:
+        symbol = self.take()
+        if isinstance(symbol, Fraction):
+            self.operands.append(symbol)
+            return symbol
+        if symbol == "-":
+            return -self.factor()
+        if symbol == "+":
+            return self.factor()
+        if symbol == "(":
+            value = self.expr()
+            if self.take() != ")":
+                raise ValueError("Parentesi non chiusa")
+            return value
+        if symbol is None:
+            raise ValueError("Espressione incompleta")
+        raise ValueError(f"Espressione non valida vicino a {symbol!r}")
+
+
+def evaluate(text: str) -> ArithmeticResult:
+    """Evaluate a sum request or an arithmetic expression exactly.
+
+    >>> evaluate("somma 3, 5 e 10").text
+    '18'
+    >>> evaluate("(1+2)(3+4)").text
+    '21'
+    >>> evaluate("2(3+4)").text
+    '14'
+    >>> evaluate("(1+2) 3")
+    Traceback (most recent call last):
+    ...
+    ValueError: Espressione ambigua vicino a '3'
+
+    Raises:
+        ValueError: If the input is not fully understood or has fewer than two numbers.
+        ZeroDivisionError: On division by zero.
+    """
+    symbols = tokenize(text)
+    parser = _Parser(symbols)
+    value = parser.expr()
+    if parser.peek() is not None:
+        raise ValueError(f"Espressione non valida vicino a {parser.peek()!r}")
+    if len(parser.operands) < 2:
+        raise ValueError("Servono almeno due numeri")
+    expression = " ".join(format_number(s) if isinstance(s, Fraction) else s for s in symbols)
+    return ArithmeticResult(value=value, expression=expression, operands=parser.operands)
@@ -0,0 +1,151 @@
+"""Tiered intent classification in front of the LLM menu classifier.
+
+Tiers, in order: regex rules (only when all matching rules agree on one
+label), nearest centroid over embeddings of labelled example utterances
+(accepted above a cosine threshold and margin), and finally the LLM fallback.
+Example centroids are cached on disk; hits and latency are kept per tier.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TIERS = ("rules", "centroid", "llm")
+
+EmbedFn = Callable[[List[str]], List[List[float]]]
+
+
+@dataclass(frozen=True)
+class IntentRule:
+    """Regex (case-insensitive) that maps matching inputs to `label`."""
+    label: str
+    pattern: str
+
+
+@dataclass(frozen=True)
+class IntentDecision:
+    """Chosen label, deciding tier, confidence and total latency in ms."""
+    label: str
+    tier: str
+    confidence: float
+    latency_ms: float
+
+
+class IntentRouter:
+    """Classify user inputs with rules, then embedding centroids, then the LLM."""
+
+    def __init__(
+        self,
+        rules: Sequence[IntentRule],
+        examples: Dict[str, List[str]],
+        fallback: Callable[[str], str],
+        embed: Optional[EmbedFn] = None,
+        threshold: float = 0.5,
+        margin: float = 0.05,
+        cache_path: Optional[str] = None,
+        model_id: str = "",
+        window: int = 1000,
+    ):
+        self.rules = [(rule.label, re.compile(rule.pattern, re.IGNORECASE)) for rule in rules]
+        self.examples = {label: list(texts) for label, texts in examples.items() if texts}
+        self.fallback = fallback
+        self.embed = embed
+        self.threshold = threshold
+        self.margin = margin
+        self.cache_path = cache_path
+        self.model_id = model_id
+        self._centroids: Optional[Tuple[List[str], np.ndarray]] = None
+        self._hits = {tier: 0 for tier in TIERS}
+        self._latency = {tier: [] for tier in TIERS}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def match_rules(self, text: str) -> Optional[str]:
+        labels = {label for label, pattern in self.rules if pattern.search(text)}
+        return labels.pop() if len(labels) == 1 else None
+
+    def centroids(self) -> Tuple[List[str], np.ndarray]:
+        if self._centroids is not None:
+            return self._centroids
+        payload = json.dumps([self.model_id, sorted(self.examples.items())], ensure_ascii=False)
+        key = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        path = Path(self.cache_path) if self.cache_path else None
+        if path is not None and path.is_file():
+            with np.load(path) as data:
+                if str(data["key"]) == key:
+                    self._centroids = ([str(label) for label in data["labels"]], data["centroids"])
+                    return self._centroids
+
+        labels = list(self.examples)
+        texts = [text for label in labels for text in self.examples[label]]
+        vectors = _normalize(np.asarray(self.embed(texts), dtype=np.float32))
+        rows, start = [], 0
+        for label in labels:
+            end = start + len(self.examples[label])
+            rows.append(vectors[start:end].mean(axis=0))
+            start = end
+        centroids = _normalize(np.vstack(rows))
+        if path is not None:
+            with open(path, "wb") as f:
+                np.savez(f, key=key, labels=np.asarray(labels), centroids=centroids)
+        self._centroids = (labels, centroids)
+        return self._centroids
+
+    def match_centroid(self, text: str) -> Tuple[Optional[str], float]:
+        labels, centroids = self.centroids()
+        scores = centroids @ _normalize(np.asarray(self.embed([text]), dtype=np.float32))[0]
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else -1.0
+        if best >= self.threshold and best - runner_up >= self.margin:
+            return labels[order[0]], best
+        return None, best
+
+    def classify(self, text: str) -> IntentDecision:
+        start = time.perf_counter()
+        label, tier, confidence = self.match_rules(text), "rules", 1.0
+        if label is None and self.embed is not None and self.examples:
+            try:
+                label, confidence = self.match_centroid(text)
+                tier = "centroid"
+            except Exception:  # embeddings endpoint unreachable: fall back to the LLM
+                label = None
+        if label is None:
+            label, tier, confidence = self.fallback(text), "llm", 1.0
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._hits[tier] += 1
+            samples = self._latency[tier]
+            samples.append(elapsed_ms)
+            del samples[:-self._window]
+        return IntentDecision(label, tier, round(confidence, 4), round(elapsed_ms, 3))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Hits, hit rate and latency (mean/p50/p95 ms) per tier."""
+        with self._lock:
+            hits = dict(self._hits)
+            latency = {tier: np.asarray(samples) for tier, samples in self._latency.items()}
+        total = sum(hits.values())
+        result = {}
+        for tier in TIERS:
+            ms = latency[tier]
+            result[tier] = {"hits": hits[tier], "hit_rate": round(hits[tier] / total, 3) if total else 0.0}
+            if len(ms):
+                result[tier].update(
+                    mean_ms=round(float(ms.mean()), 3),
+                    p50_ms=round(float(np.percentile(ms, 50)), 3),
+                    p95_ms=round(float(np.percentile(ms, 95)), 3),
+                )
+        return result
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
@@ -0,0 +1,62 @@
+"""Benchmark of the MMR re-rank: `mmr_select` vs LangChain's implementation.
+
+Candidates are random unit vectors of the Azure embedding size; for every
+``fetch_k`` the script checks that both implementations select the same
+documents and reports the median re-rank time.
+
+Usage::
+
+    python benchmarks/bench_mmr.py --k 4 --dim 1536 --repeat 20
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+from rag_med.tools.faiss_indexes import mmr_select
+
+FETCH_KS = (20, 50, 100, 200, 500, 1000)
+
+
+def _median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'fetch_k':>8} {'langchain ms':>13} {'numpy ms':>10} {'speedup':>8} same")
+    for fetch_k in FETCH_KS:
+        query = rng.standard_normal(args.dim).astype(np.float32)
+        candidates = rng.standard_normal((fetch_k, args.dim)).astype(np.float32)
+
+        ours = mmr_select(query, candidates, args.k, args.lambda_mult)
+        theirs = maximal_marginal_relevance(query, list(candidates), args.lambda_mult, args.k)
+        t_ours = _median_ms(lambda: mmr_select(query, candidates, args.k, args.lambda_mult), args.repeat)
+        t_theirs = _median_ms(
+            lambda: maximal_marginal_relevance(query, list(candidates), args.lambda_mult, args.k),
+            args.repeat,
+        )
+        print(
+            f"{fetch_k:>8} {t_theirs:>13.2f} {t_ours:>10.2f} {t_theirs / t_ours:>7.1f}x "
+            f"{ours == theirs}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Offline benchmark suite: chunking, index build and query latency by corpus size.
+
+Runs with ``Settings(offline=True)``: deterministic hash embeddings and a stub
+chat model (see `rag_med.tools.fakes`), so no endpoint is needed and results
+are reproducible. For every size a synthetic corpus is split, embedded,
+indexed and persisted, then queried; each size runs in its own process so
+peak RSS is measured per size. Results are printed as a table and written as
+JSON (one object per size).
+
+Usage::
+
+    python benchmarks/bench_offline.py --sizes 1000 10000 --output bench_offline.json
+    python benchmarks/bench_offline.py --sizes 1000000 --dim 256 --index sq8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from rag_med.tools.faiss_indexes import INDEX_TYPES, IndexSpec
+from rag_med.tools.fakes import StubChatModel, synthetic_documents, synthetic_queries
+from rag_med.tools.persistence import INDEX_FILE
+from rag_med.tools.rag_faiss_lmstudio import (
+    Settings,
+    build_faiss_vectorstore,
+    build_rag_chain,
+    get_embeddings,
+    make_retriever,
+    split_documents,
+)
+from rag_med.tools.splitting import SplitStats
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def _percentiles(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def run_one(size: int, args: argparse.Namespace, workdir: Path) -> Dict[str, Any]:
+    """Benchmark one corpus size in the current process."""
+    settings = Settings(
+        offline=True,
+        offline_dim=args.dim,
+        persist_dir=str(workdir / f"n{size}"),
+        embedding_cache=False,
+        search_type=args.search_type,
+        k=args.k,
+        embed_batch_size=args.batch_size,
+        index=IndexSpec(index_type=args.index),
+    )
+    embeddings = get_embeddings(settings)
+    docs = list(synthetic_documents(size))
+
+    start = time.perf_counter()
+    stats = SplitStats()
+    chunks = split_documents(docs, settings, stats)
+    split_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector_store = build_faiss_vectorstore(chunks, embeddings, settings.persist_dir, settings=settings)
+    build_s = time.perf_counter() - start
+
+    retriever = make_retriever(vector_store, settings)
+    queries = synthetic_queries(docs, args.queries)
+    retriever.invoke(queries[0])  # riscaldamento (pagine dell'indice mappato)
+    retrieve = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.invoke(query)
+        retrieve.append(time.perf_counter() - start)
+
+    chain = build_rag_chain(StubChatModel(), retriever, settings.context_max_tokens)
+    answer = []
+    for query in queries[: args.answers]:
+        start = time.perf_counter()
+        chain.invoke(query)
+        answer.append(time.perf_counter() - start)
+
+    persist = Path(settings.persist_dir)
+    return {
+        "chunks": stats.chunks,
+        "dim": args.dim,
+        "index_type": args.index,
+        "search_type": args.search_type,
+        "split_s": round(split_s, 3),
+        "split_chunks_per_s": round(stats.chunks / split_s, 1) if split_s else None,
+        "split_mb_per_s": round(stats.source_chars / 1e6 / split_s, 2) if split_s else None,
+        "build_s": round(build_s, 3),
+        "build_chunks_per_s": round(stats.chunks / build_s, 1) if build_s else None,
+        "retrieve": _percentiles(retrieve),
+        "answer": _percentiles(answer) if answer else None,
+        # ru_maxrss e' in KB su Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "index_bytes": (persist / INDEX_FILE).stat().st_size,
+        "store_bytes": _dir_bytes(persist),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES[:3]))
+    parser.add_argument("--dim", type=int, default=256, help="hash embedding size (Azure: 1536)")
+    parser.add_argument("--index", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--search-type", choices=("similarity", "mmr", "hybrid"), default="similarity")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--answers", type=int, default=50, help="end-to-end answers with the stub LLM")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--workdir", default=None, help="where indexes are built (default: temp dir)")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    parser.add_argument("--run-one", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(args.run_one, args, Path(args.workdir))))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        # Un processo per dimensione: il picco di RSS non si somma tra le esecuzioni
+        for size in args.sizes:
+            cmd = [sys.executable, __file__, "--run-one", str(size), "--workdir", workdir]
+            cmd += _forwarded(args)
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            results.append(result)
+            print(
+                f"{result['chunks']:>9} chunk  split {result['split_s']:>7.2f}s  "
+                f"build {result['build_s']:>8.2f}s  retrieve p50 {result['retrieve']['p50_ms']:>7.3f}ms "
+                f"p99 {result['retrieve']['p99_ms']:>7.3f}ms  rss {result['peak_rss_mb']:>8.1f}MB  "
+                f"index {result['index_bytes'] / 1e6:>8.1f}MB",
+                flush=True,
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+def _forwarded(args: argparse.Namespace) -> List[str]:
+    return [
+        "--dim", str(args.dim), "--index", args.index, "--search-type", args.search_type,
+        "--k", str(args.k), "--queries", str(args.queries), "--answers", str(args.answers),
+        "--batch-size", str(args.batch_size),
+    ]
+
+
+if __name__ == "__main__":
+    main()
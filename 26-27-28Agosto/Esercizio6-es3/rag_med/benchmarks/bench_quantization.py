@@ -0,0 +1,135 @@
+"""Benchmark of the compressed FAISS stores: recall vs memory against flat.
+
+By default the vectors come from a store built from the ``db/`` corpus
+(``--docs-dir``) in ``--persist-dir``: the store is built with the Azure
+embeddings on the first run (``--offline`` uses hash embeddings) and reused
+afterwards, so later runs make no embedding call. With ``--synthetic N``
+random clustered vectors are used instead. Below ``--min-vectors`` the run is
+refused: the fixed costs of the compressed indexes (quantizer ranges, the
+LSH rotation matrix) dominate small stores and the ratios are meaningless.
+
+Queries are stored vectors plus a little noise; recall@k is measured against
+the exact flat search. ``B/vec`` is the serialized size per vector and
+``hot B/vec`` what must stay in RAM: for the binary index only the hashes,
+since the re-scoring vectors are read from the memory-mapped file on demand.
+``total x`` and ``hot x`` compare each against flat's ``B/vec``.
+
+Usage::
+
+    python benchmarks/bench_quantization.py --docs-dir db --persist-dir faiss_index_db --k 4
+    python benchmarks/bench_quantization.py --synthetic 20000 --dim 1536
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from rag_med.tools.faiss_indexes import IndexSpec, create_index
+from rag_med.tools.persistence import INDEX_FILE, close_vectorstore, read_faiss_index
+from rag_med.tools.rag_faiss_lmstudio import Settings, get_embeddings, load_or_build_vectorstore
+from rag_med.tools.splitting import DirectorySource
+
+SPECS = (
+    IndexSpec(index_type="flat"),
+    IndexSpec(index_type="sqfp16"),
+    IndexSpec(index_type="sq8"),
+    IndexSpec(index_type="binary", refine="sq8", k_factor=4),
+    IndexSpec(index_type="binary", refine="sq8", k_factor=16),
+    IndexSpec(index_type="binary", refine="flat", k_factor=16),
+)
+
+
+def _label(spec: IndexSpec) -> str:
+    if spec.index_type != "binary":
+        return spec.index_type
+    return f"binary+{spec.refine} x{spec.k_factor:g}"
+
+
+def _load_vectors(args: argparse.Namespace) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((max(1, args.synthetic // 50), args.dim)).astype(np.float32)
+        rows = rng.integers(0, len(centers), args.synthetic)
+        return centers[rows] + 0.3 * rng.standard_normal((args.synthetic, args.dim)).astype(np.float32)
+    if args.docs_dir:
+        # Store flat del corpus: costruito alla prima esecuzione, poi solo ricaricato
+        settings = Settings(
+            docs_dir=args.docs_dir,
+            persist_dir=args.persist_dir,
+            offline=args.offline,
+            offline_dim=args.dim,
+            embedding_cache=False,
+        )
+        close_vectorstore(load_or_build_vectorstore(
+            settings, get_embeddings(settings), DirectorySource(settings.docs_dir, settings.docs_glob)
+        ))
+    index = read_faiss_index(str(Path(args.persist_dir) / INDEX_FILE), mmap=False)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _hot_bytes(index: faiss.Index) -> int:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        index = index.base_index
+    return len(faiss.serialize_index(index))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs-dir", default="db", help="corpus of the store; empty to use --persist-dir as is")
+    parser.add_argument("--persist-dir", default="faiss_index_db")
+    parser.add_argument("--offline", action="store_true", help="hash embeddings when building the store")
+    parser.add_argument("--synthetic", type=int, default=0, help="random vectors instead of a store")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--min-vectors", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    vectors = np.ascontiguousarray(_load_vectors(args), dtype=np.float32)
+    n, dim = vectors.shape
+    if n < args.min_vectors:
+        sys.exit(
+            f"Solo {n} vettori (minimo {args.min_vectors}): i costi fissi degli indici compressi "
+            "dominano e i rapporti non sono significativi. Usa un corpus piu' grande o --synthetic N."
+        )
+    rng = np.random.default_rng(1)
+    rows = rng.choice(n, min(args.queries, n), replace=False)
+    scale = 0.05 * float(np.linalg.norm(vectors, axis=1).mean()) / np.sqrt(dim)
+    queries = vectors[rows] + scale * rng.standard_normal((len(rows), dim)).astype(np.float32)
+    k = min(args.k, n)
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    print(f"{n} vettori, dim {dim}, {len(rows)} query, k={k}")
+    print(
+        f"{'index':<22} {'recall@k':>8} {'B/vec':>8} {'hot B/vec':>10} "
+        f"{'total x':>8} {'hot x':>6} {'ms/query':>9}"
+    )
+    flat_bytes = None
+    for spec in SPECS:
+        index, _ = create_index(spec, vectors)
+        index.add(vectors)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        total = len(faiss.serialize_index(index)) / n
+        hot = _hot_bytes(index) / n
+        flat_bytes = flat_bytes or total
+        print(
+            f"{_label(spec):<22} {recall:>8.3f} {total:>8.0f} {hot:>10.0f} "
+            f"{flat_bytes / total:>7.2f}x {flat_bytes / hot:>5.1f}x {ms:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
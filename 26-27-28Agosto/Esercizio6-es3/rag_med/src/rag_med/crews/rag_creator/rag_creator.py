@@ -2,7 +2,8 @@
 
 This module declares `RagCreatorCrew`, which wires together a researcher agent
 and a single research task. The crew can be instantiated via the `crew()`
-factory and executed with `kickoff()` elsewhere.
+factory and executed with `kickoff()` elsewhere. Each crew instance has its
+own RAG tool, so its streaming option does not leak to other crews.
 """
 from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
@@ -13,15 +14,20 @@ from rag_med.tools.custom_tool import MyCustomTool
 # you can use the @before_kickoff and @after_kickoff decorators
 # https://docs.crewai.com/concepts/crews#example-crew-class-with-decorators
 
-rag_tool = MyCustomTool()
-
 @CrewBase
 class RagCreatorCrew():
-    """RagCreator crew"""
+    """RagCreator crew
+
+    Args:
+        stream (bool): Print the RAG answers token by token as they are generated.
+    """
 
     agents: List[BaseAgent]
     tasks: List[Task]
 
+    def __init__(self, stream: bool = False) -> None:
+        self.rag_tool = MyCustomTool(stream=stream)
+
     # Learn more about YAML configuration files here:
     # Agents: https://docs.crewai.com/concepts/agents#yaml-configuration-recommended
     # Tasks: https://docs.crewai.com/concepts/tasks#yaml-configuration-recommended
@@ -32,7 +38,7 @@ class RagCreatorCrew():
     def researcher(self) -> Agent:
         return Agent(
             config=self.agents_config['researcher'], # type: ignore[index]
-            tools=[rag_tool],
+            tools=[self.rag_tool],
             verbose=True
         )
 
@@ -15,14 +15,52 @@ Examples:
     True
 """
 import json
+import os
 
+import httpx
+import openai
 from pydantic import BaseModel, Field
 
 from crewai.flow import Flow, listen, start, router, or_
-from crewai import LLM
+from crewai import LLM, Crew
 
 from rag_med.crews.search_summarize.search_summarize import SearchSummarizeCrew
 from rag_med.crews.rag_creator.rag_creator import RagCreatorCrew
+from rag_med.tools import rag_faiss_lmstudio
+from rag_med.tools.intent_router import IntentRouter, IntentRule
+
+# Fast path of the menu classifier: rules fire only when they agree on one label
+INTENT_RULES = [
+    IntentRule("Uscita", r"^\W*(esci|uscita|exit|quit|bye|basta|fine|stop)\W*$"),
+    IntentRule("Rag", r"\brag\b|retrieval[\s-]+augmented"),
+]
+
+# Example utterances for the nearest-centroid tier (Uscita is covered by the rules)
+INTENT_EXAMPLES = {
+    "Rag": [
+        "Cos'e' un agente RAG?",
+        "Come funziona la retrieval augmented generation?",
+        "Come si indicizzano i documenti in un vector store FAISS?",
+        "Che differenza c'e' tra ricerca ibrida BM25 e ricerca vettoriale?",
+        "Come si scelgono chunk size e overlap per il retrieval?",
+        "Come si valutano le risposte di una pipeline RAG con Ragas?",
+        "A cosa serve il re-ranking dei passaggi recuperati?",
+        "Come si citano le fonti nelle risposte generate dal contesto?",
+    ],
+    "Ricerca": [
+        "Che tempo fara' domani a Milano?",
+        "Ultime notizie sulla borsa di oggi",
+        "Chi ha vinto la partita di ieri sera?",
+        "Quali sono i sintomi dell'influenza?",
+        "Ricetta della carbonara",
+        "Orari dei treni da Roma a Napoli",
+        "Chi e' l'attuale presidente della Repubblica?",
+        "Migliori smartphone usciti quest'anno",
+    ],
+}
+
+# Cache of the example centroids (recomputed when examples or model change)
+INTENT_CACHE_PATH = "intent_centroids.npz"
 
 
 class LLMResponseTask(BaseModel):
@@ -44,6 +82,8 @@ class SearchState(BaseModel):
         search_query (str): The current search query typed by the user.
         response (LLMResponseTask | None): The last LLM classification result.
         question (str): The original user question or topic.
+        stream (bool): Print RAG answers token by token as they are generated
+            (opt-in; read when the RAG crew is first built).
 
     Examples:
         >>> state = SearchState(question="Cos'e' RAG?")
@@ -53,38 +93,178 @@ class SearchState(BaseModel):
     search_query: str = ""
     response: LLMResponseTask = None
     question: str = ""
+    stream: bool = False
+
+
+def pooled_http_client(max_connections: int = 20) -> httpx.Client:
+    """Create the keep-alive connection pool of one flow's Azure requests.
+
+    The pool is handed only to the clients of one flow (chat models through
+    `azure_client`, intent embeddings through `get_embeddings`), so the
+    classifier, the crew agents and the centroid tier reuse warm TLS
+    connections across turns without changing LiteLLM's global session.
+    Request timeouts stay those of the OpenAI SDK and LiteLLM.
+
+    Args:
+        max_connections (int): Maximum open connections in the pool.
+
+    Returns:
+        httpx.Client: The pool; close it when the flow ends.
+    """
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+def azure_client(http_client: httpx.Client) -> openai.AzureOpenAI:
+    """Create an Azure OpenAI client that sends its requests through `http_client`.
+
+    The client is passed to LiteLLM per call (``client=``).
+
+    Args:
+        http_client (httpx.Client): Pool from `pooled_http_client`.
+
+    Returns:
+        openai.AzureOpenAI: Client configured from ``AZURE_API_BASE``,
+        ``AZURE_API_KEY`` and ``AZURE_API_VERSION``.
+    """
+    return openai.AzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_API_BASE"),
+        api_key=os.getenv("AZURE_API_KEY"),
+        api_version=os.getenv("AZURE_API_VERSION", "2024-02-01"),
+        http_client=http_client,
+    )
+
+
+def use_client(crew: Crew, client: openai.AzureOpenAI) -> Crew:
+    """Make every agent of `crew` call its model through `client`.
+
+    Args:
+        crew (Crew): Crew whose agents use Azure models (``azure/...``).
+        client (openai.AzureOpenAI): Client from `azure_client`.
+
+    Returns:
+        Crew: The same crew.
+    """
+    for agent in crew.agents:
+        agent.llm = LLM(model=agent.llm.model, client=client)
+    return crew
+
+
+def reset_crew(crew: Crew) -> Crew:
+    """Clear the per-run state of a crew so it can be kicked off again.
+
+    Task descriptions are re-interpolated by `Crew.kickoff` from the original
+    templates; only the previous outputs and tool results must be dropped.
+
+    Args:
+        crew (Crew): Crew built once and reused across questions.
+
+    Returns:
+        Crew: The same crew, ready for the next kickoff.
+    """
+    for task in crew.tasks:
+        task.output = None
+    for agent in crew.agents:
+        agent.tools_results = []
+    return crew
 
 
 class RagMed(Flow[SearchState]):
     """Interactive flow that routes to search or RAG based on LLM output.
 
     The flow starts by asking the user a question, then calls an LLM to decide
-    whether to invoke internet search, a RAG demo, or exit.
+    whether to invoke internet search, a RAG demo, or exit. The classifier LLM
+    and the crews are built once per flow instance, on first use, and reused
+    on every turn of the ``restart_flow`` loop; they and the intent
+    embeddings share the flow's connection pool, closed by `close` when
+    `kickoff` returns.
     """
 
-    @start("restart_flow")
-    def init_menu(self):
-        """Start node that asks the user for a topic and classifies intent.
+    def kickoff(self, *args, **kwargs):
+        """Run the flow, then release its connections (see `close`)."""
+        try:
+            return super().kickoff(*args, **kwargs)
+        finally:
+            self.close()
 
-        Prompts for input on the console, calls the configured LLM to classify
-        the intent into one of "Ricerca", "Rag", or "Uscita", and stores the
-        result in the flow state.
+    def close(self) -> None:
+        """Close the connection pool and drop the cached clients and crews.
 
-        Raises:
-            ValueError: If the LLM returns an unexpected payload.
+        They are built again on next use, so the flow can be kicked off again.
         """
+        cache = self.__dict__.pop("_reused_objects", {})
+        if "http_client" in cache:
+            cache["http_client"].close()
 
-        question = "Quale argomento vuoi cercare?"
-        self.state.question = input(question)
+    def _reused(self, name, factory):
+        """Return the object cached under `name`, building it on first use.
+
+        Plain methods rather than properties: `Flow.__init__` reads every
+        attribute while registering the flow methods, which would build
+        everything eagerly.
+        """
+        cache = self.__dict__.setdefault("_reused_objects", {})
+        if name not in cache:
+            cache[name] = factory()
+        return cache[name]
+
+    def _http_client(self) -> httpx.Client:
+        """Connection pool of this flow instance's Azure requests."""
+        return self._reused("http_client", pooled_http_client)
+
+    def _azure_client(self) -> openai.AzureOpenAI:
+        """Azure client on the flow's pool, shared by the LLMs of this flow instance only."""
+        return self._reused("azure_client", lambda: azure_client(self._http_client()))
+
+    def _menu_llm(self) -> LLM:
+        """Classifier LLM, created once per flow instance."""
+        return self._reused("menu_llm", lambda: LLM(
+            model="azure/gpt-4o", response_format=LLMResponseTask, client=self._azure_client()
+        ))
+
+    def _rag_creator_crew(self) -> Crew:
+        """RAG crew, created once per flow instance."""
+        return self._reused(
+            "rag_creator_crew",
+            lambda: use_client(RagCreatorCrew(stream=self.state.stream).crew(), self._azure_client()),
+        )
+
+    def _search_summarize_crew(self) -> Crew:
+        """Search and summarize crew, created once per flow instance."""
+        return self._reused(
+            "search_summarize_crew", lambda: use_client(SearchSummarizeCrew().crew(), self._azure_client())
+        )
+
+    def _intent_router(self) -> IntentRouter:
+        """Rules -> embedding centroids -> LLM classifier, created once per flow instance."""
+        settings = rag_faiss_lmstudio.SETTINGS
+        return self._reused("intent_router", lambda: IntentRouter(
+            rules=INTENT_RULES,
+            examples=INTENT_EXAMPLES,
+            fallback=self.classify_with_llm,
+            embeddings=rag_faiss_lmstudio.get_embeddings(settings, http_client=self._http_client()),
+            cache_path=INTENT_CACHE_PATH,
+            model_id="offline" if settings.offline else os.getenv("EMBEDDING_DEPLOYMENT", ""),
+        ))
+
+    def classify_with_llm(self, question: str) -> str:
+        """Classify `question` with the LLM into "Ricerca", "Rag" or "Uscita".
+
+        Args:
+            question (str): The user's topic or question.
 
-        # Initialize the LLM
-        llm = LLM(model="azure/gpt-4o", response_format=LLMResponseTask)
+        Returns:
+            str: The label chosen by the LLM.
 
+        Raises:
+            ValueError: If the LLM returns an unexpected payload.
+        """
         # Create the messages for the outline
         messages = [
             {"role": "system", "content": "Sei un assistente utile progettato per restituire una sola parola tra: Ricerca, Rag, Uscita."},
             {"role": "user", "content": f"""
-                Considerando l'argomento fornito dall'utente: "{self.state.question}", comprendi l'obiettivo dell'utente e scegli una delle seguenti opzioni:
+                Considerando l'argomento fornito dall'utente: "{question}", comprendi l'obiettivo dell'utente e scegli una delle seguenti opzioni:
 
                 1 - Rag: Se l'utente sta facendo domande sugli agenti RAG (Retrieval-Augmented Generation)
                 2 - Uscita: Se l'utente vuole uscire dall'applicazione
@@ -93,12 +273,32 @@ class RagMed(Flow[SearchState]):
             """}
         ]
 
-
         # Make the LLM call with JSON response format
-        response = llm.call(messages=messages)
-        response = json.loads(response)
-        self.state.response = LLMResponseTask(**response)
-        print("Risposta LLM: ", self.state.question)
+        response = self._menu_llm().call(messages=messages)
+        return LLMResponseTask(**json.loads(response)).response
+
+    @start("restart_flow")
+    def init_menu(self):
+        """Start node that asks the user for a topic and classifies intent.
+
+        Prompts for input on the console, classifies the intent into one of
+        "Ricerca", "Rag", or "Uscita" and stores the result in the flow state.
+        Keyword rules and an embedding nearest-centroid classifier answer the
+        clear cases locally; the LLM is called only when both are unsure.
+
+        Raises:
+            ValueError: If the LLM returns an unexpected payload.
+        """
+
+        question = "Quale argomento vuoi cercare?"
+        self.state.question = input(question)
+
+        decision = self._intent_router().classify(self.state.question)
+        self.state.response = LLMResponseTask(response=decision.label)
+        print(
+            f"Intento: {decision.label} (tier {decision.tier}, "
+            f"confidenza {decision.confidence:.2f}, {decision.latency_ms:.1f} ms)"
+        )
 
 
     @router(init_menu)
@@ -115,16 +315,23 @@ class RagMed(Flow[SearchState]):
             return "search_rag"
         elif self.state.response.response == "Uscita":
             print("Uscita...")
+            for tier, stats in self._intent_router().stats().items():
+                print(f"Classificatore {tier}: {stats}")
             return "exit"
 
     @start("search_rag")
     def rag_crew(self):
         """Starts the RAG creator crew with the current question.
 
+        When `SearchState.stream` is set, the crew's own RAG tool prints the
+        answer incrementally while the LLM generates it.
+
         Returns:
             None
         """
-        RagCreatorCrew().crew().kickoff(inputs={
+        if self.state.stream:
+            print("Risposta RAG (streaming):")
+        reset_crew(self._rag_creator_crew()).kickoff(inputs={
             "question": self.state.question
         })
 
@@ -136,7 +343,7 @@ class RagMed(Flow[SearchState]):
             None
         """
         print("Searching the internet with DuckDuckGo")
-        SearchSummarizeCrew().crew().kickoff(inputs={
+        reset_crew(self._search_summarize_crew()).kickoff(inputs={
             "topic": self.state.question
         })
 
@@ -0,0 +1,358 @@
+"""Lexical BM25 index and hybrid (BM25 + dense) retrieval.
+
+`BM25Index` is an in-process inverted index over the same chunks stored in
+the FAISS vector store. Postings are kept as CSR numpy arrays with the BM25
+term weight precomputed per (term, chunk), so a query is a handful of array
+slices plus one ``bincount``. The index is saved next to the FAISS artifacts
+as a plain ``.npz`` file (no pickle).
+
+`HybridRetriever` runs the dense and the lexical search and merges the two
+rankings with reciprocal-rank fusion (`reciprocal_rank_fusion`), which helps
+exact-term queries such as drug names and codes.
+"""
+from __future__ import annotations
+
+import os
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from rag_med.tools.faiss_indexes import embed_query, search_ids
+
+BM25_FILE = "bm25.npz"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split `text` into lowercase word tokens; codes like ``A10BA02`` stay whole.
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        List[str]: Tokens.
+
+    Examples:
+        >>> tokenize("Metformina (ATC A10BA02), 500mg")
+        ['metformina', 'atc', 'a10ba02', '500mg']
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of chunks.
+
+    Args:
+        doc_ids (np.ndarray): Docstore id of each chunk (unicode array).
+        terms (np.ndarray): Sorted vocabulary (unicode array).
+        indptr (np.ndarray): CSR offsets into `postings`/`weights`, one per term + 1.
+        postings (np.ndarray): Chunk positions, grouped by term.
+        weights (np.ndarray): Precomputed BM25 weight of each posting.
+
+    Examples:
+        >>> bm25 = BM25Index.from_texts(
+        ...     ["a", "b", "c"],
+        ...     ["aspirina e febbre", "metformina A10BA02", "febbre alta"],
+        ... )
+        >>> [doc_id for doc_id, _ in bm25.search("codice A10BA02", k=2)]
+        ['b']
+        >>> [doc_id for doc_id, _ in bm25.search("febbre", k=2)]
+        ['c', 'a']
+    """
+
+    def __init__(
+        self,
+        doc_ids: np.ndarray,
+        terms: np.ndarray,
+        indptr: np.ndarray,
+        postings: np.ndarray,
+        weights: np.ndarray,
+    ) -> None:
+        self.doc_ids = doc_ids
+        self.terms = terms
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+
+    @classmethod
+    def from_texts(
+        cls,
+        doc_ids: Sequence[str],
+        texts: Union[Iterable[str], Callable[[], Iterable[str]]],
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """Build the index from chunk ids and texts.
+
+        The texts are read twice: the first pass collects the vocabulary,
+        document frequencies and lengths, the second writes every posting and
+        its weight straight into the final arrays. Peak memory is therefore
+        the size of the index plus the vocabulary, with no per-posting Python
+        objects.
+
+        Args:
+            doc_ids (Sequence[str]): Docstore ids, one per text.
+            texts (Iterable[str] | Callable[[], Iterable[str]]): Chunk texts,
+                or a callable returning a fresh iterator over them (e.g. a
+                stream from the docstore); a one-shot iterator is buffered.
+            k1 (float): Term-frequency saturation.
+            b (float): Length normalization.
+
+        Returns:
+            BM25Index: The index.
+        """
+        if not callable(texts):
+            items = texts if isinstance(texts, Sequence) else list(texts)
+            texts = lambda: items
+
+        # 1a passata: vocabolario, document frequency e lunghezze
+        vocab: Dict[str, int] = {}
+        df_by_id = array("q")
+        lengths = array("i")
+        for text in texts():
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term in set(tokens):
+                term_id = vocab.setdefault(term, len(vocab))
+                if term_id == len(df_by_id):
+                    df_by_id.append(0)
+                df_by_id[term_id] += 1
+
+        n = len(lengths)
+        doc_len = np.frombuffer(lengths, dtype=np.int32).astype(np.float32) if n else np.empty(0, np.float32)
+        avgdl = float(doc_len.mean()) if n and doc_len.mean() > 0 else 1.0
+        terms = sorted(vocab)
+        order = np.fromiter((vocab[term] for term in terms), dtype=np.int64, count=len(terms))
+        df_by_id = np.frombuffer(df_by_id, dtype=np.int64) if len(df_by_id) else np.empty(0, np.int64)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df_by_id[order], out=indptr[1:])
+        # Prossima posizione libera di ogni termine, per id di inserimento
+        cursor = np.empty(len(terms), dtype=np.int64)
+        cursor[order] = indptr[:-1]
+        idf_by_id = np.log1p((n - df_by_id + 0.5) / (df_by_id + 0.5)).astype(np.float32)
+
+        # 2a passata: postings e pesi scritti direttamente al loro posto
+        postings = np.empty(indptr[-1], dtype=np.int32)
+        weights = np.empty(indptr[-1], dtype=np.float32)
+        for pos, text in enumerate(texts()):
+            counts = Counter(tokenize(text))
+            if not counts:
+                continue
+            ids = np.fromiter((vocab[term] for term in counts), dtype=np.int64, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            slots = cursor[ids]
+            norm = k1 * (1.0 - b + b * doc_len[pos] / avgdl)
+            postings[slots] = pos
+            weights[slots] = idf_by_id[ids] * tf * (k1 + 1.0) / (tf + norm)
+            cursor[ids] += 1
+
+        return cls(
+            doc_ids=np.asarray(list(doc_ids), dtype=str),
+            terms=np.asarray(terms, dtype=str),
+            indptr=indptr,
+            postings=postings,
+            weights=weights,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def _term_rows(self, tokens: List[str]) -> np.ndarray:
+        query = np.unique(np.asarray(tokens, dtype=str))
+        rows = np.searchsorted(self.terms, query)
+        found = rows < len(self.terms)
+        rows, query = rows[found], query[found]
+        return rows[self.terms[rows] == query]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return the `k` best-scoring chunk ids for `query`.
+
+        Args:
+            query (str): Query text.
+            k (int): Number of results.
+
+        Returns:
+            List[Tuple[str, float]]: ``(doc_id, score)`` pairs, best first;
+            chunks sharing no term with the query are never returned.
+        """
+        rows = self._term_rows(tokenize(query))
+        if not len(rows) or k <= 0:
+            return []
+        slices = [slice(self.indptr[r], self.indptr[r + 1]) for r in rows]
+        positions = np.concatenate([self.postings[s] for s in slices])
+        scores = np.bincount(
+            positions,
+            weights=np.concatenate([self.weights[s] for s in slices]),
+            minlength=len(self.doc_ids),
+        )
+        candidates = np.unique(positions)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(str(self.doc_ids[p]), float(scores[p])) for p in candidates]
+
+    def save(self, path: str) -> None:
+        """Write the index to `path` atomically (``.npz``, no pickle)."""
+        tmp = Path(str(path) + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                doc_ids=self.doc_ids,
+                terms=self.terms,
+                indptr=self.indptr,
+                postings=self.postings,
+                weights=self.weights,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Read an index written by `save`."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+
+def bm25_from_vectorstore(vector_store: FAISS) -> BM25Index:
+    """Build a `BM25Index` over every chunk currently in `vector_store`.
+
+    Args:
+        vector_store (FAISS): Vector store whose docstore holds the chunk texts.
+
+    Returns:
+        BM25Index: The index, aligned with the docstore ids.
+    """
+    doc_ids = list(vector_store.index_to_docstore_id.values())
+
+    def texts() -> Iterable[str]:
+        # Generatore: con il docstore SQLite i testi non sono mai tutti in memoria
+        for doc_id in doc_ids:
+            doc = vector_store.docstore.search(doc_id)
+            yield doc.page_content if isinstance(doc, Document) else ""
+
+    return BM25Index.from_texts(doc_ids, texts)
+
+
+def load_or_build_bm25(persist_dir: str, vector_store: FAISS) -> BM25Index:
+    """Load the persisted BM25 index, building and saving it if missing.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+        vector_store (FAISS): Vector store used to build a missing index.
+
+    Returns:
+        BM25Index: The index.
+    """
+    path = Path(persist_dir) / BM25_FILE
+    if path.exists():
+        return BM25Index.load(str(path))
+    bm25 = bm25_from_vectorstore(vector_store)
+    bm25.save(str(path))
+    return bm25
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge rankings with reciprocal-rank fusion: ``score = sum 1 / (k + rank)``.
+
+    Args:
+        rankings (Iterable[Sequence[str]]): Ranked id lists, best first.
+        k (int): Damping constant; 60 is the usual choice.
+
+    Returns:
+        List[Tuple[str, float]]: ``(id, fused score)`` pairs, best first.
+
+    Examples:
+        >>> [i for i, _ in reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])]
+        ['a', 'c', 'b']
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(
+    vector_store: FAISS,
+    bm25: BM25Index,
+    query: str,
+    k: int,
+    fetch_k: int,
+    rrf_k: int = 60,
+    query_vector: Optional[np.ndarray] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[Document]:
+    """Fuse the top `fetch_k` dense and BM25 hits of `query` and return the best `k`.
+
+    Args:
+        vector_store (FAISS): Dense vector store.
+        bm25 (BM25Index): Lexical index over the same chunks.
+        query (str): Query text.
+        k (int): Documents returned.
+        fetch_k (int): Candidates taken from each ranker.
+        rrf_k (int): Reciprocal-rank fusion constant.
+        query_vector (np.ndarray | None): Precomputed query embedding.
+        nprobe (int | None): IVF cells visited by the dense search.
+        ef_search (int | None): HNSW candidate list size for the dense search.
+
+    Returns:
+        List[Document]: Fused results, best first.
+    """
+    if query_vector is None:
+        query_vector = embed_query(vector_store, query)
+    fetch_k = max(fetch_k, k)
+    dense = [doc_id for doc_id, _ in search_ids(vector_store, query_vector, fetch_k, nprobe, ef_search)[0]]
+    lexical = [doc_id for doc_id, _ in bm25.search(query, fetch_k)]
+    docs = []
+    for doc_id, _ in reciprocal_rank_fusion([dense, lexical], k=rrf_k)[:k]:
+        doc = vector_store.docstore.search(doc_id)
+        if isinstance(doc, Document):
+            docs.append(doc)
+    return docs
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense + BM25 retriever merged with reciprocal-rank fusion.
+
+    ``k`` and ``fetch_k`` can be overridden per call, e.g.
+    ``retriever.invoke(question, k=8)``.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: FAISS
+    bm25: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        fetch_k: Optional[int] = None,
+    ) -> List[Document]:
+        return hybrid_search(
+            self.vector_store,
+            self.bm25,
+            query,
+            k or self.k,
+            fetch_k or self.fetch_k,
+            rrf_k=self.rrf_k,
+            nprobe=self.nprobe,
+            ef_search=self.ef_search,
+        )
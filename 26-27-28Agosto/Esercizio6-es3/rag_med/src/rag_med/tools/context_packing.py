@@ -0,0 +1,209 @@
+"""Token-budgeted packing of retrieved chunks into the prompt context.
+
+`pack_context` turns the ranked documents returned by the retriever into a
+compact context string: adjacent chunks of the same source that overlap are
+merged, near-duplicate passages are dropped, passages are grouped under one
+``[source:...]`` header per source, and the lowest-ranked passages are
+truncated first when the token budget is exceeded. `PackedContext` reports
+how many tokens were saved compared to concatenating every chunk verbatim.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain.schema import Document
+
+from rag_med.tools.splitting import count_tokens
+
+MIN_OVERLAP_CHARS = 20
+
+
+@dataclass
+class PackedContext:
+    """Result of `pack_context`.
+
+    Attributes:
+        text (str): Context string for the prompt.
+        tokens (int): Tokens in `text`.
+        original_tokens (int): Tokens of the unpacked, one-header-per-chunk format.
+        passages (int): Passages kept after merging and deduplication.
+        dropped (int): Passages removed as near-duplicates or over budget.
+    """
+    text: str
+    tokens: int
+    original_tokens: int
+    passages: int
+    dropped: int
+
+    @property
+    def saved_tokens(self) -> int:
+        """Prompt tokens saved by packing."""
+        return self.original_tokens - self.tokens
+
+
+@dataclass
+class _Passage:
+    source: str
+    text: str
+    rank: int
+
+
+def _source(doc: Document, rank: int) -> str:
+    return doc.metadata.get("source", f"doc{rank + 1}")
+
+
+def merge_overlap(a: str, b: str, min_overlap: int = MIN_OVERLAP_CHARS) -> Optional[str]:
+    """Join `a` and `b` if the end of `a` repeats the start of `b`.
+
+    Args:
+        a (str): Earlier chunk.
+        b (str): Later chunk.
+        min_overlap (int): Minimum shared characters.
+
+    Returns:
+        str | None: The merged text, or None if the chunks do not overlap.
+
+    Examples:
+        >>> merge_overlap("uno due tre quattro cinque", "tre quattro cinque sei", 10)
+        'uno due tre quattro cinque sei'
+        >>> merge_overlap("uno due", "tre quattro", 3) is None
+        True
+    """
+    probe = b[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    start = a.find(probe, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return a[:start] + b
+        start = a.find(probe, start + 1)
+    return None
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    words = text.split()
+    lo, hi = 0, len(words)
+    while lo < hi:  # ricerca binaria sul numero di parole che sta nel budget
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid]) + " ...") <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo]) + " ..." if lo else ""
+
+
+def _render(groups: Dict[str, List[str]]) -> str:
+    return "\n\n".join(
+        f"[source:{src}]\n" + "\n\n".join(passages) for src, passages in groups.items()
+    )
+
+
+def unpacked_context(docs: List[Document]) -> str:
+    """Return the verbatim format: one ``[source:...]`` tag per chunk.
+
+    Args:
+        docs (List[Document]): Retrieved documents.
+
+    Returns:
+        str: Concatenated chunks.
+    """
+    return "\n\n".join(f"[source:{_source(d, i)}] {d.page_content}" for i, d in enumerate(docs))
+
+
+def pack_context(
+    docs: List[Document],
+    max_tokens: Optional[int] = None,
+    dedupe_threshold: float = 0.9,
+) -> PackedContext:
+    """Pack ranked documents into a compact, token-bounded context.
+
+    Args:
+        docs (List[Document]): Retrieved documents, best first.
+        max_tokens (int | None): Token budget for the context; ``None`` means
+            no limit (merging and deduplication still apply).
+        dedupe_threshold (float): A passage is dropped when this fraction of
+            its word 3-grams already appears in a better-ranked passage.
+
+    Returns:
+        PackedContext: Context text and token accounting.
+
+    Examples:
+        >>> docs = [
+        ...     Document(page_content="FAISS indicizza vettori densi in memoria.", metadata={"source": "f.md"}),
+        ...     Document(page_content="vettori densi in memoria. Supporta IVF e HNSW.", metadata={"source": "f.md"}),
+        ...     Document(page_content="FAISS indicizza vettori densi in memoria.", metadata={"source": "g.md"}),
+        ... ]
+        >>> packed = pack_context(docs)
+        >>> print(packed.text)
+        [source:f.md]
+        FAISS indicizza vettori densi in memoria. Supporta IVF e HNSW.
+        >>> packed.saved_tokens > 0, packed.dropped
+        (True, 1)
+    """
+    passages = [_Passage(_source(d, i), d.page_content.strip(), i) for i, d in enumerate(docs)]
+
+    # 1) Unisce chunk adiacenti della stessa fonte che si sovrappongono
+    merged = True
+    while merged:
+        merged = False
+        for i, a in enumerate(passages):
+            for j, b in enumerate(passages):
+                if i == j or a.source != b.source:
+                    continue
+                text = merge_overlap(a.text, b.text)
+                if text is not None:
+                    a.text, a.rank = text, min(a.rank, b.rank)
+                    del passages[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    # 2) Scarta i quasi-duplicati, tenendo il passaggio meglio classificato
+    passages.sort(key=lambda p: p.rank)
+    kept: List[_Passage] = []
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    for passage in passages:
+        shingles = _shingles(passage.text)
+        if any(len(shingles & other) >= dedupe_threshold * len(shingles) for other in kept_shingles):
+            continue
+        kept.append(passage)
+        kept_shingles.append(shingles)
+
+    # 3) Budget: i passaggi peggio classificati vengono troncati o esclusi per primi
+    groups: Dict[str, List[str]] = {}
+    for passage in kept:
+        groups.setdefault(passage.source, []).append(passage.text)
+        if max_tokens is None or count_tokens(_render(groups)) <= max_tokens:
+            continue
+        groups[passage.source].pop()
+        if not groups[passage.source]:
+            del groups[passage.source]
+        used = count_tokens(_render(groups))
+        room = max_tokens - used - count_tokens(f"\n\n[source:{passage.source}]\n")
+        text = _truncate(passage.text, room) if room > 0 else ""
+        if text:
+            groups.setdefault(passage.source, []).append(text)
+            if count_tokens(_render(groups)) > max_tokens:
+                groups[passage.source].pop()
+                if not groups[passage.source]:
+                    del groups[passage.source]
+        break
+
+    text = _render(groups)
+    passages_out = sum(len(p) for p in groups.values())
+    return PackedContext(
+        text=text,
+        tokens=count_tokens(text),
+        original_tokens=count_tokens(unpacked_context(docs)),
+        passages=passages_out,
+        dropped=len(passages) - passages_out,
+    )
@@ -1,7 +1,9 @@
 """Custom tool that exposes a simple RAG answer function to agents.
 
 `MyCustomTool` wraps the `rag_answer` function so that agents can retrieve a
-grounded answer from a preconfigured RAG chain.
+grounded answer from a preconfigured RAG chain. The chain is taken from the
+process-wide registry in `rag_faiss_lmstudio`, so it is built only once. With
+``stream=True`` the answer is printed token by token while it is generated.
 """
 from typing import Type
 
@@ -23,7 +25,7 @@ class MyCustomTool(BaseTool):
         "RAG tool containing relevant information for retrieval-augmented generation."
     )
     args_schema: Type[BaseModel] = MyCustomToolInput
-    
+    stream: bool = False
 
     def _run(self, question: str) -> str:
         """Return a RAG-grounded answer to the provided question.
@@ -39,4 +41,15 @@ class MyCustomTool(BaseTool):
             >>> isinstance(tool._run, object)
             True
         """
-        return rag_faiss_lmstudio.rag_answer(question, rag_faiss_lmstudio.setup())
+        components = rag_faiss_lmstudio.get_rag_components()
+        if not self.stream:
+            return rag_faiss_lmstudio.rag_answer(question, components.chain, components.answer_cache)
+
+        parts = []
+        for token in rag_faiss_lmstudio.rag_answer_stream(
+            question, components.chain, components.answer_cache
+        ):
+            print(token, end="", flush=True)
+            parts.append(token)
+        print()
+        return "".join(parts)
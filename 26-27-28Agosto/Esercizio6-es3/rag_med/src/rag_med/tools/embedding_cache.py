@@ -0,0 +1,259 @@
+"""Persistent, size-bounded cache in front of an embeddings client.
+
+`CachedEmbeddings` wraps any LangChain `Embeddings` and stores every vector in
+a local SQLite file as packed float32. Entries are keyed by the embedding
+deployment and the hash of the normalized text, evicted in LRU order once the
+configured size cap is exceeded, and hit/miss counters are kept per instance.
+
+The entry count is tracked in memory, and access times of cache hits are
+buffered and written in batches, so a hit costs a single ``SELECT``.
+"""
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite"
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text before hashing: Unicode NFC and collapsed whitespace.
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        str: Normalized text.
+
+    Examples:
+        >>> normalize_text("  Ciao\\n  mondo ")
+        'Ciao mondo'
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(deployment: str, text: str) -> str:
+    """Return the cache key for `text` embedded with `deployment`.
+
+    Args:
+        deployment (str): Embedding deployment or model name.
+        text (str): Text to embed.
+
+    Returns:
+        str: Hex sha256 digest.
+
+    Examples:
+        >>> cache_key("d", "a  b") == cache_key("d", "a b")
+        True
+        >>> cache_key("d1", "a") == cache_key("d2", "a")
+        False
+    """
+    payload = f"{deployment}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper backed by an on-disk SQLite LRU cache.
+
+    Args:
+        underlying (Embeddings): Client used on cache misses.
+        path (str): SQLite file path (``":memory:"`` for a volatile cache).
+        deployment (str): Deployment name, part of the cache key.
+        max_entries (int): Maximum number of cached vectors.
+        touch_batch_size (int): Cache hits whose access time is buffered
+            before being written; they are also written before an eviction
+            and by `close`.
+
+    Examples:
+        >>> class _Fake(Embeddings):
+        ...     def embed_documents(self, texts):
+        ...         return [[float(len(t)), 1.0] for t in texts]
+        ...     def embed_query(self, text):
+        ...         return self.embed_documents([text])[0]
+        >>> emb = CachedEmbeddings(_Fake(), ":memory:", "fake", max_entries=2)
+        >>> emb.embed_documents(["ab", "abc", "ab"])
+        [[2.0, 1.0], [3.0, 1.0], [2.0, 1.0]]
+        >>> emb.embed_query("abc")
+        [3.0, 1.0]
+        >>> emb.stats()["hits"], emb.stats()["misses"]
+        (2, 2)
+    """
+
+    # Limite SQLite sul numero di parametri in una singola query
+    _MAX_PARAMS = 500
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        path: str,
+        deployment: str,
+        max_entries: int = 100_000,
+        touch_batch_size: int = 256,
+    ) -> None:
+        self.underlying = underlying
+        self.path = path
+        self.deployment = deployment
+        self.max_entries = max_entries
+        self.touch_batch_size = touch_batch_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " deployment TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access"
+                " ON embeddings(last_access)"
+            )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(keys), self._MAX_PARAMS):
+            batch = keys[start:start + self._MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        if found:
+            now = time.time()
+            self._touched.update((key, now) for key in found)
+            if len(self._touched) >= self.touch_batch_size:
+                self._flush_touches()
+        return found
+
+    def _flush_touches(self) -> None:
+        if not self._touched:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._touched.items()],
+            )
+        self._touched.clear()
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._conn:
+            # Una chiave gia' presente (miss concorrente) non e' contata due volte
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, deployment, vector, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (key, self.deployment, np.asarray(vec, dtype=np.float32).tobytes(), now)
+                    for key, vec in items.items()
+                ],
+            )
+            self._size += cursor.rowcount
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                # Accessi recenti su disco prima di scegliere le voci da eliminare
+                self._flush_touches()
+                # Evict LRU: le voci con accesso piu' vecchio
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._size -= overflow
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed `texts`, calling the underlying client only for cache misses.
+
+        Args:
+            texts (List[str]): Texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text, in input order.
+        """
+        keys = [cache_key(self.deployment, t) for t in texts]
+        with self._lock:
+            found = self._lookup(list(set(keys)))
+
+        # Deduplica i miss: ogni testo mancante viene inviato una sola volta
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query, using the cache when possible.
+
+        Args:
+            text (str): Query text.
+
+        Returns:
+            List[float]: The query vector.
+        """
+        key = cache_key(self.deployment, text)
+        with self._lock:
+            found = self._lookup([key])
+        if key in found:
+            with self._lock:
+                self.hits += 1
+            return found[key]
+
+        vector = self.underlying.embed_query(text)
+        with self._lock:
+            self._store({key: vector})
+            self.misses += 1
+        return vector
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of cached vectors.
+
+        Returns:
+            Dict[str, float]: ``hits``, ``misses``, ``hit_rate`` and ``size``.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": self._size,
+            }
+
+    def close(self) -> None:
+        """Write the buffered access times and close the SQLite connection."""
+        with self._lock:
+            self._flush_touches()
+            self._conn.close()
+
+    def clear(self) -> None:
+        """Remove every cached vector and reset the counters."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+            self._touched.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
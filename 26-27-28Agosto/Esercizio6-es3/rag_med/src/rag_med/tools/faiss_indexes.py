@@ -0,0 +1,599 @@
+"""Pluggable FAISS index types for the RAG vector store.
+
+`IndexSpec` describes the index to build (Flat, IVFFlat, HNSW, IVFPQ, or one
+of the compressed stores SQ8, SQfp16 and binary) and its build/search
+parameters. `create_index` builds and trains an empty index
+on a sample of the vectors, `save_index_params`/`read_index_params` persist
+the parameters next to the index, and `FaissRetriever` exposes the search-time
+knobs (``nprobe``, ``ef_search``) per query through FAISS search parameters.
+`MMRRetriever` re-ranks the candidates with a vectorized MMR (`mmr_select`)
+over vectors reconstructed from the index.
+"""
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+INDEX_PARAMS_FILE = "index_params.json"
+
+INDEX_TYPES = ("flat", "ivfflat", "hnsw", "ivfpq", "sq8", "sqfp16", "binary")
+
+# Stringhe index_factory dei vettori completi: indici "sq8"/"sqfp16" e re-scoring di "binary"
+REFINE_TYPES = {"flat": "Flat", "sqfp16": "SQfp16", "sq8": "SQ8"}
+
+
+@dataclass
+class IndexSpec:
+    """Type and parameters of the FAISS index.
+
+    The compressed types trade a little recall for memory: "sqfp16" stores
+    each dimension in 2 bytes, "sq8" in 1 byte, and "binary" keeps a
+    ``lsh_nbits``-bit hash per vector, searched by Hamming distance, whose top
+    ``k * k_factor`` candidates are re-scored on a `refine` copy of the
+    vectors (read from the memory-mapped file on demand).
+
+    Attributes:
+        index_type (str): One of "flat", "ivfflat", "hnsw", "ivfpq", "sq8",
+            "sqfp16", "binary".
+        nlist (int): Number of IVF cells (clamped to the training set size).
+        nprobe (int): IVF cells visited per query (search time).
+        hnsw_m (int): HNSW graph degree.
+        ef_construction (int): HNSW candidate list size while building.
+        ef_search (int): HNSW candidate list size per query (search time).
+        pq_m (int): PQ sub-quantizers; must divide the embedding dimension.
+        pq_nbits (int): Bits per PQ code.
+        lsh_nbits (int): Bits per binary hash; 0 means the embedding dimension.
+        refine (str): Re-scoring vectors of the binary index: "flat",
+            "sqfp16" or "sq8".
+        k_factor (float): Binary candidates re-scored per result (search
+            time). Recall@k grows with it: about 0.67 at 4 and 0.975 at 16 in
+            ``benchmarks/bench_quantization.py`` (sq8 refine, k=4), for under
+            0.2 ms more per query.
+        train_sample_size (int): Maximum vectors used for training.
+        seed (int): Seed for the training sample.
+    """
+    index_type: str = "flat"
+    # IVF
+    nlist: int = 1024
+    nprobe: int = 8
+    # HNSW
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    # PQ
+    pq_m: int = 16
+    pq_nbits: int = 8
+    # Binario + re-scoring
+    lsh_nbits: int = 0
+    refine: str = "sq8"
+    k_factor: float = 16.0
+    # Training
+    train_sample_size: int = 50_000
+    seed: int = 42
+
+
+def build_params(spec: IndexSpec) -> Dict[str, Any]:
+    """Return the parameters that require a rebuild when they change.
+
+    Args:
+        spec (IndexSpec): Index specification.
+
+    Returns:
+        Dict[str, Any]: Build-time parameters only.
+
+    Examples:
+        >>> build_params(IndexSpec())
+        {'index_type': 'flat'}
+        >>> build_params(IndexSpec(index_type="hnsw", ef_search=10))
+        {'index_type': 'hnsw', 'hnsw_m': 32, 'ef_construction': 200}
+        >>> build_params(IndexSpec(index_type="binary", k_factor=8))
+        {'index_type': 'binary', 'lsh_nbits': 0, 'refine': 'sq8'}
+    """
+    if spec.index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type non supportato: {spec.index_type!r} (ammessi: {INDEX_TYPES})")
+    params: Dict[str, Any] = {"index_type": spec.index_type}
+    if spec.index_type in ("ivfflat", "ivfpq"):
+        params["nlist"] = spec.nlist
+    if spec.index_type == "hnsw":
+        params.update(hnsw_m=spec.hnsw_m, ef_construction=spec.ef_construction)
+    if spec.index_type == "ivfpq":
+        params.update(pq_m=spec.pq_m, pq_nbits=spec.pq_nbits)
+    if spec.index_type == "binary":
+        if spec.refine not in REFINE_TYPES:
+            raise ValueError(f"refine non supportato: {spec.refine!r} (ammessi: {tuple(REFINE_TYPES)})")
+        params.update(lsh_nbits=spec.lsh_nbits, refine=spec.refine)
+    return params
+
+
+def _training_sample(vectors: np.ndarray, spec: IndexSpec) -> np.ndarray:
+    if len(vectors) <= spec.train_sample_size:
+        return vectors
+    rng = np.random.default_rng(spec.seed)
+    rows = rng.choice(len(vectors), spec.train_sample_size, replace=False)
+    return vectors[np.sort(rows)]
+
+
+def create_index(spec: IndexSpec, vectors: np.ndarray) -> Tuple[faiss.Index, Dict[str, Any]]:
+    """Create an empty, trained FAISS index for `vectors`.
+
+    IVF indexes train on a sample of at most `spec.train_sample_size` vectors;
+    ``nlist`` is clamped so every cell gets enough training points. Corpora too
+    small to train PQ codebooks fall back to IVFFlat. SQ8 learns per-dimension
+    ranges and the binary index its rotation and thresholds on the same sample.
+
+    Args:
+        spec (IndexSpec): Index specification.
+        vectors (np.ndarray): Float32 matrix of the vectors that will be added.
+
+    Returns:
+        Tuple[faiss.Index, dict]: The index and its effective parameters.
+
+    Examples:
+        >>> x = np.random.default_rng(0).random((200, 8), dtype=np.float32)
+        >>> index, params = create_index(IndexSpec(index_type="ivfflat", nlist=64), x)
+        >>> index.is_trained, params["effective"]["nlist"]
+        (True, 5)
+        >>> index, _ = create_index(IndexSpec(index_type="binary"), x)
+        >>> index.add(x); int(index.search(x[:1], 1)[1][0, 0])
+        0
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    effective = build_params(spec)
+    index_type = spec.index_type
+
+    if index_type == "ivfpq" and n < 2 ** spec.pq_nbits:
+        index_type = "ivfflat"  # troppi pochi punti per addestrare i codebook PQ
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, spec.hnsw_m)
+        index.hnsw.efConstruction = spec.ef_construction
+    elif index_type in ("sq8", "sqfp16"):
+        index = faiss.index_factory(dim, REFINE_TYPES[index_type])
+    elif index_type == "binary":
+        # LSH con rotazione casuale e soglie apprese; Refine ricalcola la distanza L2
+        nbits = spec.lsh_nbits or dim
+        index = faiss.index_factory(dim, f"LSH{nbits}rt,Refine({REFINE_TYPES[spec.refine]})")
+        effective["lsh_nbits"] = nbits
+    else:
+        # FAISS consiglia almeno 39 punti di training per cella
+        nlist = max(1, min(spec.nlist, n // 39))
+        suffix = "Flat" if index_type == "ivfflat" else f"PQ{spec.pq_m}x{spec.pq_nbits}"
+        index = faiss.index_factory(dim, f"IVF{nlist},{suffix}")
+        effective["nlist"] = nlist
+
+    if not index.is_trained:
+        index.train(_training_sample(vectors, spec))
+
+    effective["index_type"] = index_type
+    params = {"requested": build_params(spec), "effective": effective, "dim": dim}
+    apply_search_params(index, spec.nprobe, spec.ef_search, spec.k_factor)
+    return index, params
+
+
+def apply_search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    k_factor: Optional[float] = None,
+) -> None:
+    """Set the default search-time parameters on `index`, where applicable.
+
+    Args:
+        index (faiss.Index): Index to configure.
+        nprobe (int | None): IVF cells visited per query.
+        ef_search (int | None): HNSW candidate list size per query.
+        k_factor (float | None): Candidates re-scored per result by a refine index.
+    """
+    ivf = _ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = nprobe
+    hnsw = _hnsw(index)
+    if hnsw is not None and ef_search:
+        hnsw.hnsw.efSearch = ef_search
+    refine = _refine(index)
+    if refine is not None and k_factor:
+        refine.k_factor = k_factor
+
+
+def _ivf(index: faiss.Index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _hnsw(index: faiss.Index):
+    index = faiss.downcast_index(index)
+    return index if isinstance(index, faiss.IndexHNSW) else None
+
+
+def _refine(index: faiss.Index):
+    index = faiss.downcast_index(index)
+    return index if isinstance(index, faiss.IndexRefine) else None
+
+
+def search_parameters(
+    index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+) -> Optional[faiss.SearchParameters]:
+    """Build per-query FAISS search parameters for `index`.
+
+    Unlike `apply_search_params`, the returned object affects a single
+    ``index.search`` call and is safe to use from concurrent threads.
+
+    Args:
+        index (faiss.Index): Index that will be searched.
+        nprobe (int | None): IVF cells visited for this query.
+        ef_search (int | None): HNSW candidate list size for this query.
+
+    Returns:
+        faiss.SearchParameters | None: Parameters, or None if nothing applies.
+    """
+    if nprobe and _ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search and _hnsw(index) is not None:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def embed_query(vector_store: FAISS, text: str) -> np.ndarray:
+    """Embed `text` with the embedding function of `vector_store`.
+
+    Args:
+        vector_store (FAISS): Vector store holding the embedding function.
+        text (str): Query text.
+
+    Returns:
+        np.ndarray: Float32 query vector.
+    """
+    fn = vector_store.embedding_function
+    vector = fn.embed_query(text) if isinstance(fn, Embeddings) else fn(text)
+    return np.asarray(vector, dtype=np.float32)
+
+
+def _search(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+    params = search_parameters(index, nprobe, ef_search)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def search_ids(
+    vector_store: FAISS,
+    queries: np.ndarray,
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[List[Tuple[str, float]]]:
+    """Search a batch of query vectors, returning docstore ids only.
+
+    Args:
+        vector_store (FAISS): Vector store to search.
+        queries (np.ndarray): Float32 matrix, one query per row.
+        k (int): Results per query.
+        nprobe (int | None): IVF cells visited.
+        ef_search (int | None): HNSW candidate list size.
+
+    Returns:
+        List[List[Tuple[str, float]]]: ``(docstore id, L2 distance)`` pairs
+        per query, best first.
+    """
+    scores, positions = _search(vector_store.index, queries, k, nprobe, ef_search)
+    id_map = vector_store.index_to_docstore_id
+    return [
+        [(id_map[pos], float(score)) for score, pos in zip(row_scores, row_positions) if pos != -1]
+        for row_scores, row_positions in zip(scores, positions)
+    ]
+
+
+def search_vectors(
+    vector_store: FAISS,
+    queries: np.ndarray,
+    k: int,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """Search a batch of query vectors with optional per-query parameters.
+
+    Args:
+        vector_store (FAISS): Vector store to search.
+        queries (np.ndarray): Float32 matrix, one query per row.
+        k (int): Results per query.
+        nprobe (int | None): IVF cells visited.
+        ef_search (int | None): HNSW candidate list size.
+
+    Returns:
+        List[List[Tuple[Document, float]]]: ``(document, L2 distance)`` pairs
+        per query, best first.
+    """
+    results = []
+    for row in search_ids(vector_store, queries, k, nprobe, ef_search):
+        hits = []
+        for doc_id, score in row:
+            doc = vector_store.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                hits.append((doc, score))
+        results.append(hits)
+    return results
+
+
+def reconstruct_vectors(index: faiss.Index, positions: np.ndarray) -> np.ndarray:
+    """Return the stored vectors at `positions`, without re-embedding.
+
+    IVF indexes get a direct map on first use. PQ and SQ indexes return the
+    approximate (decoded) vectors; the binary index returns its refine vectors.
+
+    Args:
+        index (faiss.Index): Index holding the vectors.
+        positions (np.ndarray): Index positions.
+
+    Returns:
+        np.ndarray: Float32 matrix, one row per position.
+
+    Raises:
+        RuntimeError: If the index type cannot reconstruct vectors.
+    """
+    ivf = _ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """Greedy maximal marginal relevance over candidate vectors.
+
+    Cosine relevance to the query is computed once; each selection adds one
+    row of candidate-candidate similarities and updates the running maximum
+    redundancy with ``np.maximum``, so the cost is O(k * n * d) with no Python
+    loop over the candidates. The result matches LangChain's
+    ``maximal_marginal_relevance``.
+
+    Args:
+        query (np.ndarray): Query vector.
+        candidates (np.ndarray): Candidate vectors, one per row.
+        k (int): Number of candidates to select.
+        lambda_mult (float): 1 = pure relevance, 0 = maximum diversity.
+
+    Returns:
+        List[int]: Selected row indices, in selection order.
+
+    Examples:
+        >>> c = np.array([[1.0, 0.0], [0.99, 0.1], [0.6, 0.8]], dtype=np.float32)
+        >>> mmr_select(np.array([1.0, 0.2]), c, k=2, lambda_mult=0.5)
+        [1, 2]
+        >>> mmr_select(np.array([1.0, 0.2]), c, k=2, lambda_mult=1.0)
+        [1, 0]
+    """
+    n = len(candidates)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    vectors = np.asarray(candidates, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    q = np.asarray(query, dtype=np.float32).ravel()
+    q = q / (np.linalg.norm(q) or 1.0)
+
+    relevance = vectors @ q
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < k:
+        # aggiornamento incrementale: solo la riga dell'ultimo selezionato
+        np.maximum(redundancy, vectors @ vectors[selected[-1]], out=redundancy)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def mmr_search(
+    vector_store: FAISS,
+    queries: np.ndarray,
+    k: int,
+    fetch_k: int,
+    lambda_mult: float = 0.5,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[List[Document]]:
+    """Fetch `fetch_k` candidates per query and re-rank them with MMR.
+
+    Candidate vectors are reconstructed from the FAISS index; only index types
+    that cannot reconstruct fall back to re-embedding the candidate texts.
+
+    Args:
+        vector_store (FAISS): Vector store to search.
+        queries (np.ndarray): Float32 matrix, one query per row.
+        k (int): Documents returned per query.
+        fetch_k (int): Candidates fetched per query.
+        lambda_mult (float): 1 = pure relevance, 0 = maximum diversity.
+        nprobe (int | None): IVF cells visited.
+        ef_search (int | None): HNSW candidate list size.
+
+    Returns:
+        List[List[Document]]: Selected documents per query, in MMR order.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    _, positions = _search(vector_store.index, queries, max(fetch_k, k), nprobe, ef_search)
+    results = []
+    for query, row in zip(queries, positions):
+        row = row[row != -1]
+        ids = [vector_store.index_to_docstore_id[pos] for pos in row]
+        try:
+            vectors = reconstruct_vectors(vector_store.index, row)
+            docs = None
+        except RuntimeError:
+            docs = [vector_store.docstore.search(doc_id) for doc_id in ids]
+            texts = [d.page_content if isinstance(d, Document) else "" for d in docs]
+            fn = vector_store.embedding_function
+            vectors = np.asarray(
+                fn.embed_documents(texts) if isinstance(fn, Embeddings) else [fn(t) for t in texts],
+                dtype=np.float32,
+            )
+        hits = []
+        for i in mmr_select(query, vectors, k, lambda_mult):
+            doc = docs[i] if docs is not None else vector_store.docstore.search(ids[i])
+            if isinstance(doc, Document):
+                hits.append(doc)
+        results.append(hits)
+    return results
+
+
+def remove_ids(vector_store: FAISS, ids: List[str]) -> None:
+    """Delete `ids` from the store, rebuilding indexes without ``remove_ids``.
+
+    HNSW and binary indexes do not support removal, and IVF removal keeps the
+    original positions while LangChain renumbers them: for these the surviving
+    vectors are reconstructed from the index and re-added to a fresh copy of
+    it (keeping the trained quantizer), so no re-embedding is needed.
+
+    Args:
+        vector_store (FAISS): Vector store, modified in place.
+        ids (List[str]): Docstore ids to delete.
+    """
+    index = vector_store.index
+    # IVF: remove_ids non compatta le posizioni, la mappa di LangChain si sfaserebbe
+    if _ivf(index) is None:
+        try:
+            vector_store.delete(ids)
+            return
+        except RuntimeError:
+            pass
+
+    to_delete = set(ids)
+    kept = [(pos, doc_id) for pos, doc_id in sorted(vector_store.index_to_docstore_id.items())
+            if doc_id not in to_delete]
+    vectors = reconstruct_vectors(index, np.asarray([pos for pos, _ in kept], dtype=np.int64))
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    if kept:
+        rebuilt.add(vectors)
+    vector_store.index = rebuilt
+    vector_store.docstore.delete(list(to_delete))
+    vector_store.index_to_docstore_id = {i: doc_id for i, (_, doc_id) in enumerate(kept)}
+
+
+def save_index_params(persist_dir: str, params: Dict[str, Any], spec: IndexSpec) -> None:
+    """Persist build and search parameters next to the index.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+        params (dict): Parameters returned by `create_index`.
+        spec (IndexSpec): Spec used for the build (for search defaults).
+    """
+    payload = dict(
+        params, search={"nprobe": spec.nprobe, "ef_search": spec.ef_search, "k_factor": spec.k_factor}
+    )
+    path = Path(persist_dir) / INDEX_PARAMS_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def read_index_params(persist_dir: str) -> Dict[str, Any]:
+    """Read the persisted index parameters.
+
+    Indexes saved before this file existed were always flat.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+
+    Returns:
+        dict: Persisted parameters.
+    """
+    path = Path(persist_dir) / INDEX_PARAMS_FILE
+    if not path.exists():
+        flat = build_params(IndexSpec())
+        return {"requested": flat, "effective": flat}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FaissRetriever(BaseRetriever):
+    """Similarity retriever with per-query FAISS search parameters.
+
+    ``k``, ``nprobe`` and ``ef_search`` can be overridden on each call, e.g.
+    ``retriever.invoke(question, nprobe=64)``, to trade recall for latency.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: FAISS
+    k: int = 4
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Document]:
+        hits = search_vectors(
+            self.vector_store,
+            embed_query(self.vector_store, query),
+            k or self.k,
+            nprobe=nprobe or self.nprobe,
+            ef_search=ef_search or self.ef_search,
+        )[0]
+        return [doc for doc, _ in hits]
+
+
+class MMRRetriever(BaseRetriever):
+    """MMR retriever over vectors reconstructed from the FAISS index.
+
+    ``k``, ``fetch_k`` and ``lambda_mult`` can be overridden per call, e.g.
+    ``retriever.invoke(question, fetch_k=200)``.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: FAISS
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        fetch_k: Optional[int] = None,
+        lambda_mult: Optional[float] = None,
+    ) -> List[Document]:
+        return mmr_search(
+            self.vector_store,
+            embed_query(self.vector_store, query),
+            k or self.k,
+            fetch_k or self.fetch_k,
+            lambda_mult=self.lambda_mult if lambda_mult is None else lambda_mult,
+            nprobe=self.nprobe,
+            ef_search=self.ef_search,
+        )[0]
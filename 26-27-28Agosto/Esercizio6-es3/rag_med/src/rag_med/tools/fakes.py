@@ -0,0 +1,214 @@
+"""Deterministic offline stand-ins for the Azure models, plus synthetic corpora.
+
+`HashEmbeddings` maps each word to a signed bucket of a fixed-size vector
+(feature hashing), so texts sharing words get similar vectors and retrieval
+behaves sensibly without any network call. `StubChatModel` answers by quoting
+the first passage of the prompt context, with an optional simulated latency.
+Both implement the LangChain interfaces returned by `get_embeddings` and
+`get_llm_from_lmstudio`, which return them when ``Settings.offline`` is set.
+
+`synthetic_documents` and `synthetic_queries` generate reproducible corpora of
+any size for the benchmarks in ``benchmarks/``.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from rag_med.tools.bm25 import tokenize
+
+_CONTEXT_RE = re.compile(r"Contesto \(estratti selezionati\):\n(.*?)(?:\n\n|$)", re.DOTALL)
+_SOURCE_RE = re.compile(r"\[source:([^\]]+)\]")
+
+_SYLLABLES = (
+    "ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "zo",
+    "tra", "pre", "con", "mol", "ster", "gli", "ana", "ide", "ossi", "cor",
+)
+
+
+@lru_cache(maxsize=1_000_000)
+def _bucket(token: str, dim: int) -> Tuple[int, float]:
+    h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return h % dim, 1.0 if (h >> 63) & 1 else -1.0
+
+
+class HashEmbeddings(Embeddings):
+    """Feature-hashing embeddings: deterministic, offline and fast.
+
+    Args:
+        dim (int): Vector size (Azure ``text-embedding-3-small`` uses 1536).
+
+    Examples:
+        >>> emb = HashEmbeddings(dim=64)
+        >>> a, b, c = emb.embed_documents(["metformina e glicemia", "glicemia e metformina", "FAISS IVF"])
+        >>> a == b, round(float(np.dot(a, a)), 3), bool(np.dot(a, b) > np.dot(a, c))
+        (True, 1.0, True)
+    """
+
+    def __init__(self, dim: int = 1536) -> None:
+        self.dim = dim
+
+    def embed_matrix(self, texts: List[str]) -> np.ndarray:
+        """Embed `texts` into a float32 matrix with unit-norm rows."""
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                col, sign = _bucket(token, self.dim)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        # Un solo bincount per tutto il batch invece di un ciclo per testo
+        flat = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(cols, dtype=np.int64)
+        matrix = np.bincount(flat, weights=signs, minlength=len(texts) * self.dim)
+        matrix = matrix.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_matrix([text])[0].tolist()
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model that answers by quoting the first passage of the context.
+
+    The answer cites the first ``[source:...]`` of the context, so the prompt
+    and citation format are exercised. Streaming yields one word per chunk.
+
+    Attributes:
+        latency (float): Seconds slept per call, to simulate generation time.
+        max_chars (int): Characters of the context quoted in the answer.
+
+    Examples:
+        >>> from langchain_core.messages import HumanMessage
+        >>> msg = "Domanda:\\nA cosa serve?\\n\\nContesto (estratti selezionati):\\n[source:f.md]\\nFAISS cerca vettori.\\n\\nIstruzioni:"
+        >>> StubChatModel().invoke([HumanMessage(content=msg)]).content
+        'FAISS cerca vettori. [source:f.md]'
+    """
+
+    latency: float = 0.0
+    max_chars: int = 200
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content) if messages else ""
+        match = _CONTEXT_RE.search(prompt)
+        context = match.group(1) if match else prompt
+        source = _SOURCE_RE.search(context)
+        body = _SOURCE_RE.sub("", context).strip()[: self.max_chars]
+        if not body:
+            return "Non è presente nel contesto fornito."
+        return f"{body} [source:{source.group(1)}]" if source else body
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = AIMessage(content=self._answer(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        words = self._answer(messages).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            token = word if i == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def _vocabulary(size: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    syllables = np.asarray(_SYLLABLES)
+    parts = rng.integers(0, len(syllables), size=(size, 4))
+    lengths = rng.integers(2, 5, size=size)
+    words = {"".join(syllables[row[:n]]) for row, n in zip(parts, lengths)}
+    # Ordine casuale: le parole frequenti (indici bassi) non condividono il prefisso
+    return rng.permutation(np.asarray(sorted(words)))
+
+
+def synthetic_documents(
+    n: int, words: int = 50, vocab_size: int = 20_000, seed: int = 0, batch: int = 10_000
+) -> Iterator[Document]:
+    """Yield `n` reproducible pseudo-Italian documents with Zipf word frequencies.
+
+    With the default size every document fits in one ``recursive`` chunk, so
+    `n` is also the number of indexed chunks.
+
+    Args:
+        n (int): Number of documents.
+        words (int): Words per document.
+        vocab_size (int): Distinct words drawn (before deduplication).
+        seed (int): Random seed.
+        batch (int): Documents generated per numpy call.
+
+    Yields:
+        Document: Documents with ``source`` metadata ``synthetic/docNNNNNNN.md``.
+
+    Examples:
+        >>> docs = list(synthetic_documents(3, words=5))
+        >>> len(docs), docs[0].metadata["source"], len(docs[0].page_content.split())
+        (3, 'synthetic/doc0000000.md', 5)
+        >>> docs[0].page_content == next(synthetic_documents(1, words=5)).page_content
+        True
+    """
+    vocab = _vocabulary(vocab_size, seed)
+    rng = np.random.default_rng(seed + 1)
+    for start in range(0, n, batch):
+        size = min(batch, n - start)
+        ids = (rng.zipf(1.3, size=(size, words)) - 1) % len(vocab)
+        for offset, row in enumerate(vocab[ids]):
+            yield Document(
+                page_content=" ".join(row) + ".",
+                metadata={"source": f"synthetic/doc{start + offset:07d}.md"},
+            )
+
+
+def synthetic_queries(docs: List[Document], n: int, words: int = 6, seed: int = 0) -> List[str]:
+    """Build `n` queries from word windows of random documents.
+
+    Args:
+        docs (List[Document]): Corpus to sample from.
+        n (int): Number of queries.
+        words (int): Words per query.
+        seed (int): Random seed.
+
+    Returns:
+        List[str]: Queries, each with at least one relevant document.
+    """
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(docs), size=n):
+        tokens = docs[int(i)].page_content.rstrip(".").split()
+        start = int(rng.integers(0, max(1, len(tokens) - words + 1)))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
@@ -0,0 +1,212 @@
+"""Batched, concurrent embedding stage used when building FAISS indexes.
+
+`embed_texts` splits the texts into fixed-size batches and embeds them with a
+bounded thread pool. Throttled requests (HTTP 429) are retried with tenacity's
+exponential back-off, and an AIMD limiter lowers the number of in-flight
+requests while the endpoint is throttling. Completed batches are checkpointed
+to disk so an interrupted build resumes instead of restarting. `BatchEmbedder`
+exposes the same per-batch logic to the streaming build (`rag_med.tools.pipeline`).
+"""
+from __future__ import annotations
+
+import hashlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from openai import APIConnectionError, APITimeoutError, RateLimitError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Return True for throttling and transient network errors.
+
+    Args:
+        exc (BaseException): Exception raised by the embeddings client.
+
+    Returns:
+        bool: Whether the request should be retried.
+
+    Examples:
+        >>> is_retryable(ValueError("bad input"))
+        False
+    """
+    if isinstance(exc, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    return getattr(exc, "status_code", None) in (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease cap on in-flight requests.
+
+    Every throttled request halves the allowed concurrency; every successful
+    one raises it by one step, up to `max_in_flight`.
+
+    Args:
+        max_in_flight (int): Upper bound on concurrent requests.
+
+    Examples:
+        >>> limiter = AdaptiveLimiter(8)
+        >>> limiter.on_throttle(); limiter.limit
+        4
+        >>> limiter.on_success(); limiter.limit
+        5
+    """
+
+    def __init__(self, max_in_flight: int) -> None:
+        self.max_in_flight = max(1, max_in_flight)
+        self.limit = self.max_in_flight
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self) -> "AdaptiveLimiter":
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+
+    def on_success(self) -> None:
+        with self._cond:
+            self.limit = min(self.max_in_flight, self.limit + 1)
+            self._cond.notify_all()
+
+
+def _batch_key(texts: List[str]) -> str:
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class BatchEmbedder:
+    """Embeds one batch at a time with retries, AIMD throttling and checkpoints.
+
+    Thread-safe: every thread embedding through the same instance shares one
+    `AdaptiveLimiter`, so a throttled endpoint slows all of them down.
+
+    Args:
+        embeddings (Embeddings): Embeddings client.
+        max_workers (int): Maximum number of requests in flight.
+        max_retries (int): Attempts per batch before giving up.
+        checkpoint_dir (str | None): Directory where completed batches are
+            saved as ``.npy`` files; batches already present are not re-embedded.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_workers: int = 4,
+        max_retries: int = 6,
+        checkpoint_dir: Optional[str] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.limiter = AdaptiveLimiter(max_workers)
+        self.checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir else None
+        if self.checkpoint_dir:
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self._embed_with_retry = retry(
+            wait=wait_exponential(multiplier=1, min=2, max=60),  # 2s, 4s, 8s, ... max 60s
+            stop=stop_after_attempt(max_retries),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._on_retry,
+            reraise=True,
+        )(self._embed_once)
+
+    def _on_retry(self, retry_state) -> None:
+        exc = retry_state.outcome.exception()
+        if getattr(exc, "status_code", None) == 429 or isinstance(exc, RateLimitError):
+            self.limiter.on_throttle()
+
+    def _embed_once(self, batch: List[str]) -> np.ndarray:
+        with self.limiter:
+            vectors = self.embeddings.embed_documents(batch)
+        self.limiter.on_success()
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed(self, batch: List[str]) -> np.ndarray:
+        """Embed `batch`, or load it from its checkpoint.
+
+        Args:
+            batch (List[str]): Texts of one embeddings request.
+
+        Returns:
+            np.ndarray: Float32 matrix with one row per text.
+
+        Raises:
+            Exception: The last error of a batch that exhausted its retries.
+        """
+        path = self.checkpoint_dir / f"{_batch_key(batch)}.npy" if self.checkpoint_dir else None
+        if path and path.exists():
+            return np.load(path)
+        vectors = self._embed_with_retry(batch)
+        if path:
+            tmp = path.with_suffix(".tmp.npy")
+            np.save(tmp, vectors)
+            tmp.replace(path)
+        return vectors
+
+
+def embed_texts(
+    texts: List[str],
+    embeddings: Embeddings,
+    batch_size: int = 64,
+    max_workers: int = 4,
+    max_retries: int = 6,
+    checkpoint_dir: Optional[str] = None,
+) -> np.ndarray:
+    """Embed `texts` in batches with bounded concurrency and resumable checkpoints.
+
+    Args:
+        texts (List[str]): Texts to embed.
+        embeddings (Embeddings): Embeddings client.
+        batch_size (int): Texts per embeddings request.
+        max_workers (int): Maximum number of requests in flight.
+        max_retries (int): Attempts per batch before giving up.
+        checkpoint_dir (str | None): Directory where completed batches are
+            saved as ``.npy`` files; batches already present are not re-embedded.
+
+    Returns:
+        np.ndarray: Float32 matrix with one row per input text.
+
+    Raises:
+        Exception: The last error of a batch that exhausted its retries.
+
+    Examples:
+        >>> class _Fake(Embeddings):
+        ...     def embed_documents(self, texts):
+        ...         return [[float(len(t))] for t in texts]
+        ...     def embed_query(self, text):
+        ...         return [float(len(text))]
+        >>> embed_texts(["a", "bb", "ccc"], _Fake(), batch_size=2).ravel().tolist()
+        [1.0, 2.0, 3.0]
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
+        return np.empty((0, 0), dtype=np.float32)
+    embedder = BatchEmbedder(embeddings, max_workers, max_retries, checkpoint_dir)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        results = list(pool.map(embedder.embed, batches))
+    return np.vstack(results)
+
+
+def clear_checkpoints(checkpoint_dir: str) -> None:
+    """Remove the checkpoint directory once the index has been persisted.
+
+    Args:
+        checkpoint_dir (str): Directory passed to `embed_texts`.
+    """
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
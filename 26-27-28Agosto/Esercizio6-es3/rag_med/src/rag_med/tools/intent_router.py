@@ -0,0 +1,216 @@
+"""Tiered intent classification in front of the LLM menu classifier.
+
+`IntentRouter` tries three tiers in order and stops at the first confident one:
+
+1. ``rules``: regular expressions for obvious inputs (``"esci"``, ``"rag"``);
+   a rule decides only when all matching rules agree on one label;
+2. ``centroid``: cosine similarity between the input embedding and the
+   centroid of the embeddings of labelled example utterances, accepted above
+   ``threshold`` and with ``margin`` over the runner-up label;
+3. ``llm``: the fallback callable, i.e. the original LLM classification.
+
+The first two tiers cost no chat completion: at most one embeddings call.
+Example centroids are computed once and cached on disk. Hit counts and
+latency are kept per tier (see `IntentRouter.stats`).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag_med.tools.timings import StageTimings
+
+TIERS = ("rules", "centroid", "llm")
+
+
+@dataclass(frozen=True)
+class IntentRule:
+    """Regular expression that maps matching inputs to `label`.
+
+    Attributes:
+        label (str): Intent returned on a match.
+        pattern (str): Regular expression, searched case-insensitively.
+    """
+
+    label: str
+    pattern: str
+
+
+@dataclass(frozen=True)
+class IntentDecision:
+    """Result of `IntentRouter.classify`.
+
+    Attributes:
+        label (str): Chosen intent.
+        tier (str): Tier that decided (``rules``, ``centroid`` or ``llm``).
+        confidence (float): Cosine similarity for ``centroid``, 1.0 otherwise.
+        latency_ms (float): Time spent classifying, all tiers included.
+    """
+
+    label: str
+    tier: str
+    confidence: float
+    latency_ms: float
+
+
+class IntentRouter:
+    """Classify user inputs with rules, then embeddings, then the LLM.
+
+    Args:
+        rules (Sequence[IntentRule]): Fast-path rules.
+        examples (Dict[str, List[str]]): Example utterances per label for the
+            centroid tier; labels without examples are only reachable through
+            rules or the LLM.
+        fallback (Callable[[str], str]): Slow classifier (the LLM call).
+        embeddings (Embeddings | None): Embedding model; None disables the
+            centroid tier.
+        threshold (float): Minimum cosine similarity to accept a centroid.
+        margin (float): Minimum lead over the second-best centroid.
+        cache_path (str | None): ``.npz`` file caching the example centroids.
+        model_id (str): Embedding model name, part of the cache key.
+
+    Examples:
+        >>> from rag_med.tools.fakes import HashEmbeddings
+        >>> router = IntentRouter(
+        ...     rules=[IntentRule("Uscita", r"^\\s*(esci|exit)\\s*$")],
+        ...     examples={"Rag": ["come funziona il retrieval augmented generation",
+        ...                       "indicizzare documenti con faiss"],
+        ...               "Ricerca": ["meteo di domani a roma", "risultati delle partite di calcio"]},
+        ...     fallback=lambda text: "Ricerca",
+        ...     embeddings=HashEmbeddings(dim=256),
+        ...     threshold=0.3,
+        ... )
+        >>> texts = ("Esci", "retrieval augmented generation con faiss", "xyz")
+        >>> [(d.label, d.tier) for d in map(router.classify, texts)]
+        [('Uscita', 'rules'), ('Rag', 'centroid'), ('Ricerca', 'llm')]
+        >>> {tier: s["hits"] for tier, s in router.stats().items()}
+        {'rules': 1, 'centroid': 1, 'llm': 1}
+    """
+
+    def __init__(
+        self,
+        rules: Sequence[IntentRule],
+        examples: Dict[str, List[str]],
+        fallback: Callable[[str], str],
+        embeddings: Optional[Embeddings] = None,
+        threshold: float = 0.5,
+        margin: float = 0.05,
+        cache_path: Optional[str] = None,
+        model_id: str = "",
+    ) -> None:
+        self.rules = [(rule.label, re.compile(rule.pattern, re.IGNORECASE)) for rule in rules]
+        self.examples = {label: list(texts) for label, texts in examples.items() if texts}
+        self.fallback = fallback
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.margin = margin
+        self.cache_path = cache_path
+        self.model_id = model_id
+        self.timings = StageTimings()
+        self._centroids: Optional[Tuple[List[str], np.ndarray]] = None
+        self._hits = {tier: 0 for tier in TIERS}
+        self._lock = threading.Lock()
+
+    def match_rules(self, text: str) -> Optional[str]:
+        """Return the label of the matching rules, or None if none or ambiguous."""
+        labels = {label for label, pattern in self.rules if pattern.search(text)}
+        return labels.pop() if len(labels) == 1 else None
+
+    def _cache_key(self) -> str:
+        payload = json.dumps([self.model_id, sorted(self.examples.items())], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def centroids(self) -> Tuple[List[str], np.ndarray]:
+        """Return the labels and unit-norm example centroids (one row per label)."""
+        if self._centroids is not None:
+            return self._centroids
+        key = self._cache_key()
+        path = Path(self.cache_path) if self.cache_path else None
+        if path is not None and path.is_file():
+            with np.load(path) as data:
+                if str(data["key"]) == key:
+                    self._centroids = ([str(label) for label in data["labels"]], data["centroids"])
+                    return self._centroids
+
+        labels = list(self.examples)
+        texts = [text for label in labels for text in self.examples[label]]
+        vectors = _normalize(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+        rows, start = [], 0
+        for label in labels:
+            end = start + len(self.examples[label])
+            rows.append(vectors[start:end].mean(axis=0))
+            start = end
+        centroids = _normalize(np.vstack(rows))
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                np.savez(f, key=key, labels=np.asarray(labels), centroids=centroids)
+        self._centroids = (labels, centroids)
+        return self._centroids
+
+    def match_centroid(self, text: str) -> Tuple[Optional[str], float]:
+        """Return the nearest label if confident enough, and its similarity."""
+        labels, centroids = self.centroids()
+        query = _normalize(np.asarray([self.embeddings.embed_query(text)], dtype=np.float32))[0]
+        scores = centroids @ query
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else -1.0
+        if best >= self.threshold and best - runner_up >= self.margin:
+            return labels[order[0]], best
+        return None, best
+
+    def classify(self, text: str) -> IntentDecision:
+        """Classify `text`, using the LLM fallback only when the local tiers are unsure.
+
+        Args:
+            text (str): User input.
+
+        Returns:
+            IntentDecision: Label, deciding tier, confidence and latency.
+        """
+        start = time.perf_counter()
+        label, tier, confidence = self.match_rules(text), "rules", 1.0
+        if label is None and self.embeddings is not None and self.examples:
+            try:
+                label, confidence = self.match_centroid(text)
+                tier = "centroid"
+            except Exception:  # endpoint non raggiungibile: si passa all'LLM
+                label = None
+        if label is None:
+            label, tier, confidence = self.fallback(text), "llm", 1.0
+
+        elapsed = time.perf_counter() - start
+        self.timings.record(tier, elapsed)
+        with self._lock:
+            self._hits[tier] += 1
+        return IntentDecision(label, tier, round(confidence, 4), round(elapsed * 1000, 3))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Return hits, hit rate and latency (mean/p50/p95 ms) per tier."""
+        with self._lock:
+            hits = dict(self._hits)
+        total = sum(hits.values())
+        latency = self.timings.summary()
+        return {
+            tier: {
+                "hits": hits[tier],
+                "hit_rate": round(hits[tier] / total, 3) if total else 0.0,
+                **{k: v for k, v in latency.get(tier, {}).items() if k != "count"},
+            }
+            for tier in TIERS
+        }
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
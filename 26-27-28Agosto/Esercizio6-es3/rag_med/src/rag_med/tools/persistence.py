@@ -0,0 +1,380 @@
+"""Pickle-free persistence for the FAISS vector store.
+
+The index is written with ``faiss.write_index`` and read back memory-mapped,
+so its pages are loaded on demand by the OS. Chunk text and metadata live in a
+SQLite file (`SQLiteDocstore`) together with the FAISS position -> docstore id
+map (`SQLiteIdMap`); both are queried lazily, one row per search hit, so
+startup time and resident memory do not grow with the corpus.
+
+Layout of ``persist_dir``::
+
+    index.faiss       FAISS index
+    docstore.sqlite   tables ``docs(id, content, metadata)`` and ``idmap(pos, id)``
+    generation.json   generation marker, rewritten last when both files are replaced
+
+Replacing the index and the docstore takes two renames. `begin_generation`
+marks the store incomplete before them and `commit_generation` marks it
+complete after; a crash in between leaves a store that `has_vectorstore`
+reports as missing, so it is rebuilt instead of pairing an index with the
+wrong docstore.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+GENERATION_FILE = "generation.json"
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore backed by a SQLite file; documents are fetched by id on demand.
+
+    Writes are kept in an open transaction until `commit`, so a crash during an
+    update leaves the persisted store unchanged. After `close` the connection
+    is reopened on the next access, so closing a store that is still
+    referenced elsewhere (e.g. an evicted tenant) only releases it early; if
+    the file was replaced in the meantime the access raises instead of mixing
+    the old index with the new documents.
+
+    Args:
+        path (str): SQLite file path.
+
+    Examples:
+        >>> store = SQLiteDocstore(":memory:")
+        >>> store.add({"a": Document(page_content="ciao", metadata={"source": "x.md"})})
+        >>> store.search("a").metadata
+        {'source': 'x.md'}
+        >>> store.search("b")
+        'ID b not found.'
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = sqlite3.connect(path, check_same_thread=False)
+        self._inode = os.stat(path).st_ino if path != ":memory:" else None
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idmap (pos INTEGER PRIMARY KEY, id TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Chiamata con il lock acquisito; dopo close() si riapre lo stesso file, se c'e' ancora
+        if self._db is None:
+            if self._inode is None or not os.path.exists(self.path) or os.stat(self.path).st_ino != self._inode:
+                raise RuntimeError(f"Docstore chiuso o sostituito su disco: {self.path}")
+            self._db = sqlite3.connect(f"file:{self.path}?mode=rw", uri=True, check_same_thread=False)
+        return self._db
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Return the document stored under `search`, or a not-found message."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, metadata FROM docs WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Insert documents keyed by id; existing ids raise `ValueError`."""
+        rows = [
+            (doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+            for doc_id, doc in texts.items()
+        ]
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO docs (id, content, metadata) VALUES (?, ?, ?)", rows
+                )
+            except sqlite3.IntegrityError as exc:
+                raise ValueError(f"Tried to add ids that already exist: {exc}") from exc
+
+    def delete(self, ids: List) -> None:
+        """Delete documents by id."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", [(i,) for i in ids])
+
+    def id_map(self) -> "SQLiteIdMap":
+        """Return the lazily-read FAISS position -> docstore id mapping."""
+        return SQLiteIdMap(self)
+
+    def write_id_map(self, mapping) -> None:
+        """Replace the stored position -> id mapping with `mapping`."""
+        if isinstance(mapping, SQLiteIdMap) and mapping.store is self:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM idmap")
+            self._conn.executemany(
+                "INSERT INTO idmap (pos, id) VALUES (?, ?)",
+                ((int(pos), doc_id) for pos, doc_id in mapping.items()),
+            )
+
+    def commit(self) -> None:
+        """Commit pending writes."""
+        with self._lock:
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Close the connection, discarding uncommitted writes."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SQLiteIdMap(MutableMapping):
+    """Dict-like FAISS position -> docstore id map stored in `SQLiteDocstore`.
+
+    Lookups hit SQLite only for the positions returned by a search.
+    """
+
+    def __init__(self, store: SQLiteDocstore) -> None:
+        self.store = store
+
+    def __getitem__(self, pos: int) -> str:
+        with self.store._lock:
+            row = self.store._conn.execute(
+                "SELECT id FROM idmap WHERE pos = ?", (int(pos),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __setitem__(self, pos: int, doc_id: str) -> None:
+        with self.store._lock:
+            self.store._conn.execute(
+                "INSERT OR REPLACE INTO idmap (pos, id) VALUES (?, ?)", (int(pos), doc_id)
+            )
+
+    def __delitem__(self, pos: int) -> None:
+        with self.store._lock:
+            cur = self.store._conn.execute("DELETE FROM idmap WHERE pos = ?", (int(pos),))
+        if cur.rowcount == 0:
+            raise KeyError(pos)
+
+    def __iter__(self) -> Iterator[int]:
+        with self.store._lock:
+            rows = self.store._conn.execute("SELECT pos FROM idmap ORDER BY pos").fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        with self.store._lock:
+            return self.store._conn.execute("SELECT COUNT(*) FROM idmap").fetchone()[0]
+
+    def items(self):
+        with self.store._lock:
+            return self.store._conn.execute("SELECT pos, id FROM idmap ORDER BY pos").fetchall()
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+def read_generation(persist_dir: str) -> Optional[Dict[str, object]]:
+    """Return the generation marker of `persist_dir`, or None if missing.
+
+    Args:
+        persist_dir (str): Directory holding the artifacts.
+
+    Returns:
+        dict | None: ``{"generation": int, "complete": bool}``.
+    """
+    path = Path(persist_dir) / GENERATION_FILE
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_generation(persist_dir: str, generation: int, complete: bool) -> None:
+    path = Path(persist_dir) / GENERATION_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "complete": complete}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def begin_generation(persist_dir: str) -> int:
+    """Mark the store incomplete before its files are replaced.
+
+    Args:
+        persist_dir (str): Directory holding the artifacts.
+
+    Returns:
+        int: The new generation, to pass to `commit_generation`.
+
+    Examples:
+        >>> import tempfile
+        >>> d = tempfile.mkdtemp()
+        >>> g = begin_generation(d); read_generation(d)
+        {'generation': 1, 'complete': False}
+        >>> commit_generation(d, g); read_generation(d)
+        {'generation': 1, 'complete': True}
+    """
+    current = read_generation(persist_dir) or {}
+    generation = int(current.get("generation", 0)) + 1
+    _write_generation(persist_dir, generation, complete=False)
+    return generation
+
+
+def commit_generation(persist_dir: str, generation: int) -> None:
+    """Mark the store complete once all its files are in place."""
+    _write_generation(persist_dir, generation, complete=True)
+
+
+def read_faiss_index(path: str, mmap: bool = True) -> faiss.Index:
+    """Read a FAISS index, memory-mapped and read-only when `mmap` is True.
+
+    A memory-mapped index must not be modified: load it with ``mmap=False``
+    before adding or removing vectors. Index types that cannot be mapped are
+    read into RAM.
+
+    Args:
+        path (str): Index file.
+        mmap (bool): Map the file instead of reading it into RAM.
+
+    Returns:
+        faiss.Index: The index.
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    # IO_FLAG_MMAP_IFC (faiss >= 1.10) mappa anche i codici flat/HNSW, non solo le liste IVF
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def load_vectorstore(persist_dir: str, embeddings: Embeddings, mmap: bool = True) -> FAISS:
+    """Load a vector store saved by `save_vectorstore`.
+
+    Args:
+        persist_dir (str): Directory holding the artifacts.
+        embeddings (Embeddings): Embedding model for queries.
+        mmap (bool): Memory-map the index (read-only). Use False to update it.
+
+    Returns:
+        FAISS: Vector store with a SQLite-backed docstore.
+    """
+    persist_path = Path(persist_dir)
+    index = read_faiss_index(str(persist_path / INDEX_FILE), mmap=mmap)
+    docstore = SQLiteDocstore(str(persist_path / DOCSTORE_FILE))
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=docstore.id_map(),
+    )
+
+
+def save_vectorstore(vector_store: FAISS, persist_dir: str) -> None:
+    """Persist `vector_store` as ``index.faiss`` + ``docstore.sqlite``.
+
+    A store whose docstore already lives in ``persist_dir`` is committed in
+    place; any other docstore (e.g. a freshly built `InMemoryDocstore`) is
+    copied into a new SQLite file that atomically replaces the old one.
+
+    Args:
+        vector_store (FAISS): Vector store to save.
+        persist_dir (str): Destination directory.
+    """
+    persist_path = Path(persist_dir)
+    persist_path.mkdir(parents=True, exist_ok=True)
+    docstore_path = persist_path / DOCSTORE_FILE
+    index_tmp = persist_path / (INDEX_FILE + ".tmp")
+    faiss.write_index(vector_store.index, str(index_tmp))
+
+    docstore = vector_store.docstore
+    in_place = (
+        isinstance(docstore, SQLiteDocstore)
+        and docstore.path != ":memory:"
+        and docstore_path.exists()
+        and Path(docstore.path).resolve() == docstore_path.resolve()
+    )
+    generation = begin_generation(persist_dir)
+    if in_place:
+        docstore.write_id_map(vector_store.index_to_docstore_id)
+        docstore.commit()
+    else:
+        db_tmp = persist_path / (DOCSTORE_FILE + ".tmp")
+        if db_tmp.exists():
+            db_tmp.unlink()
+        target = SQLiteDocstore(str(db_tmp))
+        ids = list(vector_store.index_to_docstore_id.values())
+        for start in range(0, len(ids), 1000):
+            batch = ids[start:start + 1000]
+            target.add({doc_id: docstore.search(doc_id) for doc_id in batch})
+        target.write_id_map(vector_store.index_to_docstore_id)
+        target.commit()
+        target.close()
+        os.replace(db_tmp, docstore_path)
+
+    os.replace(index_tmp, persist_path / INDEX_FILE)
+    legacy = persist_path / LEGACY_DOCSTORE_FILE
+    if legacy.exists():
+        legacy.unlink()
+    commit_generation(persist_dir, generation)
+
+
+def migrate_legacy_store(persist_dir: str, embeddings: Embeddings) -> bool:
+    """Convert an ``index.faiss`` + ``index.pkl`` store to the SQLite format.
+
+    This is the only place the pickle is read, once, for indexes written by
+    older versions; the pickle is removed afterwards.
+
+    Args:
+        persist_dir (str): Directory holding the artifacts.
+        embeddings (Embeddings): Embedding model.
+
+    Returns:
+        bool: True if a migration happened.
+    """
+    persist_path = Path(persist_dir)
+    if not (persist_path / LEGACY_DOCSTORE_FILE).exists() or (persist_path / DOCSTORE_FILE).exists():
+        return False
+    if not (persist_path / INDEX_FILE).exists():
+        return False
+    legacy = FAISS.load_local(persist_dir, embeddings, allow_dangerous_deserialization=True)
+    save_vectorstore(legacy, persist_dir)
+    return True
+
+
+def has_vectorstore(persist_dir: str) -> bool:
+    """Return True if `persist_dir` holds a complete store saved by `save_vectorstore`.
+
+    A store whose generation marker says a replacement was interrupted is
+    reported as missing; stores written before markers existed count as complete.
+    """
+    persist_path = Path(persist_dir)
+    if not ((persist_path / INDEX_FILE).exists() and (persist_path / DOCSTORE_FILE).exists()):
+        return False
+    marker = read_generation(persist_dir)
+    return marker is None or bool(marker.get("complete"))
+
+
+def close_vectorstore(vector_store: Optional[FAISS]) -> None:
+    """Release the SQLite connection held by `vector_store`, if any."""
+    if vector_store is not None and isinstance(vector_store.docstore, SQLiteDocstore):
+        vector_store.docstore.close()
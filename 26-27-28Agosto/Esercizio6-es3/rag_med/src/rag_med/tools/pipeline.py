@@ -0,0 +1,284 @@
+"""Streaming, pipelined index build with bounded memory.
+
+The stages of a full build run concurrently and are connected by bounded
+queues, so reading files, splitting, embedding requests and FAISS ``add``
+overlap and no stage holds the whole corpus:
+
+1. `prefetch` runs the document loader in a background thread;
+2. a second `prefetch` runs the splitter on the documents as they arrive;
+3. chunks are grouped into batches and embedded by a thread pool, with at
+   most ``max_in_flight`` batches outstanding;
+4. the calling thread adds each embedded batch, in order, to the FAISS index
+   and to a SQLite docstore written directly to disk.
+
+Indexes that need training (IVF, SQ8, binary) cannot receive vectors before
+the stream ends: the vectors are spilled to a temporary file while a uniform
+reservoir sample of at most ``train_sample_size`` of them is kept in memory,
+so the training set covers the whole corpus and not only the first files in
+path order. The index is then trained on the sample and filled from the file.
+
+The new index and docstore replace the previous ones under a generation
+marker (`rag_med.tools.persistence.begin_generation`), so a crash between the
+two swaps is detected on load instead of pairing mismatched files.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from rag_med.tools.faiss_indexes import IndexSpec, create_index
+from rag_med.tools.indexing import BatchEmbedder
+from rag_med.tools.persistence import (
+    DOCSTORE_FILE,
+    INDEX_FILE,
+    LEGACY_DOCSTORE_FILE,
+    SQLiteDocstore,
+    begin_generation,
+    commit_generation,
+)
+
+T = TypeVar("T")
+
+_DONE = object()
+
+# Tipi di indice che richiedono un campione di addestramento prima di add()
+TRAINED_INDEX_TYPES = ("ivfflat", "ivfpq", "sq8", "binary")
+
+# Vettori letti per volta dal file temporaneo quando si riempie un indice addestrato
+_ADD_BLOCK_ROWS = 8192
+
+
+def prefetch(items: Iterable[T], maxsize: int = 8) -> Iterator[T]:
+    """Iterate `items` in a background thread, at most `maxsize` items ahead.
+
+    Exceptions raised by the producer are re-raised in the consumer. If the
+    consumer stops early the producer is stopped at its next item.
+
+    Args:
+        items (Iterable[T]): Source iterable; may be a slow generator.
+        maxsize (int): Capacity of the queue between the two threads.
+
+    Yields:
+        T: The items of `items`, in order.
+
+    Examples:
+        >>> list(prefetch(range(5), maxsize=2))
+        [0, 1, 2, 3, 4]
+    """
+    buffer: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def _put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put(item):
+                    return
+            _put(_DONE)
+        except BaseException as exc:  # inoltrato al consumatore
+            _put(exc)
+
+    thread = threading.Thread(target=_produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _StreamingStore:
+    """FAISS store fed batch by batch; trained index types are built at `flush`."""
+
+    def __init__(
+        self, spec: IndexSpec, embeddings: Embeddings, docstore: SQLiteDocstore, spill_path: Path
+    ) -> None:
+        self.spec = spec
+        self.embeddings = embeddings
+        self.docstore = docstore
+        self.vector_store: Optional[FAISS] = None
+        self.params: Dict[str, Any] = {}
+        self._trained = spec.index_type in TRAINED_INDEX_TYPES
+        self._spill_path = spill_path
+        self._spill = None
+        self._sample: Optional[np.ndarray] = None
+        self._rows = 0
+        self._rng = np.random.default_rng(spec.seed)
+
+    def add(self, chunks: List[Document], ids: List[str], vectors: np.ndarray) -> None:
+        if not self._trained:
+            if self.vector_store is None:
+                self._create(vectors)
+            self._add(chunks, ids, vectors)
+            return
+        # Documenti e id map subito nel docstore; i vettori su file fino all'addestramento
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.docstore.add({doc_id: chunk for doc_id, chunk in zip(ids, chunks)})
+        id_map = self.docstore.id_map()
+        for offset, doc_id in enumerate(ids):
+            id_map[self._rows + offset] = doc_id
+        if self._spill is None:
+            self._spill = open(self._spill_path, "wb")
+        vectors.tofile(self._spill)
+        self._reservoir(vectors)
+        self._rows += len(vectors)
+
+    def _reservoir(self, vectors: np.ndarray) -> None:
+        # Algoritmo R: ogni vettore visto finisce nel campione con probabilita' size / visti
+        size = self.spec.train_sample_size
+        if self._sample is None:
+            self._sample = np.empty((size, vectors.shape[1]), dtype=np.float32)
+        positions = np.arange(self._rows, self._rows + len(vectors))
+        fill = positions < size
+        self._sample[positions[fill]] = vectors[fill]
+        slots = self._rng.integers(0, positions[~fill] + 1) if (~fill).any() else positions[:0]
+        keep = slots < size
+        self._sample[slots[keep]] = vectors[~fill][keep]
+
+    def flush(self) -> None:
+        """Train and fill the index from the spilled vectors, if not created yet."""
+        if self.vector_store is not None or not self._rows:
+            return
+        self._spill.close()
+        self._create(self._sample[:min(self._rows, self.spec.train_sample_size)])
+        self._sample = None
+        dim = self.vector_store.index.d
+        vectors = np.memmap(self._spill_path, dtype=np.float32, mode="r", shape=(self._rows, dim))
+        for start in range(0, self._rows, _ADD_BLOCK_ROWS):
+            self.vector_store.index.add(np.ascontiguousarray(vectors[start:start + _ADD_BLOCK_ROWS]))
+        del vectors
+
+    def close(self) -> None:
+        """Remove the spill file."""
+        if self._spill is not None:
+            self._spill.close()
+        if self._spill_path.exists():
+            self._spill_path.unlink()
+
+    def _create(self, sample: np.ndarray) -> None:
+        index, self.params = create_index(self.spec, sample)
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=self.docstore,
+            index_to_docstore_id=self.docstore.id_map(),
+        )
+
+    def _add(self, chunks: List[Document], ids: List[str], vectors: np.ndarray) -> None:
+        self.vector_store.add_embeddings(
+            text_embeddings=zip([c.page_content for c in chunks], vectors),
+            metadatas=[c.metadata for c in chunks],
+            ids=ids,
+        )
+
+
+def build_streaming(
+    chunks: Iterable[Tuple[Document, str]],
+    embeddings: Embeddings,
+    embedder: BatchEmbedder,
+    spec: IndexSpec,
+    persist_dir: str,
+    batch_size: int = 64,
+    max_in_flight: int = 8,
+) -> Dict[str, Any]:
+    """Embed and index a stream of chunks, writing the store to `persist_dir`.
+
+    The previous store is replaced only once the new one is complete; the
+    swap of index and docstore is bracketed by a generation marker, so a crash
+    in between leaves a store that `has_vectorstore` reports as missing.
+
+    Args:
+        chunks (Iterable[Tuple[Document, str]]): ``(chunk, docstore id)`` pairs;
+            typically a `prefetch`-ed splitter.
+        embeddings (Embeddings): Embedding model stored in the vector store.
+        embedder (BatchEmbedder): Embeds one batch (retries, checkpoints).
+        spec (IndexSpec): Index to build.
+        persist_dir (str): Destination directory.
+        batch_size (int): Chunks per embeddings request.
+        max_in_flight (int): Embedded batches outstanding at once; bounds the
+            memory held between the embedding and the ``add`` stage.
+
+    Returns:
+        Dict[str, Any]: Index parameters returned by `create_index`.
+
+    Raises:
+        ValueError: If `chunks` is empty.
+    """
+    persist_path = Path(persist_dir)
+    persist_path.mkdir(parents=True, exist_ok=True)
+    db_tmp = persist_path / (DOCSTORE_FILE + ".tmp")
+    if db_tmp.exists():
+        db_tmp.unlink()
+    docstore = SQLiteDocstore(str(db_tmp))
+    store = _StreamingStore(spec, embeddings, docstore, persist_path / (INDEX_FILE + ".vectors.tmp"))
+
+    window: Deque[Tuple[List[Document], List[str], Future]] = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="embed") as pool:
+            for batch in _batched(chunks, batch_size):
+                docs = [doc for doc, _ in batch]
+                ids = [doc_id for _, doc_id in batch]
+                future = pool.submit(embedder.embed, [d.page_content for d in docs])
+                window.append((docs, ids, future))
+                # Finestra limitata: si aggiunge in ordine il batch piu' vecchio
+                if len(window) >= max_in_flight:
+                    docs, ids, future = window.popleft()
+                    store.add(docs, ids, future.result())
+            while window:
+                docs, ids, future = window.popleft()
+                store.add(docs, ids, future.result())
+        store.flush()
+        if store.vector_store is None:
+            raise ValueError("Nessun chunk da indicizzare")
+
+        index_tmp = persist_path / (INDEX_FILE + ".tmp")
+        faiss.write_index(store.vector_store.index, str(index_tmp))
+        docstore.commit()
+    finally:
+        for _, _, future in window:
+            future.cancel()
+        store.close()
+        docstore.close()
+
+    generation = begin_generation(persist_dir)
+    os.replace(db_tmp, persist_path / DOCSTORE_FILE)
+    os.replace(index_tmp, persist_path / INDEX_FILE)
+    legacy = persist_path / LEGACY_DOCSTORE_FILE
+    if legacy.exists():
+        legacy.unlink()
+    commit_generation(persist_dir, generation)
+    return store.params
@@ -7,31 +7,71 @@ are used to configure Azure OpenAI credentials and deployments.
 """
 from __future__ import annotations
 
+import hashlib
+import json
 import os
-from dataclasses import dataclass
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
-from typing import List
-from langchain_community.document_loaders import DirectoryLoader
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from openai import AzureOpenAI
 
 import faiss
+import numpy as np
 from langchain.schema import Document
 from langchain_openai import AzureOpenAIEmbeddings
 from langchain_openai import AzureChatOpenAI
 from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.embeddings import Embeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # LangChain Core (prompt/chain)
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
 # Chat model init (provider-agnostic, qui puntiamo a LM Studio via OpenAI-compatible)
 from langchain.chat_models import init_chat_model
 from dotenv import load_dotenv
 
+from rag_med.tools.bm25 import (
+    BM25_FILE,
+    HybridRetriever,
+    bm25_from_vectorstore,
+    hybrid_search,
+    load_or_build_bm25,
+)
+from rag_med.tools.context_packing import PackedContext, pack_context
+from rag_med.tools.embedding_cache import EMBEDDING_CACHE_FILE, CachedEmbeddings
+from rag_med.tools.faiss_indexes import (
+    FaissRetriever,
+    IndexSpec,
+    MMRRetriever,
+    mmr_search,
+    search_vectors,
+    apply_search_params,
+    build_params,
+    read_index_params,
+    remove_ids,
+    save_index_params,
+)
+from rag_med.tools.indexing import BatchEmbedder, clear_checkpoints, embed_texts
+from rag_med.tools.pipeline import build_streaming, prefetch
+from rag_med.tools.rerank import DEFAULT_RERANK_MODEL, CrossEncoderReranker, RerankingRetriever
+from rag_med.tools.semantic_cache import SemanticAnswerCache
+from rag_med.tools.splitting import DirectorySource, MarkdownTokenSplitter, SplitStats, measure_split
+from rag_med.tools.timings import StageTimings, TimedRetriever
+from rag_med.tools.persistence import (
+    close_vectorstore,
+    has_vectorstore,
+    load_vectorstore,
+    migrate_legacy_store,
+    save_vectorstore,
+)
+
 # =========================
 # Configurazione
 # =========================
@@ -44,27 +84,97 @@ class Settings:
 
     Attributes:
         persist_dir (str): Directory where FAISS artifacts are saved.
-        chunk_size (int): Maximum characters per text chunk.
-        chunk_overlap (int): Overlap between consecutive chunks.
-        search_type (str): Retrieval mode, "mmr" or "similarity".
+        docs_dir (str | None): Markdown corpus directory, streamed one file at
+            a time; ``None`` uses the simulated corpus.
+        docs_glob (str): Files of `docs_dir` to index.
+        reindex (bool): Re-read and re-hash every file of `docs_dir` on load,
+            ignoring the sizes and modification times in the manifest.
+        splitter (str): "recursive" (characters) or "markdown" (headings and
+            tokens, see `rag_med.tools.splitting`).
+        chunk_size (int): Maximum characters per text chunk ("recursive").
+        chunk_overlap (int): Overlap between consecutive chunks ("recursive").
+        chunk_tokens (int): Maximum tokens per chunk ("markdown").
+        chunk_overlap_tokens (int): Maximum tokens repeated between chunks ("markdown").
+        search_type (str): Retrieval mode, "mmr", "similarity" or "hybrid"
+            (dense + BM25 fused with reciprocal-rank fusion).
         k (int): Number of results returned by the retriever.
-        fetch_k (int): Candidate pool size for MMR.
+        fetch_k (int): Candidate pool size for MMR and for each ranker in
+            hybrid search.
         mmr_lambda (float): Trade-off between relevance and diversity in MMR.
+        rrf_k (int): Reciprocal-rank fusion constant for hybrid search.
+        rerank (bool): Re-rank `fetch_k` candidates with a local cross-encoder
+            and keep the top `k` (needs the ``rerank`` extra).
+        rerank_model (str): Cross-encoder model id.
+        rerank_batch_size (int): Pairs per cross-encoder forward pass.
+        context_max_tokens (int | None): Token budget of the prompt context
+            (opt-in); ``None`` (default) keeps every retrieved passage, only
+            merged and deduplicated.
         hf_model_name (str): Default HF embedding model (not used with Azure).
+        offline (bool): Use deterministic hash embeddings and a stub chat
+            model (`rag_med.tools.fakes`) instead of the Azure endpoints.
+        offline_dim (int): Size of the offline hash embeddings.
+        embedding_cache (bool): Cache embeddings in a local SQLite file.
+        embedding_cache_path (str | None): SQLite file of the embeddings
+            cache; ``None`` puts ``embedding_cache.sqlite`` in `persist_dir`.
+        embedding_cache_max_entries (int): Maximum number of cached vectors.
+        embed_batch_size (int): Chunks per embeddings request at index build.
+        embed_max_workers (int): Maximum embeddings requests in flight.
+        embed_max_retries (int): Attempts per batch on throttling/transient errors.
+        build_queue_size (int): Items buffered between the stages of the
+            streaming build (documents, chunks, embedded batches).
+        index (IndexSpec): FAISS index type with build and search parameters.
+        generation_max_concurrency (int): LLM calls in flight in `rag_answer_batch`.
+        semantic_cache (bool): Enable the semantic answer cache.
+        semantic_cache_threshold (float): Minimum cosine similarity for a cache hit.
+        semantic_cache_ttl (float): Lifetime of a cached answer, in seconds.
+        semantic_cache_max_entries (int): Maximum cached answers.
         lmstudio_model_env (str): Env var name that holds the chat model deployment.
     """
     # Persistenza FAISS
     persist_dir: str = "faiss_index_example"
+    # Corpus (None = corpus simulato)
+    docs_dir: Optional[str] = None
+    docs_glob: str = "**/*.md"
+    reindex: bool = False           # ignora le stat dei file e ricalcola tutti gli hash
     # Text splitting
+    splitter: str = "recursive"     # "recursive" (caratteri) o "markdown" (titoli + token)
     chunk_size: int = 700
     chunk_overlap: int = 300
+    chunk_tokens: int = 256
+    chunk_overlap_tokens: int = 32
     # Retriever (MMR)
-    search_type: str = "similarity"        # "mmr" o "similarity"
+    search_type: str = "similarity"        # "mmr", "similarity" o "hybrid"
     k: int = 1                      # risultati finali
-    fetch_k: int = 1              # candidati iniziali (per MMR)
-    mmr_lambda: float = 1         # 0 = diversificazione massima, 1 = pertinenza massima
+    fetch_k: int = 20             # candidati iniziali (per MMR e hybrid)
+    mmr_lambda: float = 0.5       # 0 = diversificazione massima, 1 = pertinenza massima
+    rrf_k: int = 60               # costante della reciprocal-rank fusion (hybrid)
+    # Re-ranking con cross-encoder (opzionale)
+    rerank: bool = False
+    rerank_model: str = DEFAULT_RERANK_MODEL
+    rerank_batch_size: int = 32
+    # Contesto del prompt
+    context_max_tokens: Optional[int] = None  # None = nessun troncamento
     # Embedding
     hf_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    offline: bool = False            # modelli finti deterministici, nessuna chiamata di rete
+    offline_dim: int = 1536
+    embedding_cache: bool = True
+    embedding_cache_path: Optional[str] = None   # None = dentro persist_dir
+    embedding_cache_max_entries: int = 100_000
+    # Indicizzazione a batch
+    embed_batch_size: int = 64
+    embed_max_workers: int = 4
+    embed_max_retries: int = 6
+    build_queue_size: int = 8        # elementi in coda tra gli stadi della build in streaming
+    # Tipo di indice FAISS (flat, ivfflat, hnsw, ivfpq)
+    index: IndexSpec = field(default_factory=IndexSpec)
+    # Generazione batch
+    generation_max_concurrency: int = 4
+    # Cache semantica delle risposte
+    semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_ttl: float = 3600
+    semantic_cache_max_entries: int = 1000
     # LM Studio (OpenAI-compatible)
     lmstudio_model_env: str = "LMSTUDIO_MODEL"  # nome del modello in LM Studio, via env var
 
@@ -77,30 +187,91 @@ SETTINGS = Settings()
 # Componenti di base
 # =========================
 
-def get_embeddings(settings: Settings) -> AzureOpenAIEmbeddings:
+def get_embeddings(settings: Settings, http_client: Optional[Any] = None) -> Embeddings:
     """Create an Azure OpenAI embeddings client from environment variables.
 
+    When `settings.embedding_cache` is set the client is wrapped in a
+    persistent `CachedEmbeddings` stored next to the index (or at
+    `settings.embedding_cache_path`), used by both `embed_documents` and
+    `embed_query`. With `settings.offline` deterministic `HashEmbeddings`
+    are returned instead (never cached).
+
     Args:
-        settings (Settings): Runtime configuration (unused but kept for symmetry).
+        settings (Settings): Runtime configuration (embedding cache options).
+        http_client (httpx.Client | None): Connection pool for the Azure
+            requests, e.g. one shared with the caller's chat models; None lets
+            the OpenAI SDK create its own.
 
     Returns:
-        AzureOpenAIEmbeddings: Configured embeddings client.
+        Embeddings: Configured embeddings client, possibly cached.
 
     Raises:
         RuntimeError: If required environment variables are missing.
     """
+    if settings.offline:
+        from rag_med.tools.fakes import HashEmbeddings  # solo per test e benchmark offline
 
-    return AzureOpenAIEmbeddings(
+        return HashEmbeddings(dim=settings.offline_dim)
+    deployment = os.getenv("EMBEDDING_DEPLOYMENT")
+    embeddings = AzureOpenAIEmbeddings(
         api_version="2024-02-01",
         azure_endpoint=os.getenv("AZURE_API_BASE"),
         api_key=os.getenv("AZURE_API_KEY"),
-        model=os.getenv("EMBEDDING_DEPLOYMENT"),
+        model=deployment,
+        http_client=http_client,
+    )
+    if not settings.embedding_cache:
+        return embeddings
+    cache_path = Path(embedding_cache_path(settings))
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    return CachedEmbeddings(
+        embeddings,
+        path=str(cache_path),
+        deployment=deployment or "",
+        max_entries=settings.embedding_cache_max_entries,
     )
 
 
+def embedding_cache_path(settings: Settings) -> str:
+    """Return the SQLite file of the embeddings cache for `settings`.
+
+    Examples:
+        >>> Path(embedding_cache_path(Settings(persist_dir="idx"))).as_posix()
+        'idx/embedding_cache.sqlite'
+    """
+    return str(settings.embedding_cache_path or Path(settings.persist_dir) / EMBEDDING_CACHE_FILE)
+
+
+def embeddings_client_key(settings: Settings) -> Tuple:
+    """Return the part of `settings` that configures the embeddings client.
+
+    Settings with equal keys can share one `get_embeddings` client (and its
+    cache connection), e.g. across tenants.
+
+    Examples:
+        >>> a, b = Settings(persist_dir="a", k=1), Settings(persist_dir="a", k=5)
+        >>> embeddings_client_key(a) == embeddings_client_key(b)
+        True
+        >>> embeddings_client_key(a) == embeddings_client_key(Settings(persist_dir="b"))
+        False
+    """
+    if settings.offline:
+        return ("offline", settings.offline_dim)
+    if not settings.embedding_cache:
+        return ("azure",)
+    return ("azure", embedding_cache_path(settings), settings.embedding_cache_max_entries)
+
+
+def llm_client_key(settings: Settings) -> Tuple:
+    """Return the part of `settings` that configures the chat model client."""
+    return ("offline",) if settings.offline else ("azure", settings.lmstudio_model_env)
+
+
 def get_llm_from_lmstudio(settings: Settings):
     """Initialize an Azure OpenAI chat model from environment variables.
 
+    With `settings.offline` a `StubChatModel` is returned instead.
+
     Args:
         settings (Settings): Runtime configuration.
 
@@ -110,6 +281,10 @@ def get_llm_from_lmstudio(settings: Settings):
     Raises:
         RuntimeError: If required environment variables are not set.
     """
+    if settings.offline:
+        from rag_med.tools.fakes import StubChatModel  # solo per test e benchmark offline
+
+        return StubChatModel()
     base_url = os.getenv("AZURE_API_BASE")
     api_key = os.getenv("AZURE_API_KEY")
     model_name = os.getenv("CHAT_DEPLOYMENT")
@@ -180,17 +355,72 @@ def simulate_corpus() -> List[Document]:
     return docs
 
 
-def split_documents(docs: List[Document], settings: Settings) -> List[Document]:
-    """Split documents into overlapping chunks for better retrieval.
+DocumentSource = Union[Iterable[Document], Callable[[], Iterable[Document]], DirectorySource]
+
+
+def _iter_docs(docs: DocumentSource) -> Iterable[Document]:
+    # Una sorgente richiamabile puo' essere riletta piu' volte senza tenerla in memoria
+    return docs() if callable(docs) else docs
+
+
+def _iter_docs_of(docs: DocumentSource, sources: set) -> Iterable[Document]:
+    # Da una directory si leggono solo i file richiesti
+    if isinstance(docs, DirectorySource):
+        return docs.load(sources)
+    return (d for d in _iter_docs(docs) if _doc_source(d) in sources)
+
+
+def split_documents(
+    docs: Iterable[Document], settings: Settings, stats: Optional[SplitStats] = None
+) -> List[Document]:
+    """Split documents into chunks for better retrieval.
+
+    With ``settings.splitter == "markdown"`` documents are consumed one at a
+    time and cut on headings and token counts, dropping chunks repeated within
+    a source; otherwise the recursive character splitter is used.
 
     Args:
-        docs (List[Document]): The documents to split.
+        docs (Iterable[Document]): The documents to split; may be a generator.
         settings (Settings): Chunking configuration.
+        stats (SplitStats | None): Updated with the split counters, including
+            the amplification ratio.
 
     Returns:
         List[Document]: The resulting chunks.
     """
-    splitter = RecursiveCharacterTextSplitter(
+    return list(iter_split_documents(docs, settings, stats))
+
+
+def iter_split_documents(
+    docs: Iterable[Document], settings: Settings, stats: Optional[SplitStats] = None
+) -> Iterator[Document]:
+    """Lazy `split_documents`: documents are read and split one at a time.
+
+    Args:
+        docs (Iterable[Document]): The documents to split; may be a generator.
+        settings (Settings): Chunking configuration.
+        stats (SplitStats | None): Updated with the split counters as
+            documents are consumed.
+
+    Yields:
+        Document: The resulting chunks, in document order.
+    """
+    stats = stats if stats is not None else SplitStats()
+    if settings.splitter == "markdown":
+        splitter = MarkdownTokenSplitter(settings.chunk_tokens, settings.chunk_overlap_tokens)
+        splitter.stats = stats
+        yield from splitter.split(docs)
+        return
+    splitter = _recursive_splitter(settings)
+    for doc in docs:
+        chunks = splitter.split_documents([doc])
+        for name, value in measure_split([doc], chunks).__dict__.items():
+            setattr(stats, name, getattr(stats, name) + value)
+        yield from chunks
+
+
+def _recursive_splitter(settings: Settings) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=settings.chunk_size,
         chunk_overlap=settings.chunk_overlap,
         separators=[
@@ -198,105 +428,542 @@ def split_documents(docs: List[Document], settings: Settings) -> List[Document]:
             ", ", " ", ""  # fallback aggressivo
         ],
     )
-    return splitter.split_documents(docs)
 
 
-def build_faiss_vectorstore(chunks: List[Document], embeddings: AzureOpenAI, persist_dir: str) -> FAISS:
+CHECKPOINT_DIR = "build_checkpoint"
+
+
+def embed_chunks(
+    chunks: List[Document], embeddings: Embeddings, settings: Settings, persist_dir: str
+) -> List[Tuple[str, List[float]]]:
+    """Embed chunks in concurrent batches, checkpointing under `persist_dir`.
+
+    Args:
+        chunks (List[Document]): Pre-split documents.
+        embeddings (Embeddings): Embedding model.
+        settings (Settings): Batch size, concurrency and retry configuration.
+        persist_dir (str): Index directory; checkpoints go in a subdirectory.
+
+    Returns:
+        List[Tuple[str, List[float]]]: ``(text, vector)`` pairs in chunk order.
+    """
+    texts = [c.page_content for c in chunks]
+    vectors = embed_texts(
+        texts,
+        embeddings,
+        batch_size=settings.embed_batch_size,
+        max_workers=settings.embed_max_workers,
+        max_retries=settings.embed_max_retries,
+        checkpoint_dir=str(Path(persist_dir) / CHECKPOINT_DIR),
+    )
+    return list(zip(texts, vectors))
+
+
+def build_faiss_vectorstore(
+    chunks: List[Document],
+    embeddings: AzureOpenAI,
+    persist_dir: str,
+    ids: Optional[List[str]] = None,
+    settings: Optional[Settings] = None,
+) -> FAISS:
     """Build a FAISS vector store from chunks and persist it.
 
+    Chunks are embedded in batches with bounded concurrency; an interrupted
+    build resumes from the last checkpoint. The index type comes from
+    `settings.index`; its parameters are saved next to the index, together
+    with a BM25 index over the same chunks when hybrid search is configured.
+
     Args:
         chunks (List[Document]): Pre-split documents.
         embeddings (AzureOpenAIEmbeddings): Embedding model.
         persist_dir (str): Directory to store FAISS artifacts.
+        ids (List[str] | None): Optional docstore ids, one per chunk.
+        settings (Settings | None): Indexing configuration; defaults to `SETTINGS`.
 
     Returns:
         FAISS: The created vector store.
     """
-    # Determina la dimensione dell'embedding
-    vs = FAISS.from_documents(
-        documents=chunks,
-        embedding=embeddings
+    ids = ids if ids is not None else [str(uuid.uuid4()) for _ in chunks]
+    return _build_vectorstore_streaming(zip(chunks, ids), embeddings, persist_dir, settings or SETTINGS)
+
+
+def _build_vectorstore_streaming(
+    chunks: Iterable[Tuple[Document, str]], embeddings: Embeddings, persist_dir: str, settings: Settings
+) -> FAISS:
+    """Run the pipelined build (`rag_med.tools.pipeline`) and persist every artifact.
+
+    Embedding requests, FAISS ``add`` and the SQLite docstore writes overlap
+    with the producer of `chunks`; memory is bounded by
+    `settings.build_queue_size` batches plus the training sample of the index.
+    """
+    embedder = BatchEmbedder(
+        embeddings,
+        max_workers=settings.embed_max_workers,
+        max_retries=settings.embed_max_retries,
+        checkpoint_dir=str(Path(persist_dir) / CHECKPOINT_DIR),
+    )
+    params = build_streaming(
+        chunks,
+        embeddings,
+        embedder,
+        settings.index,
+        persist_dir,
+        batch_size=settings.embed_batch_size,
+        max_in_flight=max(settings.build_queue_size, settings.embed_max_workers),
     )
+    save_index_params(persist_dir, params, settings.index)
 
-    Path(persist_dir).mkdir(parents=True, exist_ok=True)
-    vs.save_local(persist_dir)
+    vs = load_vectorstore(persist_dir, embeddings, mmap=True)
+    apply_search_params(vs.index, settings.index.nprobe, settings.index.ef_search, settings.index.k_factor)
+    refresh_bm25(vs, persist_dir, settings)
+    clear_checkpoints(str(Path(persist_dir) / CHECKPOINT_DIR))
+    notify_index_changed(persist_dir)
     return vs
 
 
-def load_or_build_vectorstore(settings: Settings, embeddings: AzureOpenAI, docs: List[Document]) -> FAISS:
-    """Load a persisted FAISS index or build it from documents if missing.
+def refresh_bm25(vector_store: FAISS, persist_dir: str, settings: Settings) -> None:
+    """Rebuild the persisted BM25 index after a build or update, if it is used.
+
+    BM25 statistics (idf, average document length) depend on the whole
+    corpus, so the index is rebuilt from every chunk in the docstore: even an
+    update touching one file costs a full pass over the corpus. It is only
+    paid with ``settings.search_type == "hybrid"``; otherwise a stale file is
+    removed and `load_or_build_bm25` builds a fresh one on first hybrid use.
+
+    Args:
+        vector_store (FAISS): Vector store whose docstore holds the chunks.
+        persist_dir (str): Directory holding the FAISS artifacts.
+        settings (Settings): Retrieval configuration (``search_type``).
+    """
+    path = Path(persist_dir) / BM25_FILE
+    if settings.search_type == "hybrid":
+        # BM25 letto dal docstore su disco, un chunk alla volta
+        bm25_from_vectorstore(vector_store).save(str(path))
+    else:
+        path.unlink(missing_ok=True)
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+def _doc_source(doc: Document) -> str:
+    return str(doc.metadata.get("source") or doc.metadata.get("id") or "")
+
+
+def hash_sources(docs: Iterable[Document]) -> Dict[str, str]:
+    """Compute a content hash for every source in `docs`.
+
+    Documents sharing the same ``source`` metadata are hashed together, in
+    order, together with their metadata. Only the running digests are kept,
+    so `docs` can be a generator.
+
+    Args:
+        docs (Iterable[Document]): Source documents.
+
+    Returns:
+        Dict[str, str]: Mapping ``source -> sha256 hex digest``.
+
+    Examples:
+        >>> a = Document(page_content="x", metadata={"source": "a.md"})
+        >>> b = Document(page_content="y", metadata={"source": "a.md"})
+        >>> list(hash_sources([a, b])) == ["a.md"]
+        True
+        >>> hash_sources([a])["a.md"] == hash_sources([b])["a.md"]
+        False
+    """
+    digests: Dict[str, Any] = {}
+    for doc in docs:
+        h = digests.setdefault(_doc_source(doc), hashlib.sha256())
+        h.update(doc.page_content.encode("utf-8"))
+        h.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return {src: h.hexdigest() for src, h in digests.items()}
+
+
+def current_hashes(
+    docs: DocumentSource, manifest: Optional[Dict[str, Any]], settings: Settings
+) -> Tuple[Dict[str, str], Optional[Dict[str, List[int]]]]:
+    """Return the current source hashes, reading only files that may have changed.
+
+    For a `DirectorySource` the size and modification time of every file are
+    compared with those recorded in `manifest`: files with the same stat keep
+    their recorded hash and are not read. Other sources, and every file when
+    ``settings.reindex`` is set, are read and hashed.
+
+    Args:
+        docs (DocumentSource): Current source documents.
+        manifest (dict | None): Manifest of the persisted index, if any.
+        settings (Settings): Configuration (``reindex``).
+
+    Returns:
+        Tuple[dict, dict | None]: ``source -> hash`` and, for a directory,
+        ``source -> [mtime_ns, size]`` to store in the manifest.
+    """
+    if not isinstance(docs, DirectorySource):
+        return hash_sources(_iter_docs(docs)), None
+    # Stat prima della lettura: un file modificato nel frattempo verra' riletto al prossimo avvio
+    stats = docs.stat()
+    old_sources = (manifest or {}).get("sources", {})
+    stale = {
+        src for src, st in stats.items()
+        if settings.reindex or old_sources.get(src, {}).get("stat") != st
+        or not old_sources.get(src, {}).get("hash")
+    }
+    hashes = {src: old_sources[src]["hash"] for src in stats if src not in stale}
+    hashes.update(hash_sources(docs.load(stale)))
+    return hashes, stats
+
+
+def _record_stats(manifest: Dict[str, Any], stats: Optional[Dict[str, List[int]]]) -> bool:
+    """Store the file stats in the manifest entries; return True if any changed."""
+    updated = False
+    for src, entry in manifest.get("sources", {}).items():
+        if stats and src in stats and entry.get("stat") != stats[src]:
+            entry["stat"] = stats[src]
+            updated = True
+    return updated
+
+
+def _splitter_params(settings: Settings) -> Dict[str, Any]:
+    # Se cambiano questi parametri i chunk esistenti non sono piu' validi
+    if settings.splitter == "markdown":
+        return {
+            "splitter": "markdown",
+            "chunk_tokens": settings.chunk_tokens,
+            "chunk_overlap_tokens": settings.chunk_overlap_tokens,
+        }
+    return {"chunk_size": settings.chunk_size, "chunk_overlap": settings.chunk_overlap}
+
+
+def read_manifest(persist_dir: str) -> Optional[Dict[str, Any]]:
+    """Read the per-source manifest stored next to the index.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+
+    Returns:
+        dict | None: The manifest, or ``None`` if missing.
+    """
+    path = Path(persist_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(persist_dir: str, manifest: Dict[str, Any]) -> None:
+    """Atomically write the manifest next to the index.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+        manifest (dict): Manifest with ``splitter`` and ``sources`` keys.
+    """
+    path = Path(persist_dir) / MANIFEST_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _manifest_from_docstore(vector_store: FAISS) -> Dict[str, Any]:
+    """Rebuild a manifest for an index persisted before manifests existed.
+
+    Hashes are unknown, so every source is re-embedded on the next update.
+    """
+    sources: Dict[str, Dict[str, Any]] = {}
+    for doc_id in vector_store.index_to_docstore_id.values():
+        doc = vector_store.docstore.search(doc_id)
+        src = _doc_source(doc) if isinstance(doc, Document) else ""
+        sources.setdefault(src, {"hash": None, "ids": []})["ids"].append(doc_id)
+    return {"splitter": None, "sources": sources}
+
+
+def _split_sources(
+    docs: Iterable[Document],
+    hashes: Dict[str, str],
+    settings: Settings,
+    stats: Optional[SplitStats] = None,
+) -> Tuple[List[Document], List[str], Dict[str, Dict[str, Any]]]:
+    """Split `docs` and assign deterministic ids of the form ``<hash>-<n>``."""
+    sources: Dict[str, Dict[str, Any]] = {}
+    pairs = list(_iter_split_sources(docs, hashes, settings, sources, stats))
+    return [chunk for chunk, _ in pairs], [chunk_id for _, chunk_id in pairs], sources
+
+
+def _iter_split_sources(
+    docs: Iterable[Document],
+    hashes: Dict[str, str],
+    settings: Settings,
+    sources: Dict[str, Dict[str, Any]],
+    stats: Optional[SplitStats] = None,
+) -> Iterator[Tuple[Document, str]]:
+    """Lazy `_split_sources`: yield ``(chunk, id)`` and fill `sources` as it goes."""
+    for chunk in iter_split_documents(docs, settings, stats):
+        src = _doc_source(chunk)
+        entry = sources.setdefault(src, {"hash": hashes[src], "ids": []})
+        chunk_id = f"{hashes[src][:16]}-{len(entry['ids'])}"
+        entry["ids"].append(chunk_id)
+        yield chunk, chunk_id
+    # Sorgenti che non producono chunk (es. file vuoti) restano tracciate
+    for src, h in hashes.items():
+        sources.setdefault(src, {"hash": h, "ids": []})
+
+
+def diff_sources(
+    manifest: Dict[str, Any], hashes: Dict[str, str], settings: Settings
+) -> Tuple[set, set, Dict[str, Dict[str, Any]]]:
+    """Compare the manifest with the current source hashes.
+
+    Args:
+        manifest (dict): Manifest describing the current index content.
+        hashes (Dict[str, str]): Current ``source -> hash`` mapping.
+        settings (Settings): Chunking configuration.
+
+    Returns:
+        Tuple[set, set, dict]: Changed or new sources, removed sources, and the
+        manifest sources (with hashes cleared if the splitter changed).
+
+    Examples:
+        >>> m = {"splitter": _splitter_params(Settings()), "sources": {"a": {"hash": "1", "ids": []}}}
+        >>> diff_sources(m, {"a": "1", "b": "2"}, Settings())[:2]
+        ({'b'}, set())
+    """
+    old_sources = manifest.get("sources", {})
+    if manifest.get("splitter") != _splitter_params(settings):
+        # Parametri di splitting diversi: tutto va ri-chunkato
+        old_sources = {src: {"hash": None, "ids": e["ids"]} for src, e in old_sources.items()}
+
+    changed = {src for src, h in hashes.items() if old_sources.get(src, {}).get("hash") != h}
+    removed = set(old_sources) - set(hashes)
+    return changed, removed, old_sources
+
+
+def update_vectorstore(
+    vector_store: FAISS,
+    manifest: Dict[str, Any],
+    docs: DocumentSource,
+    settings: Settings,
+    embeddings: Embeddings,
+    hashes: Optional[Dict[str, str]] = None,
+) -> Tuple[Dict[str, Any], bool]:
+    """Apply only the source-level changes between `manifest` and `docs`.
+
+    New or changed sources are split and embedded; chunks of changed or deleted
+    sources are removed from the index.
+
+    Args:
+        vector_store (FAISS): Loaded vector store, modified in place.
+        manifest (dict): Manifest describing the current index content.
+        docs (DocumentSource): Current source documents, or a callable that
+            returns a fresh iterator over them.
+        settings (Settings): Chunking and indexing configuration.
+        embeddings (Embeddings): Embedding model for the new chunks.
+        hashes (Dict[str, str] | None): Precomputed `hash_sources(docs)`.
+
+    Returns:
+        Tuple[dict, bool]: Updated manifest and whether the index changed.
+    """
+    hashes = hashes if hashes is not None else hash_sources(_iter_docs(docs))
+    changed, removed, old_sources = diff_sources(manifest, hashes, settings)
+
+    stale_ids = [i for src in changed | removed for i in old_sources.get(src, {}).get("ids", [])]
+    if stale_ids:
+        remove_ids(vector_store, stale_ids)
+
+    new_sources = {src: e for src, e in old_sources.items() if src not in changed | removed}
+    chunking = manifest.get("chunking")
+    if changed:
+        changed_docs = _iter_docs_of(docs, changed)
+        stats = SplitStats()
+        chunks, ids, sources = _split_sources(
+            changed_docs, {src: hashes[src] for src in changed}, settings, stats
+        )
+        chunking = stats.as_dict()
+        if chunks:
+            vector_store.add_embeddings(
+                embed_chunks(chunks, embeddings, settings, settings.persist_dir),
+                metadatas=[c.metadata for c in chunks],
+                ids=ids,
+            )
+        new_sources.update(sources)
+
+    new_manifest = {"splitter": _splitter_params(settings), "sources": new_sources, "chunking": chunking}
+    return new_manifest, bool(stale_ids or changed or removed)
+
+
+def load_or_build_vectorstore(settings: Settings, embeddings: AzureOpenAI, docs: DocumentSource) -> FAISS:
+    """Load a persisted FAISS index, updating it incrementally, or build it.
+
+    A manifest of per-source content hashes is stored next to the index. On
+    load only new or changed sources are split and embedded, and chunks of
+    deleted sources are removed, so the cost is proportional to the change;
+    with hybrid search the BM25 index is still rebuilt from the whole corpus
+    (see `refresh_bm25`). If `settings.index` asks for a different index type or build parameters,
+    the index is rebuilt.
+
+    The index is memory-mapped and documents are read lazily from SQLite (see
+    `rag_med.tools.persistence`); stores in the old pickle format are
+    converted on first load.
+
+    When `docs` is a callable (e.g. ``lambda: iter_directory_documents(path)``)
+    sources are streamed: once to hash them and once to split the changed
+    ones, so the corpus is never held in memory. With a `DirectorySource`
+    the manifest also records each file's size and modification time, and
+    loading an existing index only reads files whose stat changed (all of
+    them with ``settings.reindex``), so an unchanged corpus costs one
+    ``stat`` per file. A full build is pipelined:
+    loading, splitting, embedding and FAISS ``add`` run concurrently with
+    bounded queues between them (`rag_med.tools.pipeline`). The split counters of the
+    last build or update, including the amplification ratio, are stored
+    under ``chunking`` in the manifest.
 
     Args:
         settings (Settings): Configuration including persistence directory.
         embeddings (AzureOpenAIEmbeddings): Embedding model.
-        docs (List[Document]): Source documents.
+        docs (DocumentSource): Source documents, or a callable returning a
+            fresh iterator over them.
 
     Returns:
         FAISS: Loaded or newly built vector store.
     """
-    persist_path = Path(settings.persist_dir)
-    index_file = persist_path / "index.faiss"
-    meta_file = persist_path / "index.pkl"
-
-    if index_file.exists() and meta_file.exists():
-        # Dal 2024/2025 molte build richiedono il flag 'allow_dangerous_deserialization' per caricare pkl locali
-        return FAISS.load_local(
-            settings.persist_dir,
-            embeddings,
-            allow_dangerous_deserialization=True
-        )
+    migrate_legacy_store(settings.persist_dir, embeddings)
+    rebuild_needed = read_index_params(settings.persist_dir)["requested"] != build_params(settings.index)
+
+    if has_vectorstore(settings.persist_dir) and not rebuild_needed:
+        vs = load_vectorstore(settings.persist_dir, embeddings, mmap=True)
+        manifest = read_manifest(settings.persist_dir) or _manifest_from_docstore(vs)
+        hashes, file_stats = current_hashes(docs, manifest, settings)
+        changed, removed, _ = diff_sources(manifest, hashes, settings)
+        if changed or removed:
+            # Un indice mappato in memoria e' di sola lettura: ricarica per aggiornarlo,
+            # chiudendo prima la connessione SQLite della copia mappata
+            close_vectorstore(vs)
+            vs = load_vectorstore(settings.persist_dir, embeddings, mmap=False)
+            manifest, _ = update_vectorstore(vs, manifest, docs, settings, embeddings, hashes)
+            save_vectorstore(vs, settings.persist_dir)
+            refresh_bm25(vs, settings.persist_dir, settings)
+            _record_stats(manifest, file_stats)
+            write_manifest(settings.persist_dir, manifest)
+            clear_checkpoints(str(Path(settings.persist_dir) / CHECKPOINT_DIR))
+            notify_index_changed(settings.persist_dir)
+        elif _record_stats(manifest, file_stats):
+            # File toccati ma con lo stesso contenuto: si aggiornano solo le stat
+            write_manifest(settings.persist_dir, manifest)
+        apply_search_params(vs.index, settings.index.nprobe, settings.index.ef_search, settings.index.k_factor)
+        return vs
+
+    hashes, file_stats = current_hashes(docs, None, settings)
+    # Il manifest di un indice precedente non descrive quello nuovo: va riscritto dopo il build
+    (Path(settings.persist_dir) / MANIFEST_FILE).unlink(missing_ok=True)
+
+    # Build in streaming: lettura, splitting, embedding e add si sovrappongono
+    stats = SplitStats()
+    sources: Dict[str, Dict[str, Any]] = {}
+    docs_iter = prefetch(_iter_docs(docs), settings.build_queue_size)
+    chunks = prefetch(
+        _iter_split_sources(docs_iter, hashes, settings, sources, stats),
+        settings.build_queue_size * settings.embed_batch_size,
+    )
+    vs = _build_vectorstore_streaming(chunks, embeddings, settings.persist_dir, settings)
+    _record_stats({"sources": sources}, file_stats)
+    write_manifest(settings.persist_dir, {
+        "splitter": _splitter_params(settings),
+        "sources": sources,
+        "chunking": stats.as_dict(),
+    })
+    return vs
 
-    chunks = split_documents(docs, settings)
-    return build_faiss_vectorstore(chunks, embeddings, settings.persist_dir)
 
+def make_retriever(vector_store: FAISS, settings: Settings, timings: Optional[StageTimings] = None):
+    """Configure a retriever in MMR, pure similarity or hybrid mode.
 
-def make_retriever(vector_store: FAISS, settings: Settings):
-    """Configure a retriever in MMR or pure similarity mode.
+    The similarity retriever applies the search-time knobs of
+    `settings.index` and accepts per-query overrides, e.g.
+    ``retriever.invoke(question, nprobe=64)``. The MMR retriever re-ranks
+    `settings.fetch_k` candidates using vectors reconstructed from the index.
+    The hybrid retriever fuses the top `settings.fetch_k` dense and BM25 hits
+    with reciprocal-rank fusion. With `settings.rerank`, the chosen retriever
+    returns `settings.fetch_k` candidates and a cross-encoder keeps the best
+    `settings.k`.
 
     Args:
         vector_store (FAISS): The vector store backing the retriever.
         settings (Settings): Retrieval configuration.
+        timings (StageTimings | None): Receives the latency of the first-stage
+            search (``retrieve``) and of the cross-encoder (``rerank``).
 
     Returns:
         Any: A retriever compatible with LangChain invoke interface.
     """
+    if settings.rerank:
+        return RerankingRetriever(
+            base=make_retriever(vector_store, _candidate_settings(settings), timings),
+            reranker=CrossEncoderReranker(settings.rerank_model, settings.rerank_batch_size),
+            k=settings.k,
+            timings=timings,
+        )
     if settings.search_type == "mmr":
-        return vector_store.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": settings.k, "fetch_k": settings.fetch_k, "lambda_mult": settings.mmr_lambda},
+        retriever = MMRRetriever(
+            vector_store=vector_store,
+            k=settings.k,
+            fetch_k=settings.fetch_k,
+            lambda_mult=settings.mmr_lambda,
+            nprobe=settings.index.nprobe,
+            ef_search=settings.index.ef_search,
+        )
+    elif settings.search_type == "hybrid":
+        retriever = HybridRetriever(
+            vector_store=vector_store,
+            bm25=load_or_build_bm25(settings.persist_dir, vector_store),
+            k=settings.k,
+            fetch_k=settings.fetch_k,
+            rrf_k=settings.rrf_k,
+            nprobe=settings.index.nprobe,
+            ef_search=settings.index.ef_search,
         )
     else:
-        return vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": settings.k},
+        retriever = FaissRetriever(
+            vector_store=vector_store,
+            k=settings.k,
+            nprobe=settings.index.nprobe,
+            ef_search=settings.index.ef_search,
         )
+    return TimedRetriever(base=retriever, timings=timings) if timings is not None else retriever
 
 
-def format_docs_for_prompt(docs: List[Document]) -> str:
+def _candidate_settings(settings: Settings) -> Settings:
+    # Il retriever di base restituisce fetch_k candidati da ri-ordinare
+    return replace(settings, rerank=False, k=max(settings.k, settings.fetch_k))
+
+
+def format_docs_for_prompt(docs: List[Document], max_tokens: Optional[int] = None) -> str:
     """Format retrieved docs into a string with [source:...] citations.
 
+    Overlapping chunks of the same source are merged, near-duplicates are
+    dropped and passages are grouped under one header per source; with a
+    budget, the lowest-ranked passages are truncated first (see
+    `rag_med.tools.context_packing.pack_context`).
+
     Args:
-        docs (List[Document]): Retrieved documents to include in the prompt.
+        docs (List[Document]): Retrieved documents to include in the prompt, best first.
+        max_tokens (int | None): Token budget for the context.
 
     Returns:
         str: Formatted context string.
-    """
-    lines = []
-    for i, d in enumerate(docs, start=1):
-        src = d.metadata.get("source", f"doc{i}")
-        lines.append(f"[source:{src}] {d.page_content}")
-    return "\n\n".join(lines)
 
+    Examples:
+        >>> print(format_docs_for_prompt([Document(page_content="testo", metadata={"source": "a.md"})]))
+        [source:a.md]
+        testo
+    """
+    return pack_context(docs, max_tokens).text
 
-def build_rag_chain(llm, retriever):
-    """Build the RAG chain: retrieval -> prompt -> LLM -> string output.
 
-    Args:
-        llm: The chat model to generate answers.
-        retriever: The retriever providing relevant context for the prompt.
+def build_rag_prompt() -> ChatPromptTemplate:
+    """Return the prompt shared by every RAG chain.
 
     Returns:
-        Runnable: A chain that maps a question string to an answer string.
+        ChatPromptTemplate: Prompt with ``question`` and ``context`` variables.
     """
     system_prompt = (
         "Sei un assistente esperto. Rispondi in italiano. "
@@ -306,7 +973,7 @@ def build_rag_chain(llm, retriever):
         "Sii conciso, accurato e tecnicamente corretto."
     )
 
-    prompt = ChatPromptTemplate.from_messages([
+    return ChatPromptTemplate.from_messages([
         ("system", system_prompt),
         ("human",
          "Domanda:\n{question}\n\n"
@@ -318,51 +985,261 @@ def build_rag_chain(llm, retriever):
          "4) Non contraddire assolutamente il CONTENUTO fornito nel contesto.")
     ])
 
+
+def _pack_and_record(
+    docs: List[Document], max_tokens: Optional[int], timings: Optional[StageTimings]
+) -> PackedContext:
+    packed = pack_context(docs, max_tokens)
+    if timings is not None:
+        timings.record_value("context_tokens", packed.tokens)
+    return packed
+
+
+def build_rag_chain(
+    llm, retriever, max_context_tokens: Optional[int] = None, timings: Optional[StageTimings] = None
+):
+    """Build the RAG chain: retrieval -> prompt -> LLM -> string output.
+
+    Args:
+        llm: The chat model to generate answers.
+        retriever: The retriever providing relevant context for the prompt.
+        max_context_tokens (int | None): Token budget of the packed context.
+        timings (StageTimings | None): Receives the packed context size of
+            every query as ``context_tokens`` (see `StageTimings.value_summary`).
+
+    Returns:
+        Runnable: A chain that maps a question string to an answer string.
+    """
     # LCEL: dict -> prompt -> llm -> parser
     chain = (
         {
-            "context": retriever | format_docs_for_prompt,
+            "context": retriever
+            | RunnableLambda(lambda docs: _pack_and_record(docs, max_context_tokens, timings).text),
             "question": RunnablePassthrough(),
         }
-        | prompt
+        | build_rag_prompt()
         | llm
         | StrOutputParser()
     )
     return chain
 
 
-def rag_answer(question: str, chain) -> str:
+def build_rag_chain_with_sources(
+    llm, retriever, max_context_tokens: Optional[int] = None, timings: Optional[StageTimings] = None
+):
+    """Build a RAG chain that returns the answer together with its context.
+
+    Retrieval runs once; the retrieved documents are passed through next to
+    the answer, so callers see exactly the context the LLM was given. The
+    packed context is returned too, with the prompt tokens it saved.
+
+    Args:
+        llm: The chat model to generate answers.
+        retriever: The retriever providing relevant context for the prompt.
+        max_context_tokens (int | None): Token budget of the packed context.
+        timings (StageTimings | None): Receives the packed context size of
+            every query as ``context_tokens``.
+
+    Returns:
+        Runnable: A chain mapping a question string to a dict with keys
+        ``question``, ``docs`` (List[Document]), ``context``
+        (`PackedContext`, see ``saved_tokens``) and ``answer`` (str).
+    """
+    generation = (
+        RunnableLambda(lambda x: {
+            "context": x["context"].text,
+            "question": x["question"],
+        })
+        | build_rag_prompt()
+        | llm
+        | StrOutputParser()
+    )
+    return RunnableParallel(
+        docs=retriever,
+        question=RunnablePassthrough(),
+    ).assign(
+        context=RunnableLambda(lambda x: _pack_and_record(x["docs"], max_context_tokens, timings))
+    ).assign(answer=generation)
+
+
+def rag_answer(question: str, chain, cache: Optional[SemanticAnswerCache] = None) -> str:
     """Execute the RAG chain for a single question.
 
     Args:
         question (str): Natural language question.
         chain: A chain created by `build_rag_chain`.
+        cache (SemanticAnswerCache | None): Optional semantic answer cache;
+            a similar past question returns its answer without running the chain.
 
     Returns:
         str: The generated answer.
 
     Examples:
-        >>> def _fake_chain(q):
-        ...     return f"echo: {q}"
+        >>> _fake_chain = RunnableLambda(lambda q: f"echo: {q}")
         >>> rag_answer("test", _fake_chain)
         'echo: test'
     """
+    if cache is not None:
+        return cache.get_or_compute(question, lambda: chain.invoke(question))
     return chain.invoke(question)
 
 
-def get_contexts_for_question(retriever, question: str, k: int) -> List[str]:
-    """Return the text of the top-k retrieved chunks used as context.
+def retrieve_batch(questions: List[str], vector_store: FAISS, settings: Settings) -> List[List[Document]]:
+    """Retrieve the context documents of many questions at once.
+
+    All questions are embedded with a single `embed_documents` request and
+    searched with one batched FAISS call on the query matrix. With
+    `settings.rerank`, the candidates of all questions are re-ranked in one
+    batched cross-encoder call.
 
     Args:
-        retriever: Retriever with an `invoke` method that returns Documents.
-        question (str): The user query.
-        k (int): Number of contexts to return.
+        questions (List[str]): Natural language questions.
+        vector_store (FAISS): Vector store to search.
+        settings (Settings): Retrieval configuration.
 
     Returns:
-        List[str]: The page contents of the top-k retrieved documents.
+        List[List[Document]]: Retrieved documents per question, in input order.
     """
-    docs = docs = retriever.invoke(question)[:k]
-    return [d.page_content for d in docs]
+    if not questions:
+        return []
+    if settings.rerank:
+        candidates = retrieve_batch(questions, vector_store, _candidate_settings(settings))
+        reranker = CrossEncoderReranker(settings.rerank_model, settings.rerank_batch_size)
+        return reranker.rerank_batch(questions, candidates, settings.k)
+    fn = vector_store.embedding_function
+    vectors = np.asarray(
+        fn.embed_documents(questions) if isinstance(fn, Embeddings) else [fn(q) for q in questions],
+        dtype=np.float32,
+    )
+    if settings.search_type == "mmr":
+        return mmr_search(
+            vector_store,
+            vectors,
+            settings.k,
+            settings.fetch_k,
+            lambda_mult=settings.mmr_lambda,
+            nprobe=settings.index.nprobe,
+            ef_search=settings.index.ef_search,
+        )
+    if settings.search_type == "hybrid":
+        bm25 = load_or_build_bm25(settings.persist_dir, vector_store)
+        return [
+            hybrid_search(
+                vector_store,
+                bm25,
+                q,
+                settings.k,
+                settings.fetch_k,
+                rrf_k=settings.rrf_k,
+                query_vector=v,
+                nprobe=settings.index.nprobe,
+                ef_search=settings.index.ef_search,
+            )
+            for q, v in zip(questions, vectors)
+        ]
+    hits = search_vectors(
+        vector_store,
+        vectors,
+        settings.k,
+        nprobe=settings.index.nprobe,
+        ef_search=settings.index.ef_search,
+    )
+    return [[doc for doc, _ in row] for row in hits]
+
+
+def rag_answer_batch(
+    questions: List[str],
+    vector_store: FAISS,
+    llm,
+    settings: Optional[Settings] = None,
+    max_concurrency: Optional[int] = None,
+) -> List[str]:
+    """Answer many questions with shared retrieval and concurrent generation.
+
+    Retrieval uses `retrieve_batch` (one embeddings request, one FAISS search);
+    generation runs through LCEL ``batch`` with at most `max_concurrency` LLM
+    calls in flight.
+
+    Args:
+        questions (List[str]): Natural language questions.
+        vector_store (FAISS): Vector store to search.
+        llm: Chat model used for generation.
+        settings (Settings | None): Configuration; defaults to `SETTINGS`.
+        max_concurrency (int | None): LLM calls in flight; defaults to
+            `settings.generation_max_concurrency`.
+
+    Returns:
+        List[str]: Answers in the same order as `questions`.
+
+    Examples:
+        >>> components = get_rag_components()  # doctest: +SKIP
+        >>> rag_answer_batch(["Cos'e' FAISS?"], components.vector_store, components.llm)  # doctest: +SKIP
+        ['FAISS è una libreria ... [source:faiss-overview.md]']
+    """
+    settings = settings or SETTINGS
+    contexts = retrieve_batch(questions, vector_store, settings)
+    generation = build_rag_prompt() | llm | StrOutputParser()
+    inputs = [
+        {"question": q, "context": format_docs_for_prompt(docs, settings.context_max_tokens)}
+        for q, docs in zip(questions, contexts)
+    ]
+    return generation.batch(
+        inputs,
+        config={"max_concurrency": max_concurrency or settings.generation_max_concurrency},
+    )
+
+
+def rag_answer_stream(
+    question: str, chain, cache: Optional[SemanticAnswerCache] = None
+) -> Iterator[str]:
+    """Stream the answer of the RAG chain token by token.
+
+    Args:
+        question (str): Natural language question.
+        chain: A chain created by `build_rag_chain`.
+        cache (SemanticAnswerCache | None): Optional semantic answer cache; a
+            hit is yielded as a single piece, a miss is cached once complete.
+
+    Yields:
+        str: Answer fragments as they arrive from the LLM.
+
+    Examples:
+        >>> _fake_chain = RunnableLambda(lambda q: f"echo: {q}")
+        >>> "".join(rag_answer_stream("test", _fake_chain))
+        'echo: test'
+    """
+    if cache is None:
+        yield from chain.stream(question)
+        return
+
+    entry, vector = cache.lookup(question)
+    if entry is not None:
+        cache.record_hit(entry)
+        yield entry.answer
+        return
+
+    start = time.perf_counter()
+    parts = []
+    for token in chain.stream(question):
+        parts.append(token)
+        yield token
+    cache.store(question, "".join(parts), time.perf_counter() - start, vector)
+    cache.record_miss()
+
+
+async def arag_answer_stream(question: str, chain) -> AsyncIterator[str]:
+    """Asynchronously stream the answer of the RAG chain.
+
+    Args:
+        question (str): Natural language question.
+        chain: A chain created by `build_rag_chain`.
+
+    Yields:
+        str: Answer fragments as they arrive from the LLM.
+    """
+    async for token in chain.astream(question):
+        yield token
+
 
 def build_ragas_dataset(
     questions: List[str],
@@ -370,28 +1247,39 @@ def build_ragas_dataset(
     chain,
     k: int,
     ground_truth: dict[str, str] | None = None,
+    max_concurrency: int = 4,
 ):
     """Run RAG for each question and return a dataset suitable for Ragas.
 
+    With a chain from `build_rag_chain_with_sources` each question is
+    retrieved once: the contexts in the dataset are the documents the answer
+    was generated from. A chain that returns a plain answer string (e.g.
+    `build_rag_chain`) is still accepted; its contexts are then fetched with
+    `retriever`, at the cost of a second retrieval per question.
+
     Args:
         questions (List[str]): Questions to evaluate.
-        retriever: Retriever used to obtain contexts.
-        chain: Chain used to produce answers.
+        retriever: Retriever used only for chains that do not return ``docs``.
+        chain: Chain created by `build_rag_chain_with_sources` (or `build_rag_chain`).
         k (int): Number of contexts per question.
         ground_truth (dict[str, str] | None): Optional references keyed by question.
+        max_concurrency (int): Questions processed in parallel.
 
     Returns:
         list[dict]: Each row contains user_input, retrieved_contexts, response, and optional reference.
     """
-    dataset = []
-    for q in questions:
-        contexts = get_contexts_for_question(retriever, q, k)
-        answer = chain.invoke(q)
+    results = chain.batch(questions, config={"max_concurrency": max_concurrency})
 
+    dataset = []
+    for q, result in zip(questions, results):
+        if isinstance(result, dict):
+            docs, answer = result["docs"], result["answer"]
+        else:
+            docs, answer = retriever.invoke(q), result
         row = {
             # chiavi richieste da molte metriche Ragas
             "user_input": q,
-            "retrieved_contexts": contexts,
+            "retrieved_contexts": [d.page_content for d in docs[:k]],
             "response": answer,
         }
         if ground_truth and q in ground_truth:
@@ -402,38 +1290,302 @@ def build_ragas_dataset(
 
 
 # =========================
-# Esecuzione dimostrativa
+# Registry dei componenti RAG
 # =========================
 
-def setup():
-    """Create and return a ready-to-use RAG chain using default settings.
+@dataclass
+class RagComponents:
+    """Ready-to-use RAG objects built from a single `Settings` instance.
+
+    Attributes:
+        embeddings (AzureOpenAIEmbeddings): Embeddings client.
+        llm (AzureChatOpenAI): Chat model used for generation.
+        vector_store (FAISS): Loaded or freshly built vector store.
+        retriever (Any): Retriever configured from the settings.
+        chain (Any): RAG chain mapping a question to an answer string.
+        answer_cache (SemanticAnswerCache | None): Semantic answer cache, if enabled.
+        timings (StageTimings | None): Latency of the ``retrieve``, ``rerank``
+            and ``generate`` stages (see `StageTimings.summary`) and the packed
+            context size per query (``context_tokens``, see
+            `StageTimings.value_summary`).
+    """
+    embeddings: Any
+    llm: Any
+    vector_store: FAISS
+    retriever: Any
+    chain: Any
+    answer_cache: Optional[SemanticAnswerCache] = None
+    timings: Optional[StageTimings] = None
+
+
+@dataclass
+class _RegistryEntry:
+    settings: Settings
+    components: RagComponents
+    index_signature: Tuple
+
+
+_REGISTRY: Dict[str, _RegistryEntry] = {}
+_REGISTRY_LOCK = threading.Lock()
+_KEY_LOCKS: Dict[str, threading.Lock] = {}
+_INDEX_LISTENERS: List[Callable[[str], None]] = []
+
+
+def _settings_key(settings: Settings) -> str:
+    """Return a stable, hashable key for a `Settings` instance.
+
+    Args:
+        settings (Settings): Runtime configuration.
+
+    Returns:
+        str: JSON serialization of the settings with sorted keys.
+
+    Examples:
+        >>> _settings_key(Settings()) == _settings_key(Settings())
+        True
+        >>> _settings_key(Settings(k=1)) == _settings_key(Settings(k=2))
+        False
+    """
+    return json.dumps(asdict(settings), sort_keys=True, default=str)
+
+
+INDEX_ARTIFACTS = (
+    "index.faiss", "docstore.sqlite", "index.pkl", "manifest.json", "index_params.json", "bm25.npz",
+    "generation.json",
+)
+
+
+def index_signature(persist_dir: str) -> Tuple:
+    """Return (name, mtime_ns, size) of every persisted index artifact.
+
+    The signature changes whenever the index is rewritten on disk, including by
+    another process, and is cheap to compute (a couple of ``stat`` calls).
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+
+    Returns:
+        Tuple: One entry per existing artifact.
+    """
+    signature = []
+    for name in INDEX_ARTIFACTS:
+        path = Path(persist_dir) / name
+        if path.is_file():
+            stat = path.stat()
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def index_version(persist_dir: str) -> str:
+    """Return a short version id of the persisted index, changing on every rewrite.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+
+    Returns:
+        str: Hex digest of the artifacts' signature.
+    """
+    return hashlib.sha1(repr(index_signature(persist_dir)).encode("utf-8")).hexdigest()[:12]
+
+
+def same_dir(a: str, b: str) -> bool:
+    """Return True if `a` and `b` name the same directory once resolved.
+
+    Examples:
+        >>> same_dir("indice", "./indice/../indice")
+        True
+    """
+    return Path(a).resolve() == Path(b).resolve()
+
+
+def register_index_listener(callback: Callable[[str], None]) -> None:
+    """Register a callback fired after a persisted index has changed.
+
+    Args:
+        callback (Callable[[str], None]): Function receiving the persist dir.
+    """
+    with _REGISTRY_LOCK:
+        _INDEX_LISTENERS.append(callback)
+
+
+def unregister_index_listener(callback: Callable[[str], None]) -> None:
+    """Remove a callback added with `register_index_listener`, if present.
+
+    Args:
+        callback (Callable[[str], None]): The registered callback.
+    """
+    with _REGISTRY_LOCK:
+        if callback in _INDEX_LISTENERS:
+            _INDEX_LISTENERS.remove(callback)
+
+
+def invalidate_rag_registry(persist_dir: Optional[str] = None) -> None:
+    """Drop cached RAG components so the next lookup rebuilds them.
+
+    Args:
+        persist_dir (str | None): Only drop entries backed by this directory.
+            When ``None`` every entry is dropped.
+
+    Examples:
+        >>> invalidate_rag_registry()
+        >>> len(_REGISTRY)
+        0
+    """
+    with _REGISTRY_LOCK:
+        for key, entry in list(_REGISTRY.items()):
+            if persist_dir is None or same_dir(entry.settings.persist_dir, persist_dir):
+                del _REGISTRY[key]
+
+
+def notify_index_changed(persist_dir: str) -> None:
+    """Invalidate the registry and fire the listeners for `persist_dir`.
+
+    Called after the index has been written to disk.
+
+    Args:
+        persist_dir (str): Directory whose artifacts changed.
+    """
+    invalidate_rag_registry(persist_dir)
+    with _REGISTRY_LOCK:
+        listeners = list(_INDEX_LISTENERS)
+    for callback in listeners:
+        callback(persist_dir)
+
+
+def get_rag_components(settings: Optional[Settings] = None) -> RagComponents:
+    """Return the process-wide RAG components for `settings`, building them lazily.
+
+    Components are built once per distinct `Settings` value and reused by every
+    thread. An entry is rebuilt when the persisted index changes on disk or
+    after `invalidate_rag_registry` / `notify_index_changed`.
+
+    Args:
+        settings (Settings | None): Configuration; defaults to `SETTINGS`.
+
+    Returns:
+        RagComponents: The cached components.
+    """
+    settings = settings or SETTINGS
+    key = _settings_key(settings)
+
+    with _REGISTRY_LOCK:
+        entry = _REGISTRY.get(key)
+        if entry and entry.index_signature == index_signature(settings.persist_dir):
+            return entry.components
+        key_lock = _KEY_LOCKS.setdefault(key, threading.Lock())
+
+    # Un lock per chiave: build concorrenti di settings diversi non si bloccano
+    with key_lock:
+        with _REGISTRY_LOCK:
+            entry = _REGISTRY.get(key)
+            if entry and entry.index_signature == index_signature(settings.persist_dir):
+                return entry.components
+
+        components = build_components(settings)
+
+        with _REGISTRY_LOCK:
+            _REGISTRY[key] = _RegistryEntry(
+                settings=settings,
+                components=components,
+                index_signature=index_signature(settings.persist_dir),
+            )
+        return components
+
+
+def get_rag_chain(settings: Optional[Settings] = None):
+    """Return the cached RAG chain for `settings`.
+
+    Args:
+        settings (Settings | None): Configuration; defaults to `SETTINGS`.
 
     Returns:
         Any: A chain that accepts a question and returns an answer string.
 
     Examples:
-        >>> chain = setup()  # doctest: +SKIP
-        >>> isinstance(chain, object)  # doctest: +SKIP
+        >>> chain = get_rag_chain()  # doctest: +SKIP
+        >>> chain is get_rag_chain()  # doctest: +SKIP
         True
     """
-    settings = SETTINGS
+    return get_rag_components(settings).chain
+
+
+# =========================
+# Esecuzione dimostrativa
+# =========================
+
+def build_components(
+    settings: Settings, embeddings: Optional[Embeddings] = None, llm: Optional[Any] = None
+) -> RagComponents:
+    """Build embeddings, LLM, vector store, retriever and chain from scratch.
+
+    Prefer `get_rag_components`, which caches the result.
+
+    Args:
+        settings (Settings): Runtime configuration.
+        embeddings (Embeddings | None): Client to reuse instead of calling
+            `get_embeddings` (see `embeddings_client_key`).
+        llm (Any | None): Chat model to reuse instead of calling
+            `get_llm_from_lmstudio` (see `llm_client_key`).
 
-    # 1) Componenti
-    embeddings = get_embeddings(settings)
-    llm = get_llm_from_lmstudio(settings)
+    Returns:
+        RagComponents: The freshly built components.
+    """
+    # 1) Componenti (le chiamate LLM registrano la latenza dello stadio "generate")
+    timings = StageTimings()
+    embeddings = embeddings if embeddings is not None else get_embeddings(settings)
+    llm = (llm if llm is not None else get_llm_from_lmstudio(settings)).with_config(
+        callbacks=[timings.llm_callback()]
+    )
 
-    # 2) Dati simulati e indicizzazione (load or build)
-    docs = simulate_corpus()
-    # loader = DirectoryLoader("db", glob="**/*.md")
-    # docs = loader.load()
+    # 2) Corpus (file markdown letti uno alla volta, o dati simulati) e indicizzazione
+    if settings.docs_dir:
+        docs = DirectorySource(settings.docs_dir, settings.docs_glob)
+    else:
+        docs = simulate_corpus()
     vector_store = load_or_build_vectorstore(settings, embeddings, docs)
 
     # 3) Retriever ottimizzato
-    retriever = make_retriever(vector_store, settings)
+    retriever = make_retriever(vector_store, settings, timings)
 
     # 4) Catena RAG
-    chain = build_rag_chain(llm, retriever)
+    chain = build_rag_chain(llm, retriever, settings.context_max_tokens, timings)
 
-    return chain
+    # 5) Cache semantica (opzionale), invalidata quando cambia l'indice
+    answer_cache = None
+    if settings.semantic_cache:
+        answer_cache = SemanticAnswerCache(
+            embeddings,
+            threshold=settings.semantic_cache_threshold,
+            ttl_seconds=settings.semantic_cache_ttl,
+            max_entries=settings.semantic_cache_max_entries,
+            index_version=lambda: index_version(settings.persist_dir),
+        )
+
+    return RagComponents(
+        embeddings=embeddings,
+        llm=llm,
+        vector_store=vector_store,
+        retriever=retriever,
+        chain=chain,
+        answer_cache=answer_cache,
+        timings=timings,
+    )
+
+
+def setup(settings: Optional[Settings] = None):
+    """Create and return a ready-to-use RAG chain, bypassing the registry.
+
+    Args:
+        settings (Settings | None): Configuration; defaults to `SETTINGS`.
+
+    Returns:
+        Any: A chain that accepts a question and returns an answer string.
+
+    Examples:
+        >>> chain = setup()  # doctest: +SKIP
+        >>> isinstance(chain, object)  # doctest: +SKIP
+        True
+    """
+    return build_components(settings or SETTINGS).chain
 
     # ans = rag_answer(q, chain)
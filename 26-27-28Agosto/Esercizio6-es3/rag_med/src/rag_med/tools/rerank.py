@@ -0,0 +1,152 @@
+"""Optional cross-encoder re-ranking between retrieval and prompt.
+
+The retriever fetches ``fetch_k`` candidates; `CrossEncoderReranker` scores
+every (question, chunk) pair with a local CPU cross-encoder and keeps the top
+``k``. The model is loaded once per process (`load_cross_encoder`) and the
+pairs of many questions are scored in one batched call (`rerank_batch`).
+
+Requires the optional ``sentence-transformers`` dependency
+(``pip install "rag_med[rerank]"``).
+"""
+from __future__ import annotations
+
+import threading
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from rag_med.tools.timings import StageTimings
+
+# Cross-encoder multilingue (addestrato su mMARCO), adatto al corpus in italiano
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+@lru_cache(maxsize=None)
+def load_cross_encoder(model_name: str = DEFAULT_RERANK_MODEL, max_length: int = 512):
+    """Load a sentence-transformers ``CrossEncoder`` on CPU, once per process.
+
+    Args:
+        model_name (str): Hugging Face model id.
+        max_length (int): Maximum tokens per (question, chunk) pair.
+
+    Returns:
+        CrossEncoder: The loaded model.
+
+    Raises:
+        ImportError: If sentence-transformers is not installed.
+    """
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError as exc:
+        raise ImportError(
+            "Il re-ranking richiede sentence-transformers: pip install \"rag_med[rerank]\""
+        ) from exc
+    return CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a cross-encoder and keeps the best.
+
+    Args:
+        model_name (str): Cross-encoder to load on first use.
+        batch_size (int): Pairs per forward pass.
+        model (Any | None): Preloaded model exposing
+            ``predict(pairs, batch_size=...)``; skips `load_cross_encoder`.
+
+    Examples:
+        >>> class _Overlap:
+        ...     def predict(self, pairs, batch_size=32):
+        ...         return [len(set(q.split()) & set(t.split())) for q, t in pairs]
+        >>> reranker = CrossEncoderReranker(model=_Overlap())
+        >>> docs = [Document(page_content=t) for t in ("gatto nero", "cane nero", "cane bianco")]
+        >>> [d.page_content for d in reranker.rerank("cane bianco", docs, k=2)]
+        ['cane bianco', 'cane nero']
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        batch_size: int = 32,
+        model: Optional[Any] = None,
+    ) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = model
+        # Un solo forward pass alla volta: i batch di piu' thread non si contendono la CPU
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> Any:
+        if self._model is None:
+            self._model = load_cross_encoder(self.model_name)
+        return self._model
+
+    def rerank_batch(
+        self, queries: Sequence[str], candidates: Sequence[List[Document]], k: int
+    ) -> List[List[Document]]:
+        """Re-rank the candidates of many queries with one batched model call.
+
+        Args:
+            queries (Sequence[str]): Questions.
+            candidates (Sequence[List[Document]]): Retrieved candidates per question.
+            k (int): Documents kept per question.
+
+        Returns:
+            List[List[Document]]: Top `k` documents per question, best first.
+        """
+        pairs = [(q, d.page_content) for q, docs in zip(queries, candidates) for d in docs]
+        if not pairs:
+            return [[] for _ in queries]
+        with self._lock:
+            scores = np.asarray(self.model.predict(pairs, batch_size=self.batch_size), dtype=np.float32)
+
+        results, offset = [], 0
+        for docs in candidates:
+            row = scores[offset:offset + len(docs)]
+            offset += len(docs)
+            order = np.argsort(-row, kind="stable")[:k]
+            results.append([docs[i] for i in order])
+        return results
+
+    def rerank(self, query: str, docs: List[Document], k: int) -> List[Document]:
+        """Re-rank the candidates of a single query.
+
+        Args:
+            query (str): Question.
+            docs (List[Document]): Retrieved candidates.
+            k (int): Documents kept.
+
+        Returns:
+            List[Document]: Top `k` documents, best first.
+        """
+        return self.rerank_batch([query], [docs], k)[0]
+
+
+class RerankingRetriever(BaseRetriever):
+    """Wraps a retriever returning ``fetch_k`` candidates and keeps the top ``k``.
+
+    Re-ranking time is recorded as the ``rerank`` stage of `timings`, if given;
+    time the first stage by passing a `TimedRetriever` as `base` (as
+    `make_retriever` does), so ``retrieve`` and ``rerank`` are reported apart.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    base: BaseRetriever
+    reranker: CrossEncoderReranker
+    k: int = 4
+    timings: Optional[StageTimings] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base.invoke(query)
+        if self.timings is None:
+            return self.reranker.rerank(query, candidates, self.k)
+        with self.timings.stage("rerank"):
+            return self.reranker.rerank(query, candidates, self.k)
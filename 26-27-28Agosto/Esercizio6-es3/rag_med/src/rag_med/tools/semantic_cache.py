@@ -0,0 +1,214 @@
+"""Semantic answer cache for the RAG chain.
+
+`SemanticAnswerCache` embeds each incoming question and looks it up in a small
+dedicated FAISS inner-product index of past questions. When the cosine
+similarity of the nearest one passes a threshold, its stored answer is
+returned without retrieval or generation. Entries expire after a TTL, the
+least recently used ones are evicted above a size cap, and the whole cache is
+dropped when the version of the underlying document index changes.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+@dataclass
+class CacheEntry:
+    """A cached answer.
+
+    Attributes:
+        question (str): Question the answer was generated for.
+        answer (str): Generated answer.
+        created_at (float): Creation time (``time.time()``).
+        latency (float): Seconds it took to produce the answer.
+    """
+    question: str
+    answer: str
+    created_at: float
+    latency: float
+
+
+class SemanticAnswerCache:
+    """Answer cache keyed by query-embedding similarity.
+
+    Args:
+        embeddings (Embeddings): Model used to embed questions.
+        threshold (float): Minimum cosine similarity for a hit.
+        ttl_seconds (float): Entry lifetime; ``0`` disables expiry.
+        max_entries (int): Maximum cached answers (LRU eviction).
+        index_version (Callable[[], str] | None): Returns the current version of
+            the document index; a change clears the cache.
+
+    Examples:
+        >>> class _Fake(Embeddings):
+        ...     def embed_documents(self, texts):
+        ...         return [self.embed_query(t) for t in texts]
+        ...     def embed_query(self, text):
+        ...         return [1.0, 0.0] if "faiss" in text.lower() else [0.0, 1.0]
+        >>> cache = SemanticAnswerCache(_Fake(), threshold=0.9)
+        >>> cache.get_or_compute("Cos'e' FAISS?", lambda: "una libreria")
+        'una libreria'
+        >>> cache.get_or_compute("cosa e' faiss", lambda: "mai chiamata")
+        'una libreria'
+        >>> cache.metrics()["hits"], cache.metrics()["misses"]
+        (1, 1)
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1000,
+        index_version: Optional[Callable[[], str]] = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version = index_version
+        self._version = index_version() if index_version else None
+        self._index: Optional[faiss.IndexIDMap2] = None
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray([self.embeddings.embed_query(question)], dtype=np.float32)
+        faiss.normalize_L2(vector)  # prodotto scalare su vettori normalizzati = coseno
+        return vector
+
+    def _check_version(self) -> None:
+        if self.index_version is None:
+            return
+        version = self.index_version()
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self) -> None:
+        self._index = None
+        self._entries.clear()
+
+    def _remove(self, entry_ids) -> None:
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        if self._index is not None and entry_ids:
+            self._index.remove_ids(np.asarray(entry_ids, dtype=np.int64))
+
+    def lookup(self, question: str, vector: Optional[np.ndarray] = None) -> Tuple[Optional[CacheEntry], np.ndarray]:
+        """Return the cached entry for a similar question, if any.
+
+        Args:
+            question (str): Incoming question.
+            vector (np.ndarray | None): Precomputed normalized embedding.
+
+        Returns:
+            Tuple[CacheEntry | None, np.ndarray]: The hit (or None) and the
+            normalized question embedding, reusable by `store`.
+        """
+        if vector is None:
+            vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            if self._index is None or self._index.ntotal == 0:
+                return None, vector
+            scores, ids = self._index.search(vector, 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            entry = self._entries.get(entry_id)
+            if entry is None or score < self.threshold:
+                return None, vector
+            if self.ttl_seconds and time.time() - entry.created_at > self.ttl_seconds:
+                self._remove([entry_id])
+                return None, vector
+            self._entries.move_to_end(entry_id)
+            return entry, vector
+
+    def store(self, question: str, answer: str, latency: float, vector: Optional[np.ndarray] = None) -> None:
+        """Add an answer to the cache, evicting the least recently used entries.
+
+        Args:
+            question (str): Question the answer belongs to.
+            answer (str): Generated answer.
+            latency (float): Seconds it took to produce the answer.
+            vector (np.ndarray | None): Normalized embedding from `lookup`.
+        """
+        if vector is None:
+            vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+            self._entries[entry_id] = CacheEntry(question, answer, time.time(), latency)
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow])
+
+    def get_or_compute(self, question: str, compute: Callable[[], str]) -> str:
+        """Return a cached answer or compute, cache and return a new one.
+
+        Args:
+            question (str): Incoming question.
+            compute (Callable[[], str]): Produces the answer on a miss.
+
+        Returns:
+            str: The answer.
+        """
+        entry, vector = self.lookup(question)
+        if entry is not None:
+            self.record_hit(entry)
+            return entry.answer
+
+        start = time.perf_counter()
+        answer = compute()
+        latency = time.perf_counter() - start
+        self.store(question, answer, latency, vector)
+        self.record_miss()
+        return answer
+
+    def record_hit(self, entry: CacheEntry) -> None:
+        """Count a hit served from `entry` (for callers using `lookup` directly)."""
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += entry.latency
+
+    def record_miss(self) -> None:
+        """Count a miss (for callers using `lookup` directly)."""
+        with self._lock:
+            self.misses += 1
+
+    def invalidate(self) -> None:
+        """Drop every cached answer."""
+        with self._lock:
+            self._clear()
+
+    def metrics(self) -> Dict[str, float]:
+        """Return hit rate and saved latency.
+
+        Returns:
+            Dict[str, float]: ``hits``, ``misses``, ``hit_rate``,
+            ``saved_seconds`` (generation time avoided) and ``size``.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,335 @@
+"""Structure-aware, streaming splitter for markdown corpora.
+
+`MarkdownTokenSplitter` consumes documents one at a time (e.g. from
+`iter_directory_documents`, a lazy `DirectoryLoader`), cuts them on markdown
+headings, and packs paragraphs and sentences into chunks bounded by a token
+count rather than characters. Identical chunks within a source are dropped
+by hash, and
+`SplitStats` reports the amplification ratio (chunk chars / source chars) so
+chunk size and overlap can be tuned.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from langchain.schema import Document
+from langchain_community.document_loaders import DirectoryLoader, TextLoader
+
+from rag_med.tools.embedding_cache import normalize_text
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # tiktoken assente o vocabolario non scaricabile (offline)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the ``cl100k_base`` encoding used by the Azure models.
+
+    Without tiktoken (or its vocabulary file) words and punctuation marks are
+    counted instead, a close approximation for Italian and English prose.
+
+    Args:
+        text (str): Text to measure.
+
+    Returns:
+        int: Number of tokens.
+
+    Examples:
+        >>> count_tokens("")
+        0
+        >>> count_tokens("ciao mondo") > 0
+        True
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(_APPROX_TOKEN_RE.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@dataclass
+class SplitStats:
+    """Counters collected while splitting.
+
+    Attributes:
+        documents (int): Source documents read.
+        source_chars (int): Characters in the source documents.
+        chunks (int): Chunks emitted.
+        chunk_chars (int): Characters in the emitted chunks.
+        duplicates (int): Chunks dropped as exact duplicates.
+
+    Examples:
+        >>> SplitStats(documents=1, source_chars=100, chunks=2, chunk_chars=170).amplification
+        1.7
+    """
+    documents: int = 0
+    source_chars: int = 0
+    chunks: int = 0
+    chunk_chars: int = 0
+    duplicates: int = 0
+
+    @property
+    def amplification(self) -> float:
+        """Chunk chars / source chars; 1.0 means no text is duplicated."""
+        return round(self.chunk_chars / self.source_chars, 3) if self.source_chars else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        """Return the counters together with the amplification ratio."""
+        return dict(asdict(self), amplification=self.amplification)
+
+
+def iter_directory_documents(path: str, glob: str = "**/*.md") -> Iterator[Document]:
+    """Yield the files under `path` one at a time as documents.
+
+    Args:
+        path (str): Corpus directory.
+        glob (str): Files to load.
+
+    Yields:
+        Document: One document per file, with ``source`` metadata.
+    """
+    loader = DirectoryLoader(
+        path, glob=glob, loader_cls=TextLoader, loader_kwargs={"encoding": "utf-8"}
+    )
+    yield from loader.lazy_load()
+
+
+class DirectorySource:
+    """Re-readable corpus directory that can also list and stat its files.
+
+    Calling the object yields every file as a document, like
+    `iter_directory_documents`. `stat` and `load` let the index loader
+    compare file sizes and modification times with its manifest and read
+    only the files that changed.
+
+    Args:
+        path (str): Corpus directory.
+        glob (str): Files to load.
+
+    Examples:
+        >>> import tempfile
+        >>> root = tempfile.mkdtemp()
+        >>> _ = Path(root, "a.md").write_text("# A", encoding="utf-8")
+        >>> _ = Path(root, ".b.md").write_text("# B", encoding="utf-8")
+        >>> source = DirectorySource(root, "*.md")
+        >>> [Path(p).name for p in source.paths()]
+        ['a.md']
+        >>> [d.page_content for d in source.load(source.paths())]
+        ['# A']
+    """
+
+    def __init__(self, path: str, glob: str = "**/*.md") -> None:
+        self.path = path
+        self.glob = glob
+
+    def __call__(self) -> Iterator[Document]:
+        return iter_directory_documents(self.path, self.glob)
+
+    def paths(self) -> List[str]:
+        """Return the files `DirectoryLoader` would load, as ``source`` strings."""
+        root = Path(self.path)
+        return sorted(
+            str(p) for p in root.glob(self.glob)
+            # stessi file del DirectoryLoader: niente file nascosti
+            if p.is_file() and not any(part.startswith(".") for part in p.relative_to(root).parts)
+        )
+
+    def stat(self) -> Dict[str, List[int]]:
+        """Return ``source -> [mtime_ns, size]`` for every file, without reading them."""
+        result: Dict[str, List[int]] = {}
+        for path in self.paths():
+            st = os.stat(path)
+            result[path] = [st.st_mtime_ns, st.st_size]
+        return result
+
+    def load(self, paths: Iterable[str]) -> Iterator[Document]:
+        """Yield the documents of the given files only, skipping vanished ones."""
+        for path in sorted(paths):
+            if os.path.isfile(path):
+                yield from TextLoader(path, encoding="utf-8").lazy_load()
+
+
+def split_markdown_sections(text: str) -> Iterator[Tuple[List[str], str]]:
+    """Cut markdown on headings, ignoring ``#`` lines inside fenced code.
+
+    Args:
+        text (str): Markdown text.
+
+    Yields:
+        Tuple[List[str], str]: Heading path and text of each section, heading
+        lines included; headings with no text of their own are kept at the
+        top of the next section.
+
+    Examples:
+        >>> md = "intro\\n# A\\ntesto a\\n## B\\ntesto b"
+        >>> [(path, body.splitlines()[0]) for path, body in split_markdown_sections(md)]
+        [([], 'intro'), (['A'], '# A'), (['A', 'B'], '## B')]
+    """
+    headers: List[str] = []
+    path: List[str] = []
+    lines: List[str] = []
+    has_body = False
+    in_fence = False
+    for line in text.splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            # I titoli senza testo restano in testa alla sezione successiva
+            if has_body:
+                yield path, "\n".join(lines).strip()
+                lines, has_body = [], False
+            level = len(match.group(1))
+            headers = headers[:level - 1] + [match.group(2)]
+            path = list(headers)
+        elif line.strip():
+            has_body = True
+        lines.append(line)
+    if has_body:
+        yield path, "\n".join(lines).strip()
+
+
+class MarkdownTokenSplitter:
+    """Streaming splitter: markdown sections packed into token-bounded chunks.
+
+    Each section is split into paragraphs; paragraphs longer than
+    `chunk_tokens` are split into sentences, and sentences into words. Pieces
+    are packed greedily up to `chunk_tokens`, repeating at most
+    `chunk_overlap_tokens` of trailing pieces at the start of the next chunk
+    of the same section. Chunks whose normalized text was already emitted for
+    the same source document are dropped; identical chunks of different
+    sources are all kept, since the incremental index update (see
+    `load_or_build_vectorstore`) tracks chunks per source.
+
+    Args:
+        chunk_tokens (int): Maximum tokens per chunk.
+        chunk_overlap_tokens (int): Maximum tokens repeated between chunks.
+
+    Examples:
+        >>> md = "# Avvertenze\\nNon superare la dose.\\n\\n# Avvertenze\\nNon superare la dose."
+        >>> docs = [Document(page_content=md, metadata={"source": s}) for s in ("a.md", "b.md")]
+        >>> splitter = MarkdownTokenSplitter(chunk_tokens=50, chunk_overlap_tokens=0)
+        >>> [(c.metadata["source"], c.metadata["section"]) for c in splitter.split(docs)]
+        [('a.md', 'Avvertenze'), ('b.md', 'Avvertenze')]
+        >>> splitter.stats.chunks, splitter.stats.duplicates
+        (2, 2)
+    """
+
+    def __init__(self, chunk_tokens: int = 256, chunk_overlap_tokens: int = 32) -> None:
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap_tokens = min(chunk_overlap_tokens, chunk_tokens // 2)
+        self.stats = SplitStats()
+        self._seen: set = set()
+
+    def _pieces(self, section: str) -> Iterator[Tuple[str, str, int]]:
+        """Yield ``(text, separator, tokens)`` pieces no longer than the budget."""
+        for paragraph in re.split(r"\n\s*\n", section):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = count_tokens(paragraph)
+            if tokens <= self.chunk_tokens:
+                yield paragraph, "\n\n", tokens
+                continue
+            for sentence in _SENTENCE_RE.split(paragraph):
+                tokens = count_tokens(sentence)
+                if tokens <= self.chunk_tokens:
+                    yield sentence, " ", tokens
+                    continue
+                words = sentence.split()
+                step = max(1, len(words) * self.chunk_tokens // tokens)
+                for start in range(0, len(words), step):
+                    part = " ".join(words[start:start + step])
+                    yield part, " ", count_tokens(part)
+
+    def _pack(self, section: str) -> Iterator[str]:
+        window: List[Tuple[str, str, int]] = []
+        size = 0
+        for piece in self._pieces(section):
+            if window and size + piece[2] > self.chunk_tokens:
+                yield self._join(window)
+                overlap: List[Tuple[str, str, int]] = []
+                kept = 0
+                for prev in reversed(window[1:]):
+                    if kept + prev[2] > self.chunk_overlap_tokens:
+                        break
+                    overlap.insert(0, prev)
+                    kept += prev[2]
+                if kept + piece[2] > self.chunk_tokens:
+                    overlap, kept = [], 0
+                window, size = overlap, kept
+            window.append(piece)
+            size += piece[2]
+        if window:
+            yield self._join(window)
+
+    @staticmethod
+    def _join(window: List[Tuple[str, str, int]]) -> str:
+        text = window[0][0]
+        for piece, sep, _ in window[1:]:
+            text += sep + piece
+        return text
+
+    def split(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Split `docs` lazily, one source document at a time.
+
+        Args:
+            docs (Iterable[Document]): Source documents; may be a generator.
+
+        Yields:
+            Document: Chunks with the source metadata plus ``section`` (the
+            heading path, joined with " > ").
+        """
+        for doc in docs:
+            # Deduplica per sorgente: il manifest incrementale traccia i chunk per sorgente
+            self._seen.clear()
+            self.stats.documents += 1
+            self.stats.source_chars += len(doc.page_content)
+            for path, section in split_markdown_sections(doc.page_content):
+                for text in self._pack(section):
+                    key = hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+                    if key in self._seen:
+                        self.stats.duplicates += 1
+                        continue
+                    self._seen.add(key)
+                    self.stats.chunks += 1
+                    self.stats.chunk_chars += len(text)
+                    metadata = dict(doc.metadata)
+                    if path:
+                        metadata["section"] = " > ".join(path)
+                    yield Document(page_content=text, metadata=metadata)
+
+
+def measure_split(docs: List[Document], chunks: List[Document]) -> SplitStats:
+    """Return `SplitStats` for an already completed split.
+
+    Args:
+        docs (List[Document]): Source documents.
+        chunks (List[Document]): Chunks produced from them.
+
+    Returns:
+        SplitStats: Counters (no duplicates are tracked).
+    """
+    return SplitStats(
+        documents=len(docs),
+        source_chars=sum(len(d.page_content) for d in docs),
+        chunks=len(chunks),
+        chunk_chars=sum(len(c.page_content) for c in chunks),
+    )
@@ -0,0 +1,318 @@
+"""Multi-tenant manager of persisted RAG indexes with bounded residency.
+
+`TenantIndexManager` maps tenant ids to one persisted index each and loads the
+RAG components of a tenant on first use. Loaded tenants are kept in LRU order;
+when their estimated resident size exceeds ``max_resident_bytes`` (or their
+number exceeds ``max_tenants``) the least recently used ones are dropped, so
+one worker process can serve many corpora with a bounded memory footprint.
+Dropped tenants have their docstore closed, and tenants whose settings agree
+on the client configuration share one embeddings client and one chat model.
+
+Layout of ``root_dir``::
+
+    embedding_cache.sqlite   embeddings cache shared by the derived tenants
+    <tenant_id>/             index.faiss, docstore.sqlite, manifest.json, ...
+"""
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rag_med.tools import rag_faiss_lmstudio
+from rag_med.tools.embedding_cache import EMBEDDING_CACHE_FILE
+from rag_med.tools.persistence import close_vectorstore
+from rag_med.tools.rag_faiss_lmstudio import RagComponents, Settings
+
+# Id ammessi: niente separatori di percorso ne' ".." (evita path traversal)
+_TENANT_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+# Artefatti caricati in RAM (o mappati) da un indice; il docstore SQLite e' letto su richiesta
+RESIDENT_ARTIFACTS = ("index.faiss", "bm25.npz")
+
+
+def resident_bytes(persist_dir: str) -> int:
+    """Estimate the memory held by a loaded index from its artifact sizes.
+
+    The FAISS index is memory-mapped, so this is an upper bound on the pages
+    it can keep resident; documents stay in SQLite and are not counted.
+
+    Args:
+        persist_dir (str): Directory holding the FAISS artifacts.
+
+    Returns:
+        int: Estimated bytes (0 if nothing is persisted yet).
+    """
+    total = 0
+    for name in RESIDENT_ARTIFACTS:
+        path = Path(persist_dir) / name
+        if path.is_file():
+            total += path.stat().st_size
+    return total
+
+
+@dataclass
+class _Tenant:
+    settings: Settings
+    components: RagComponents
+    index_signature: Tuple
+    size_bytes: int
+
+
+class TenantIndexManager:
+    """Lazy, LRU-bounded cache of per-tenant RAG components.
+
+    Each tenant gets a copy of `base_settings` whose ``persist_dir`` is
+    ``root_dir/<tenant_id>`` (and ``docs_dir`` is ``docs_root/<tenant_id>``
+    when `docs_root` is given); `register` overrides the settings of a single
+    tenant. Lookups are thread-safe: concurrent first requests for the same
+    tenant build it once, and requests for different tenants do not block each
+    other. An entry is reloaded when its index changes on disk.
+
+    The SQLite docstore of an evicted or invalidated tenant is closed right
+    away; a caller still holding its components reopens it on the next read
+    (see `rag_med.tools.persistence.SQLiteDocstore`). With the default
+    factory, embeddings and chat clients are shared by every tenant with the
+    same client configuration (`embeddings_client_key`, `llm_client_key`);
+    derived tenants also share one embeddings cache in `root_dir`. Call
+    `close` (or use the manager as a context manager) to unregister it from
+    index change notifications and release every store and client.
+
+    Args:
+        root_dir (str): Directory containing one index directory per tenant.
+        max_resident_bytes (int): Memory ceiling for loaded indexes (see
+            `resident_bytes`). The most recently used tenant is always kept.
+        max_tenants (int | None): Optional cap on loaded tenants (each holds
+            an open SQLite connection).
+        base_settings (Settings | None): Template settings; defaults to `SETTINGS`.
+        docs_root (str | None): Directory containing one corpus per tenant.
+        build (Callable[[Settings], RagComponents] | None): Component factory;
+            defaults to `build_components` with shared clients.
+
+    Examples:
+        >>> manager = TenantIndexManager("/tmp/tenants", max_tenants=2, build=lambda s: s.persist_dir)
+        >>> for tenant in ("asl-to", "asl-mi", "asl-to", "asl-rm"):
+        ...     _ = manager.get(tenant)
+        >>> manager.loaded()
+        ['asl-to', 'asl-rm']
+        >>> manager.stats()["evictions"]
+        1
+        >>> manager.get("../etc")
+        Traceback (most recent call last):
+        ...
+        ValueError: tenant_id non valido: '../etc'
+        >>> manager.close()
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        max_resident_bytes: int = 2 * 1024 ** 3,
+        max_tenants: Optional[int] = None,
+        base_settings: Optional[Settings] = None,
+        docs_root: Optional[str] = None,
+        build: Optional[Callable[[Settings], RagComponents]] = None,
+    ) -> None:
+        self.root_dir = Path(root_dir)
+        self.max_resident_bytes = max_resident_bytes
+        self.max_tenants = max_tenants
+        self.base_settings = base_settings or rag_faiss_lmstudio.SETTINGS
+        self.docs_root = Path(docs_root) if docs_root else None
+        self._build = build or self._build_with_shared_clients
+        self._clients: Dict[Tuple, Any] = {}
+        self._overrides: Dict[str, Settings] = {}
+        self._tenants: "OrderedDict[str, _Tenant]" = OrderedDict()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+        rag_faiss_lmstudio.register_index_listener(self._on_index_changed)
+
+    def register(self, tenant_id: str, settings: Settings) -> None:
+        """Use `settings` for `tenant_id` instead of the derived ones.
+
+        Args:
+            tenant_id (str): Tenant id.
+            settings (Settings): Complete configuration of the tenant.
+        """
+        _check_tenant_id(tenant_id)
+        with self._lock:
+            self._overrides[tenant_id] = settings
+            self._drop(tenant_id)
+
+    def tenant_settings(self, tenant_id: str) -> Settings:
+        """Return the settings used for `tenant_id`.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            Settings: Registered settings, or `base_settings` pointed at the
+            tenant's directories.
+
+        Raises:
+            ValueError: If `tenant_id` is not a safe directory name.
+        """
+        _check_tenant_id(tenant_id)
+        with self._lock:
+            if tenant_id in self._overrides:
+                return self._overrides[tenant_id]
+        docs_dir = str(self.docs_root / tenant_id) if self.docs_root else self.base_settings.docs_dir
+        cache_path = self.base_settings.embedding_cache_path or str(self.root_dir / EMBEDDING_CACHE_FILE)
+        return replace(
+            self.base_settings,
+            persist_dir=str(self.root_dir / tenant_id),
+            docs_dir=docs_dir,
+            embedding_cache_path=cache_path,
+        )
+
+    def _shared_client(self, key: Tuple, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    def _build_with_shared_clients(self, settings: Settings) -> RagComponents:
+        embeddings = self._shared_client(
+            ("embeddings",) + rag_faiss_lmstudio.embeddings_client_key(settings),
+            lambda: rag_faiss_lmstudio.get_embeddings(settings),
+        )
+        llm = self._shared_client(
+            ("llm",) + rag_faiss_lmstudio.llm_client_key(settings),
+            lambda: rag_faiss_lmstudio.get_llm_from_lmstudio(settings),
+        )
+        return rag_faiss_lmstudio.build_components(settings, embeddings=embeddings, llm=llm)
+
+    def _drop(self, tenant_id: str) -> bool:
+        """Remove a loaded tenant and close its store; caller holds the lock."""
+        tenant = self._tenants.pop(tenant_id, None)
+        if tenant is None:
+            return False
+        close_vectorstore(getattr(tenant.components, "vector_store", None))
+        return True
+
+    def _lookup(self, tenant_id: str) -> Optional[RagComponents]:
+        """Return the cached components if still current; caller holds the lock."""
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            return None
+        if tenant.index_signature != rag_faiss_lmstudio.index_signature(tenant.settings.persist_dir):
+            self._drop(tenant_id)
+            return None
+        self._tenants.move_to_end(tenant_id)
+        return tenant.components
+
+    def get(self, tenant_id: str) -> RagComponents:
+        """Return the RAG components of `tenant_id`, loading them if needed.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            RagComponents: The tenant's components.
+
+        Raises:
+            ValueError: If `tenant_id` is not a safe directory name.
+        """
+        settings = self.tenant_settings(tenant_id)
+        with self._lock:
+            components = self._lookup(tenant_id)
+            if components is not None:
+                self._hits += 1
+                return components
+            key_lock = self._key_locks.setdefault(tenant_id, threading.Lock())
+
+        # Un lock per tenant: il caricamento di un corpus non blocca gli altri
+        with key_lock:
+            with self._lock:
+                components = self._lookup(tenant_id)
+                if components is not None:
+                    self._hits += 1
+                    return components
+                self._misses += 1
+
+            components = self._build(settings)
+
+            with self._lock:
+                self._tenants[tenant_id] = _Tenant(
+                    settings=settings,
+                    components=components,
+                    index_signature=rag_faiss_lmstudio.index_signature(settings.persist_dir),
+                    size_bytes=resident_bytes(settings.persist_dir),
+                )
+                self._evict_over_budget()
+            return components
+
+    def _evict_over_budget(self) -> None:
+        """Drop LRU tenants above the limits, keeping the newest; caller holds the lock."""
+        while len(self._tenants) > 1 and (
+            self.resident_bytes > self.max_resident_bytes
+            or (self.max_tenants is not None and len(self._tenants) > self.max_tenants)
+        ):
+            self._drop(next(iter(self._tenants)))
+            self._evictions += 1
+
+    def evict(self, tenant_id: str) -> bool:
+        """Drop the loaded components of `tenant_id`.
+
+        Args:
+            tenant_id (str): Tenant id.
+
+        Returns:
+            bool: Whether the tenant was loaded.
+        """
+        with self._lock:
+            return self._drop(tenant_id)
+
+    def _on_index_changed(self, persist_dir: str) -> None:
+        with self._lock:
+            for tenant_id, tenant in list(self._tenants.items()):
+                if rag_faiss_lmstudio.same_dir(tenant.settings.persist_dir, persist_dir):
+                    self._drop(tenant_id)
+
+    def close(self) -> None:
+        """Stop listening for index changes and release every store and shared client."""
+        rag_faiss_lmstudio.unregister_index_listener(self._on_index_changed)
+        with self._lock:
+            for tenant_id in list(self._tenants):
+                self._drop(tenant_id)
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            # Solo i client con risorse proprie (es. la cache SQLite degli embedding)
+            if callable(getattr(client, "close", None)):
+                client.close()
+
+    def __enter__(self) -> "TenantIndexManager":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @property
+    def resident_bytes(self) -> int:
+        """Estimated bytes held by the loaded tenants."""
+        return sum(t.size_bytes for t in self._tenants.values())
+
+    def loaded(self) -> List[str]:
+        """Return the loaded tenant ids, least recently used first."""
+        with self._lock:
+            return list(self._tenants)
+
+    def stats(self) -> Dict[str, int]:
+        """Return residency and hit/miss/eviction counters."""
+        with self._lock:
+            return {
+                "tenants": len(self._tenants),
+                "resident_bytes": self.resident_bytes,
+                "max_resident_bytes": self.max_resident_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+def _check_tenant_id(tenant_id: str) -> None:
+    if not _TENANT_ID_RE.match(tenant_id) or ".." in tenant_id:
+        raise ValueError(f"tenant_id non valido: {tenant_id!r}")
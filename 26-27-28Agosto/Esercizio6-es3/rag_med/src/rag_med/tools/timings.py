@@ -0,0 +1,141 @@
+"""Per-stage latency recording for the RAG pipeline.
+
+`StageTimings` keeps a bounded window of samples per stage (``retrieve``,
+``rerank``, ``generate``, ...) and summarizes them as mean/p50/p95. Stages are
+timed with the `StageTimings.stage` context manager; LLM calls are timed with
+a LangChain callback (`StageTimings.llm_callback`), which also works while
+streaming, and retrievers with the `TimedRetriever` wrapper. Per-query
+quantities other than latency (e.g. ``context_tokens``, the size of the
+packed prompt context) are kept with `StageTimings.record_value`.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from uuid import UUID
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+
+class StageTimings:
+    """Thread-safe latency samples per pipeline stage.
+
+    Args:
+        window (int): Samples kept per stage.
+
+    Examples:
+        >>> timings = StageTimings()
+        >>> timings.record("retrieve", 0.010); timings.record("retrieve", 0.030)
+        >>> timings.summary()["retrieve"]["count"], timings.summary()["retrieve"]["mean_ms"]
+        (2, 20.0)
+        >>> timings.record_value("context_tokens", 800); timings.record_value("context_tokens", 1200)
+        >>> timings.value_summary()["context_tokens"]["mean"]
+        1000.0
+    """
+
+    def __init__(self, window: int = 1000) -> None:
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self._values: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Add one latency sample for `stage`."""
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def record_value(self, name: str, value: float) -> None:
+        """Add one per-query sample of quantity `name` (not a latency)."""
+        with self._lock:
+            self._values[name].append(value)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as one sample of stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def llm_callback(self, stage: str = "generate") -> BaseCallbackHandler:
+        """Return a callback that records every LLM call as a sample of `stage`."""
+        return _LLMTimingHandler(self, stage)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return ``count``, ``mean_ms``, ``p50_ms`` and ``p95_ms`` per stage."""
+        with self._lock:
+            samples = {stage: np.asarray(values) * 1000 for stage, values in self._samples.items() if values}
+        return {
+            stage: {
+                "count": len(ms),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            }
+            for stage, ms in samples.items()
+        }
+
+    def value_summary(self) -> Dict[str, Dict[str, float]]:
+        """Return ``count``, ``mean``, ``p50``, ``p95`` and ``max`` per recorded quantity."""
+        with self._lock:
+            samples = {name: np.asarray(values, dtype=float) for name, values in self._values.items() if values}
+        return {
+            name: {
+                "count": len(v),
+                "mean": round(float(v.mean()), 3),
+                "p50": round(float(np.percentile(v, 50)), 3),
+                "p95": round(float(np.percentile(v, 95)), 3),
+                "max": float(v.max()),
+            }
+            for name, v in samples.items()
+        }
+
+
+class TimedRetriever(BaseRetriever):
+    """Wraps a retriever and records each call as a sample of `stage`.
+
+    Keyword arguments of ``invoke`` (per-query overrides such as ``nprobe``)
+    are passed through to `base`.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    base: BaseRetriever
+    timings: StageTimings
+    stage: str = "retrieve"
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> List[Document]:
+        with self.timings.stage(self.stage):
+            return self.base.invoke(query, **kwargs)
+
+
+class _LLMTimingHandler(BaseCallbackHandler):
+    """Records the wall time between LLM start and end events."""
+
+    def __init__(self, timings: StageTimings, stage: str) -> None:
+        self.timings = timings
+        self.stage = stage
+        self._starts: Dict[UUID, float] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            self.timings.record(self.stage, time.perf_counter() - start)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._starts.pop(run_id, None)